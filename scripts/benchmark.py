@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import importlib
+import subprocess
+from datetime import datetime
+import yaml
+from utils.synthetic_pdf import generate_synthetic_pdfs
+from utils.mock_openai_server import start_mock_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stages from the PDFs to a validated combined_data.jsonl for each output_format: the YAML files are converted
+# by build_training_data, and process_pdf writes JSONL itself for combine_jsonl_files when output_format is "jsonl".
+# upload_and_fine_tune runs last and only when asked for.
+PIPELINE_SCRIPTS = {
+    'yaml': ['process_pdf', 'build_training_data', 'validate_dataset'],
+    'jsonl': ['process_pdf', 'combine_jsonl_files', 'validate_dataset'],
+}
+
+def git_commit():
+    """Returns the commit the benchmark ran on, marked dirty if the tree has local changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def write_benchmark_config(work_dir, base_url, overrides):
+    """
+    Writes config/config.yaml and config/secrets.yaml for a benchmark run into work_dir.
+
+    The repo's config.yaml is the starting point, so the benchmark measures the settings you actually use.
+    """
+    with open(os.path.join(REPO_ROOT, 'config', 'config.yaml'), 'r') as config_file:
+        config = yaml.safe_load(config_file)
+    config.update(overrides)
+    config['pdf_directory'] = os.path.join(work_dir, 'datasheets')
+    # The scripts read the prompt sets from the repo; fall back to the first list there if the selected one is missing
+    prompt_sets_module = importlib.import_module('config.prompt_sets')
+    if not isinstance(getattr(prompt_sets_module, str(config.get('selected_prompt_set_list')), None), list):
+        available = [name for name, value in vars(prompt_sets_module).items() if not name.startswith('_') and isinstance(value, list)]
+        print(f"config/prompt_sets.py has no prompt set list {config.get('selected_prompt_set_list')!r}; benchmarking {available[0]!r}")
+        config['selected_prompt_set_list'] = available[0]
+
+    os.makedirs(os.path.join(work_dir, 'config'), exist_ok=True)
+    with open(os.path.join(work_dir, 'config', 'config.yaml'), 'w') as config_file:
+        yaml.safe_dump(config, config_file, sort_keys=False)
+    with open(os.path.join(work_dir, 'config', 'secrets.yaml'), 'w') as secrets_file:
+        yaml.safe_dump({'api_key': 'benchmark', 'base_url': base_url}, secrets_file)
+    return config
+
+def run_stage(script_name, work_dir, log_file):
+    """
+    Runs one pipeline script in work_dir and measures it.
+
+    :return: Dict with the wall time, CPU time, peak RSS and exit code of the script.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_ROOT, env.get('PYTHONPATH')]))
+    log_file.write(f"\n===== {script_name} =====\n")
+    log_file.flush()
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'scripts', f"{script_name}.py")],
+                               cwd=work_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    if not hasattr(os, 'wait4'):
+        # Windows has no per-child resource usage, so only the wall time is measured there
+        process.wait()
+        return {'wall_seconds': round(time.perf_counter() - start, 3), 'cpu_seconds': None, 'peak_rss_mb': None, 'exit_code': process.returncode}
+    # wait4 reports the resource usage of this child alone, unlike RUSAGE_CHILDREN
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return {
+        'wall_seconds': round(wall, 3),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'exit_code': process.returncode,
+    }
+
+def load_stage_metrics(metrics_dir, script_name):
+    """Returns the totals a script exported through utils.metrics, or None if it exported none."""
+    trace_path = os.path.join(metrics_dir, f"{script_name}_trace.json")
+    if not os.path.exists(trace_path):
+        return None
+    with open(trace_path, 'r') as trace_file:
+        return json.load(trace_file).get('metrics')
+
+def parse_failure_rate(metrics):
+    """Returns the fraction of fresh responses process_pdf could not parse, or None if it parsed none."""
+    counters = (metrics or {}).get('counters', {})
+    total = counters.get('responses_parsed', 0) + counters.get('response_parse_failures', 0)
+    return round(counters.get('response_parse_failures', 0) / total, 4) if total else None
+
+def prompt_cache_ratio(metrics):
+    """Returns the fraction of process_pdf's prompt tokens served from the prompt cache, or None without requests."""
+    totals = (metrics or {}).get('requests', {}).get('chat_completion')
+    return round(totals['cached_tokens'] / totals['prompt_tokens'], 4) if totals and totals['prompt_tokens'] else None
+
+def run_benchmark(pdf_count=5, pages_per_pdf=20, words_per_page=300, duplicate_fraction=0.0, latency_ms=200, error_rate=0.0,
+                  config_overrides=None, include_upload=False, keep=False, seed=0, malformed_rate=0.0, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Runs every pipeline stage on synthetic datasheets against a local mock model server.
+
+    :return: Result dict with the parameters, per-stage measurements and throughput figures.
+    """
+    work_dir = tempfile.mkdtemp(prefix='etl_benchmark_')
+    server, base_url = start_mock_server(latency_ms, error_rate, seed, malformed_rate=malformed_rate,
+                                         requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+    try:
+        pdf_dir = os.path.join(work_dir, 'datasheets')
+        generate_synthetic_pdfs(pdf_dir, pdf_count, pages_per_pdf, words_per_page, duplicate_fraction, seed)
+        config = write_benchmark_config(work_dir, base_url, config_overrides or {})
+
+        output_format = config.get('output_format', 'yaml')
+        scripts = PIPELINE_SCRIPTS[output_format] + (['upload_and_fine_tune'] if include_upload else [])
+        stages = {}
+        with open(os.path.join(work_dir, 'benchmark.log'), 'w') as log_file:
+            for script_name in scripts:
+                print(f"Running {script_name}...")
+                stages[script_name] = run_stage(script_name, work_dir, log_file)
+                stages[script_name]['metrics'] = load_stage_metrics(os.path.join(pdf_dir, 'metrics'), script_name)
+                peak_rss_mb = stages[script_name]['peak_rss_mb']
+                print(f"    {stages[script_name]['wall_seconds']}s" + (f", peak RSS {peak_rss_mb} MB" if peak_rss_mb is not None else ""))
+                if stages[script_name]['exit_code'] != 0:
+                    print(f"{script_name} exited with code {stages[script_name]['exit_code']}; see {log_file.name}")
+                    keep = True
+                    break
+
+        pages = pdf_count * pages_per_pdf
+        completed = len(stages) == len(scripts) and all(stage['exit_code'] == 0 for stage in stages.values())
+        # Throughput is meaningless if process_pdf crashed part way through
+        process_seconds = stages['process_pdf']['wall_seconds'] if stages['process_pdf']['exit_code'] == 0 else None
+        counts = dict(server.state['counts'])
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': {
+                'pdf_count': pdf_count, 'pages_per_pdf': pages_per_pdf, 'words_per_page': words_per_page,
+                'duplicate_fraction': duplicate_fraction, 'latency_ms': latency_ms, 'error_rate': error_rate,
+                'malformed_rate': malformed_rate, 'requests_per_minute': requests_per_minute, 'tokens_per_minute': tokens_per_minute,
+                'seed': seed, 'execution_mode': config.get('execution_mode', 'sync'),
+                'output_format': output_format, 'config_overrides': config_overrides or {},
+            },
+            'completed': completed,
+            'pages': pages,
+            'pages_per_second': round(pages / process_seconds, 2) if process_seconds else None,
+            'requests_per_second': round(counts['chat_completions'] / process_seconds, 2) if process_seconds else None,
+            'parse_failure_rate': parse_failure_rate(stages['process_pdf']['metrics']),
+            'prompt_cache_ratio': prompt_cache_ratio(stages['process_pdf']['metrics']),
+            'server_counts': counts,
+            'total_wall_seconds': round(sum(stage['wall_seconds'] for stage in stages.values()), 3),
+            'peak_rss_mb': max((stage['peak_rss_mb'] for stage in stages.values() if stage['peak_rss_mb'] is not None), default=None),
+            'stages': stages,
+            'work_dir': work_dir if keep else None,
+        }
+    finally:
+        server.shutdown()
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare_results(previous, current):
+    """Prints how the stage times of the current run differ from a previous run."""
+    print(f"Compared with {previous['commit']} ({previous['timestamp']}):")
+    if previous['parameters'] != current['parameters']:
+        print("    Warning: the runs used different parameters")
+    for stage, result in current['stages'].items():
+        before = previous['stages'].get(stage)
+        if not before or not before['wall_seconds']:
+            continue
+        change = (result['wall_seconds'] - before['wall_seconds']) / before['wall_seconds'] * 100
+        print(f"    {stage}: {before['wall_seconds']}s -> {result['wall_seconds']}s ({change:+.1f}%)")
+    for key in ('pages_per_second', 'requests_per_second', 'parse_failure_rate', 'prompt_cache_ratio', 'total_wall_seconds', 'peak_rss_mb'):
+        print(f"    {key}: {previous.get(key)} -> {current.get(key)}")
+
+def parse_override(text):
+    """Parses a --set key=value argument, reading the value as YAML (so 8, true and null work)."""
+    key, _, value = text.partition('=')
+    return key, yaml.safe_load(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic datasheets against a mock model server.")
+    parser.add_argument('--pdfs', type=int, default=5, help="Number of synthetic PDF files")
+    parser.add_argument('--pages', type=int, default=20, help="Pages per PDF")
+    parser.add_argument('--words-per-page', type=int, default=300, help="Text density of each page")
+    parser.add_argument('--duplicate-fraction', type=float, default=0.0, help="Fraction of pages repeating an earlier page")
+    parser.add_argument('--latency-ms', type=float, default=200, help="Mean latency of the mock chat completions")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of chat completions, batch requests and upload parts that fail with a 500")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="Fraction of YAML replies that do not parse")
+    parser.add_argument('--rpm', type=int, help="Requests per minute the mock server allows before answering 429")
+    parser.add_argument('--tpm', type=int, help="Tokens per minute the mock server allows before answering 429")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help="Override a config.yaml setting, e.g. --set execution_mode=async")
+    parser.add_argument('--upload', action='store_true', help="Also run upload_and_fine_tune against the mock server")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary pdf_directory and log for inspection")
+    parser.add_argument('--output', help="Result file (defaults to benchmark_results/<commit>_<timestamp>.json)")
+    parser.add_argument('--compare', help="A previous result file to compare against")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.pdfs, args.pages, args.words_per_page, args.duplicate_fraction, args.latency_ms, args.error_rate,
+                           dict(parse_override(text) for text in args.set), args.upload, args.keep, args.seed, args.malformed_rate,
+                           args.rpm, args.tpm)
+
+    output_path = args.output or os.path.join(REPO_ROOT, 'benchmark_results', f"{result['commit']}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as output_file:
+        json.dump(result, output_file, indent=4)
+
+    if result['completed']:
+        print(f"{result['pages']} pages in {result['stages']['process_pdf']['wall_seconds']}s: "
+              f"{result['pages_per_second']} pages/s, {result['requests_per_second']} requests/s, peak RSS {result['peak_rss_mb']} MB")
+        print(f"End to end {result['total_wall_seconds']}s ({result['parameters']['output_format']} output), "
+              f"parse failure rate {result['parse_failure_rate']}")
+    else:
+        print("The benchmark did not complete; its measurements are partial")
+    print(f"Results saved to {output_path}")
+    if result['work_dir']:
+        print(f"Benchmark files kept in {result['work_dir']}")
+    if args.compare:
+        with open(args.compare, 'r') as previous_file:
+            compare_results(json.load(previous_file), result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import json
+import glob
+import argparse
+import yaml
+from utils.loader import load_config
+from utils.yaml_ingest import load_document, split_document_lines
+from scripts.yaml_to_json import clean_yaml_lines, thread_object_messages
+from scripts.json_to_jsonl import write_jsonl_line
+from utils.manifest import manifest_path, load_manifest, save_manifest, plan_incremental_update, record_output
+from utils.metrics import stage_timer, increment, export_metrics, profiled, profile_path
+
+def iter_yaml_file_documents(yaml_file_path, cleaned_file=None):
+    """
+    Cleans and parses a raw YAML file one document at a time.
+
+    :param yaml_file_path: Path to the raw YAML file written by process_pdf.py.
+    :param cleaned_file: Optional open file that receives the cleaned YAML (debug mode).
+    :return: Generator of parsed documents. Empty documents after a '---' are None, as yaml.safe_load_all
+             returns them; unparseable documents are skipped.
+    """
+    with open(yaml_file_path, 'r') as yaml_file:
+        cleaned_lines = clean_yaml_lines(yaml_file)
+        if cleaned_file is not None:
+            cleaned_lines = _tee_lines(cleaned_lines, cleaned_file)
+
+        for document_num, document_lines in enumerate(split_document_lines(cleaned_lines)):
+            try:
+                data = load_document(''.join(document_lines))
+            except yaml.YAMLError as e:
+                print(f"Skipping document {document_num + 1} of {yaml_file_path}: {e}")
+                continue
+            # An empty implicit first document is no document at all to yaml.safe_load_all
+            if data is not None or document_num > 0:
+                yield data
+
+def _tee_lines(lines, output_file):
+    for line in lines:
+        output_file.write(line)
+        yield line
+
+def _write_json_array_item(item, json_file, is_first):
+    # Reproduces the layout of json.dump(data, indent=4) one item at a time
+    json_file.write('[\n' if is_first else ',\n')
+    json_file.write('\n'.join('    ' + line for line in json.dumps(item, indent=4).split('\n')))
+
+def write_training_examples(yaml_file_paths, output_file, debug_dirs=None):
+    """
+    Streams the documents of the given YAML files into an open JSONL file.
+
+    :return: Number of training examples written.
+    """
+    example_count = 0
+    for yaml_file_path in yaml_file_paths:
+        base_name = os.path.splitext(os.path.basename(yaml_file_path))[0]
+        debug_files = {}
+        try:
+            if debug_dirs:
+                debug_files['cleaned'] = open(os.path.join(debug_dirs['cleaned_yaml_directory'], f"{base_name}_cleaned.yaml"), 'w')
+                debug_files['json'] = open(os.path.join(debug_dirs['json_directory'], f"{base_name}.json"), 'w')
+                debug_files['jsonl'] = open(os.path.join(debug_dirs['jsonl_directory'], f"{base_name}.jsonl"), 'w', encoding='utf-8')
+
+            is_first = True
+            for data in iter_yaml_file_documents(yaml_file_path, debug_files.get('cleaned')):
+                # The intermediates hold the parsed documents, empty ones included, as yaml_to_json.py and json_to_jsonl.py write them
+                if debug_files:
+                    _write_json_array_item(data, debug_files['json'], is_first)
+                    write_jsonl_line(data, debug_files['jsonl'])
+                is_first = False
+                if data is None:
+                    continue
+                write_jsonl_line(thread_object_messages(data), output_file)
+                example_count += 1
+
+            if debug_files:
+                debug_files['json'].write('[]' if is_first else '\n]')
+        except Exception as e:
+            print(f"An error occurred while processing {yaml_file_path}: {e}")
+        finally:
+            for debug_file in debug_files.values():
+                debug_file.close()
+    return example_count
+
+def build_training_data(yaml_dir, combined_jsonl_dir, debug_dirs=None, manifest=None):
+    """
+    Streams every raw YAML file straight into combined_data.jsonl in one pass, document by document.
+
+    :param yaml_dir: Directory containing the YAML files written by process_pdf.py.
+    :param combined_jsonl_dir: Directory for combined_data.jsonl.
+    :param debug_dirs: Optional dict with cleaned_yaml_directory, json_directory and jsonl_directory;
+                       when given, the intermediate artifacts of the step-by-step scripts are written too.
+    :param manifest: Optional manifest; when given, only YAML files added since the last run are
+                     appended, and the combined file is rebuilt only if an earlier input changed.
+    :return: Path to the combined JSONL file.
+    """
+    os.makedirs(combined_jsonl_dir, exist_ok=True)
+    if debug_dirs:
+        for directory in debug_dirs.values():
+            os.makedirs(directory, exist_ok=True)
+
+    output_file_path = os.path.join(combined_jsonl_dir, 'combined_data.jsonl')
+    yaml_file_paths = sorted(glob.glob(os.path.join(yaml_dir, '*.yaml')))
+
+    mode, pending_paths = 'rebuild', yaml_file_paths
+    if manifest is not None:
+        mode, pending_paths = plan_incremental_update(manifest, 'build_training_data', output_file_path, yaml_file_paths)
+
+    if mode == 'skip':
+        print(f"{output_file_path} is up to date")
+        return output_file_path
+
+    if mode == 'append':
+        size_before = os.path.getsize(output_file_path)
+        with open(output_file_path, 'a', encoding='utf-8') as output_file:
+            example_count = write_training_examples(pending_paths, output_file, debug_dirs)
+        increment('bytes_written', os.path.getsize(output_file_path) - size_before)
+        print(f"Appended {example_count} training examples from {len(pending_paths)} new YAML files to {output_file_path}")
+    else:
+        temp_file_path = f"{output_file_path}.tmp"
+        with open(temp_file_path, 'w', encoding='utf-8') as output_file:
+            example_count = write_training_examples(pending_paths, output_file, debug_dirs)
+        os.replace(temp_file_path, output_file_path)
+        increment('bytes_written', os.path.getsize(output_file_path))
+        print(f"Wrote {example_count} training examples to {output_file_path}")
+
+    if manifest is not None:
+        record_output(manifest, 'build_training_data', output_file_path, yaml_file_paths)
+    return output_file_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the raw YAML files into combined_data.jsonl in a single streaming pass.")
+    parser.add_argument('--debug', action='store_true', help="Also write the cleaned YAML, JSON and per-file JSONL intermediates")
+    parser.add_argument('--full', action='store_true', help="Rebuild combined_data.jsonl from every YAML file, ignoring the manifest")
+    args = parser.parse_args()
+
+    # Load configuration and get directories
+    config = load_config()
+    debug_dirs = None
+    if args.debug:
+        debug_dirs = {
+            'cleaned_yaml_directory': config['cleaned_yaml_directory'],
+            'json_directory': config['json_directory'],
+            'jsonl_directory': config['jsonl_directory'],
+        }
+    manifest_file = manifest_path(config)
+    manifest = load_manifest(manifest_file)
+    if args.full:
+        manifest['stages'].pop('build_training_data', None)
+    with profiled(profile_path(config, 'build_training_data')), stage_timer('build_training_data'):
+        build_training_data(config['yaml_directory'], config['combined_jsonl_directory'], debug_dirs, manifest)
+    save_manifest(manifest, manifest_file)
+    export_metrics(config['metrics_directory'], 'build_training_data')
+
+if __name__ == "__main__":
+    main()
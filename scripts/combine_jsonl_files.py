@@ -1,32 +1,111 @@
 import os
 from utils.loader import load_config
+from utils.manifest import manifest_path, load_manifest, save_manifest, plan_incremental_update, record_output
+from utils.metrics import stage_timer, increment, export_metrics, profiled, profile_path
+from utils.jsonl_io import copy_file_bytes, iter_jsonl_lines, append_unique_lines, load_seen_digests, external_shuffle, write_splits
 
-def combine_jsonl_files(input_directory):
-    """Combines all JSONL files in a directory into a single JSONL file."""
+def list_jsonl_inputs(input_directory, manifest=None):
+    """
+    Returns the JSONL files to combine, sorted by name.
+
+    Files that json_to_jsonl.py produced from a JSON file that no longer exists are stale leftovers
+    of an earlier run, so they are left out.
+    """
+    input_paths = [os.path.join(input_directory, file_name) for file_name in sorted(os.listdir(input_directory))
+                   if file_name.endswith('.jsonl')]
+    if manifest is None:
+        return input_paths
+
+    converted = manifest['stages'].get('json_to_jsonl', {})
+    current = []
+    for path in input_paths:
+        sources = converted.get(path, {}).get('inputs', {})
+        if sources and not all(os.path.exists(source) for source in sources):
+            print(f"Skipping stale {path}: its source JSON file no longer exists")
+            continue
+        current.append(path)
+    return current
+
+def combine_jsonl_files(input_directory, manifest=None, dedup=True):
+    """
+    Combines all JSONL files in a directory into a single JSONL file.
+
+    With a manifest, the combined file is only rebuilt when a previously combined input changed
+    or disappeared; new input files are appended to it, and nothing is done if nothing changed.
+    With dedup, exact-duplicate records are dropped; otherwise files are concatenated with bulk copies.
+
+    :return: Path to the combined JSONL file, or None if an error occurred.
+    """
     try:
         combined_jsonl_directory = os.path.join(input_directory, 'combined_jsonl')
-        
+
         # Create the combined_jsonl directory if it doesn't exist
         if not os.path.exists(combined_jsonl_directory):
             os.makedirs(combined_jsonl_directory)
-        
+
         output_file_path = os.path.join(combined_jsonl_directory, 'combined_data.jsonl')
-        
-        with open(output_file_path, 'w', encoding='utf-8') as output_file:
-            for file_name in os.listdir(input_directory):
-                if file_name.endswith('.jsonl'):
-                    jsonl_file_path = os.path.join(input_directory, file_name)
-                    with open(jsonl_file_path, 'r', encoding='utf-8') as input_file:
-                        for line in input_file:
-                            output_file.write(line)
-        print(f"Successfully combined JSONL files into {output_file_path}")
+        input_paths = list_jsonl_inputs(input_directory, manifest)
+
+        mode, pending_paths = 'rebuild', input_paths
+        if manifest is not None:
+            mode, pending_paths = plan_incremental_update(manifest, 'combine_jsonl_files', output_file_path, input_paths)
+        if mode == 'skip':
+            print(f"{output_file_path} is up to date")
+            return output_file_path
+
+        # When appending, records already in the combined file count as seen
+        seen = load_seen_digests(output_file_path) if dedup and mode == 'append' else set()
+        dropped = 0
+        with open(output_file_path, 'ab' if mode == 'append' else 'wb') as output_file:
+            start_size = output_file.tell()
+            for jsonl_file_path in pending_paths:
+                if dedup:
+                    dropped += append_unique_lines(jsonl_file_path, output_file, seen)[1]
+                else:
+                    copy_file_bytes(jsonl_file_path, output_file)
+            increment('bytes_written', output_file.tell() - start_size)
+
+        if manifest is not None:
+            record_output(manifest, 'combine_jsonl_files', output_file_path, input_paths)
+        action = f"Appended {len(pending_paths)} new JSONL files to" if mode == 'append' else "Successfully combined JSONL files into"
+        print(f"{action} {output_file_path}")
+        if dropped:
+            print(f"Dropped {dropped} duplicate examples")
+        return output_file_path
 
     except Exception as e:
         print(f"An error occurred: {e}")
+        return None
+
+def shard_combined_file(combined_file_path, output_dir, shuffle=False, validation_fraction=0.0, shard_max_mb=None, shuffle_memory_mb=256, seed=None):
+    """
+    Splits the combined file into size-capped training shards and a validation file,
+    optionally shuffling it first with a bounded-memory external shuffle.
+    """
+    if shuffle:
+        lines = external_shuffle(combined_file_path, seed, shuffle_memory_mb)
+    else:
+        lines = iter_jsonl_lines(combined_file_path)
+    result = write_splits(lines, output_dir, validation_fraction, shard_max_mb, seed)
+    print(f"Wrote {result['counts']['train']} training examples to {len(result['shards'])} shards"
+          + (f" and {result['counts']['validation']} validation examples to {result['validation']}" if result['validation'] else ""))
+    return result
 
 if __name__ == "__main__":
     # Load configuration
     config = load_config()
     input_dir = config['jsonl_directory']
     output_dir = config['combined_jsonl_directory']
-    combine_jsonl_files(input_dir)
\ No newline at end of file
+    manifest_file = manifest_path(config)
+    manifest = load_manifest(manifest_file)
+    with profiled(profile_path(config, 'combine_jsonl_files')):
+        with stage_timer('combine_jsonl_files'):
+            combined_file_path = combine_jsonl_files(input_dir, manifest, config.get('combine_dedup', True))
+        save_manifest(manifest, manifest_file)
+
+        # Shards and the train/validation split are only written when asked for in config.yaml
+        if combined_file_path and (config.get('shuffle') or config.get('validation_fraction') or config.get('shard_max_mb')):
+            with stage_timer('shard_combined_file'):
+                shard_combined_file(combined_file_path, output_dir, config.get('shuffle', False), config.get('validation_fraction', 0.0),
+                                    config.get('shard_max_mb'), config.get('shuffle_memory_mb', 256), config.get('shuffle_seed'))
+    export_metrics(config['metrics_directory'], 'combine_jsonl_files')
@@ -1,32 +1,44 @@
 import json
 import os
 from utils.loader import load_config
+from utils.manifest import manifest_path, load_manifest, save_manifest, is_stale, record_output
+from utils.metrics import stage_timer, increment, export_metrics, profiled, profile_path
+
+def write_jsonl_line(item, output_file):
+    """Writes one item as a line of JSONL."""
+    json.dump(item, output_file)
+    output_file.write('\n')
 
 def json_to_jsonl(input_file_path, output_file_path):
-    """Converts a JSON file to JSONL format."""
+    """Converts a JSON file to JSONL format. Returns True on success."""
     try:
         with open(input_file_path, 'r', encoding='utf-8') as input_file:
             data = json.load(input_file)
 
         with open(output_file_path, 'w', encoding='utf-8') as output_file:
             for item in data:
-                json.dump(item, output_file)
-                output_file.write('\n')
+                write_jsonl_line(item, output_file)
+        increment('bytes_written', os.path.getsize(output_file_path))
+        return True
 
     except Exception as e:
         print(f"An error occurred: {e}")
+        return False
 
-def convert_directory_to_jsonl(input_dir, output_dir):
-    """Converts all JSON files in a directory to JSONL format."""
+def convert_directory_to_jsonl(input_dir, output_dir, manifest=None):
+    """Converts all JSON files in a directory to JSONL format, skipping files the manifest marks as up to date."""
     jsonl_dir = output_dir  # Use the provided directory path directly
     if not os.path.exists(jsonl_dir):
         os.makedirs(jsonl_dir)
 
-    for file_name in os.listdir(input_dir):
+    for file_name in sorted(os.listdir(input_dir)):
         if file_name.endswith('.json'):
             json_file_path = os.path.join(input_dir, file_name)
             jsonl_file_path = os.path.join(jsonl_dir, file_name.replace('.json', '.jsonl'))
-            json_to_jsonl(json_file_path, jsonl_file_path)
+            if manifest is not None and not is_stale(manifest, 'json_to_jsonl', jsonl_file_path, [json_file_path]):
+                continue
+            if json_to_jsonl(json_file_path, jsonl_file_path) and manifest is not None:
+                record_output(manifest, 'json_to_jsonl', jsonl_file_path, [json_file_path])
 
 
 def main():
@@ -34,7 +46,12 @@ def main():
     config = load_config()
     input_dir = config['json_directory']
     output_dir = config['jsonl_directory']
-    convert_directory_to_jsonl(input_dir, output_dir)
+    manifest_file = manifest_path(config)
+    manifest = load_manifest(manifest_file)
+    with profiled(profile_path(config, 'json_to_jsonl')), stage_timer('json_to_jsonl'):
+        convert_directory_to_jsonl(input_dir, output_dir, manifest)
+    save_manifest(manifest, manifest_file)
+    export_metrics(config['metrics_directory'], 'json_to_jsonl')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,51 @@
+import importlib
+from utils.loader import load_config
+from utils.manifest import manifest_path, load_manifest, save_manifest, stage_order, stale_inputs, downstream_stages, pdf_output_params
+from utils.page_selection import page_spec_for
+
+def pipeline_status(config, manifest, prompt_sets):
+    """
+    Works out which inputs of each stage are stale.
+
+    A stage is also reported as stale when any stage it depends on has stale inputs,
+    since its own inputs will change once that stage runs.
+
+    :return: Dict mapping stage name to {'stale_inputs': [...], 'stale_upstream': bool}.
+    """
+    # process_pdf outputs depend on the prompt set definitions, the PDF's page selection, the chunk token budget
+    # and the dedup threshold as well as the PDF
+    def pdf_params(path):
+        page_spec = page_spec_for(config.get('page_selection'), path)
+        return [pdf_output_params(prompt_set, page_spec, config.get('chunk_token_budget'), config.get('dedup_threshold'))
+                for prompt_set in prompt_sets]
+
+    status = {}
+    for stage in stage_order():
+        param_sets = pdf_params if stage == 'process_pdf' else None
+        status[stage] = {'stale_inputs': stale_inputs(config, manifest, stage, param_sets), 'stale_upstream': False}
+
+    for stage in stage_order():
+        if status[stage]['stale_inputs'] or status[stage]['stale_upstream']:
+            for dependent in downstream_stages(stage):
+                status[dependent]['stale_upstream'] = True
+    return status
+
+if __name__ == "__main__":
+    config = load_config()
+    prompt_sets_module = importlib.import_module('config.prompt_sets')
+    prompt_sets = getattr(prompt_sets_module, config['selected_prompt_set_list'])
+
+    manifest_file = manifest_path(config)
+    manifest = load_manifest(manifest_file)
+    for stage, stage_status in pipeline_status(config, manifest, prompt_sets).items():
+        stale = stage_status['stale_inputs']
+        if not stale and not stage_status['stale_upstream']:
+            print(f"{stage}: up to date")
+            continue
+        reason = " (an upstream stage is stale)" if stage_status['stale_upstream'] else ""
+        print(f"{stage}: {len(stale)} stale input files{reason}")
+        for path in stale:
+            print(f"    {path}")
+
+    # Persist any newly computed file hashes so the next query is faster
+    save_manifest(manifest, manifest_file)
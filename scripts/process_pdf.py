@@ -1,122 +1,947 @@
 import os
 import PyPDF2
-import datetime
 import re
+import asyncio
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, Dict
 from openai import OpenAI
 import importlib
-from utils.loader import load_config, init_openai_client
+from utils.loader import load_config, init_openai_client, init_async_openai_client
+from utils.page_cache import hash_file, cache_file_path, load_pages, store_pages
+from utils.response_cache import (open_response_cache, response_cache_key, get_cached_response,
+                                  put_cached_response, record_page, prune_pages, evict_responses, iter_cached_documents)
+from utils.manifest import manifest_path, load_manifest, save_manifest, is_stale, record_output, hash_params, pdf_output_params
+from utils.output_writer import open_output, resumed_page, add_response, finish_output, DEFAULT_FSYNC_EVERY
+from utils.chunking import estimate_tokens, iter_packed_chunks, scale_max_tokens
+from utils.dedup import new_dedup_index, keep_page, index_page
+from utils.page_selection import select_pages, page_spec_for, page_spec_key
+from utils.batch import run_batch, response_content
+from utils.rate_limit import call_with_rate_limit, call_with_rate_limit_async, init_rate_limiter
+from utils.metrics import stage_timer, record_request, increment, export_metrics, profiled, profile_path, metrics_summary
+from utils.yaml_ingest import load_documents
+from scripts.yaml_to_json import clean_yaml_lines, thread_object_messages
+from scripts.validate_dataset import check_example
+
+# Identifies the text extractor in page cache keys, so upgrading PyPDF2 invalidates old entries
+EXTRACTOR_VERSION = f"PyPDF2-{PyPDF2.__version__}"
+
+# PyPDF2 keeps every object it parses (content streams, fonts, images) for the life of the reader;
+# the lazy reader drops them after this many pages so memory stays bounded on very long documents
+RELEASE_OBJECTS_EVERY = 32
+
+# Completion budget for a single page when page packing is disabled
+DEFAULT_MAX_TOKENS = 4000
+
+# PDFs extracted or in flight at once in the async mode; each holds its page texts and open output files
+DEFAULT_MAX_CONCURRENT_PDFS = 4
+
+# Output formats: "yaml" asks for threadObject YAML that yaml_to_json.py and json_to_jsonl.py convert,
+# "jsonl" asks for schema-constrained JSON and writes training records straight to the jsonl_files folder
+OUTPUT_FORMATS = ("yaml", "jsonl")
+
+# JSON schema of one training example, in the {"messages": [...]} shape of the final JSONL.
+# Strict structured outputs require every property to be listed as required and no extra properties.
+TRAINING_EXAMPLE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "messages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "role": {"type": "string", "enum": ["system", "user", "assistant"]},
+                    "content": {"type": "string"}
+                },
+                "required": ["role", "content"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["messages"],
+    "additionalProperties": False
+}
 
 # Initialize OpenAI client
 def initialize_openai_client(api_key):
     return OpenAI(api_key=api_key)
 
-# Read PDF file and return text content of each page as a list
-def read_pdf(file_path):
-    pdf_content = []
+# Yield the text of each selected page of a PDF, one page at a time, so work on the first pages can start
+# before the rest are parsed. page_spec is a page_selection entry from config.yaml (None reads every page).
+def iter_pdf_pages(file_path, page_spec=None):
     with open(file_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        for page_num in range(len(reader.pages)):
+        for count, page_num in enumerate(select_pages(reader, page_spec), 1):
             try:
-                page = reader.pages[page_num]
-                pdf_content.append(page.extract_text())
-            except PyPDF2.errors.PdfReadError as e:
+                with stage_timer('extract_page'):
+                    page_text = reader.pages[page_num].extract_text()
+            except Exception as e:  # A malformed page must not take the rest of the document down with it
                 print(f"Error reading page {page_num + 1} of {file_path}: {e}")
-                pdf_content.append("")  # Append an empty string for the problematic page
-    return pdf_content
+                page_text = ""  # Yield an empty string for the problematic page
+            yield page_text
+            if count % RELEASE_OBJECTS_EVERY == 0:
+                # Parsed objects are re-read from the file if a later page needs them again
+                reader.resolved_objects.clear()
+
+# Read PDF file and return text content of each (selected) page as a list
+def read_pdf(file_path, page_spec=None):
+    return list(iter_pdf_pages(file_path, page_spec))
+
+# Page cache key of the extracted text: the extractor, plus the page selection if there is one
+def page_cache_version(page_spec=None):
+    return EXTRACTOR_VERSION if page_spec is None else f"{EXTRACTOR_VERSION}:{page_spec_key(page_spec)}"
+
+# Yield the text of each page, served from the on-disk page cache when the PDF has been parsed before.
+# On a cache miss pages are yielded as they are extracted, and cached once the last one has been read.
+def iter_pdf_pages_cached(file_path, cache_dir=None, pdf_hash=None, page_spec=None):
+    if cache_dir is None:
+        yield from iter_pdf_pages(file_path, page_spec)
+        return
+
+    cache_path = cache_file_path(cache_dir, pdf_hash or hash_file(file_path), page_cache_version(page_spec))
+    pdf_content = load_pages(cache_path)
+    if pdf_content is not None:
+        print(f"Page cache hit: {os.path.basename(file_path)} ({len(pdf_content)} pages)")
+        yield from pdf_content
+        return
+
+    print(f"Page cache miss: {os.path.basename(file_path)}, extracting text")
+    pdf_content = []
+    for page_text in iter_pdf_pages(file_path, page_spec):
+        pdf_content.append(page_text)
+        yield page_text
+    store_pages(cache_path, pdf_content)
+
+# Return the text of each page, from the page cache when possible
+def read_pdf_cached(file_path, cache_dir=None, pdf_hash=None, page_spec=None):
+    return list(iter_pdf_pages_cached(file_path, cache_dir, pdf_hash, page_spec))
+
+# Hash and extract one PDF. Runs inside the extraction pool, so it must stay a top-level function.
+def extract_pdf(file_path, cache_dir=None, page_spec=None):
+    with stage_timer('extract_pdf', file=os.path.basename(file_path)):
+        pdf_hash = hash_file(file_path)
+        return pdf_hash, read_pdf_cached(file_path, cache_dir, pdf_hash, page_spec)
+
+# Extract one PDF into the page cache ahead of its turn. Runs inside the extraction pool.
+def prefetch_pdf(file_path, cache_dir, page_spec=None):
+    extract_pdf(file_path, cache_dir, page_spec)
+
+def list_pdf_files(directory_path):
+    """Returns the paths of the PDF files directly inside a directory."""
+    return [os.path.join(directory_path, file_name) for file_name in sorted(os.listdir(directory_path)) if file_name.endswith('.pdf')]
+
+def iter_extracted_pdfs(pdf_paths, cache_dir=None, extraction_workers=1, page_selection=None):
+    """
+    Extracts PDFs across a process pool and yields (file_path, pdf_hash, pdf_content) for each
+    document as soon as it is ready, so the LLM stage can start while the pool keeps parsing.
+
+    A document that fails to extract is reported and skipped; the pool keeps going.
+
+    :param pdf_paths: Paths of the PDF files to extract.
+    :param cache_dir: Page cache directory, or None to disable the page cache.
+    :param extraction_workers: Number of worker processes; 1 extracts in this process.
+    :param page_selection: The page_selection mapping from config.yaml, or None to extract every page.
+    """
+    if extraction_workers <= 1:
+        for file_path in pdf_paths:
+            try:
+                pdf_hash, pdf_content = extract_pdf(file_path, cache_dir, page_spec_for(page_selection, file_path))
+            except Exception as e:
+                print(f"Error extracting {file_path}: {e}")
+                continue
+            yield file_path, pdf_hash, pdf_content
+        return
+
+    with ProcessPoolExecutor(max_workers=extraction_workers) as executor:
+        futures = {executor.submit(extract_pdf, file_path, cache_dir, page_spec_for(page_selection, file_path)): file_path for file_path in pdf_paths}
+        # Workers' metrics stay in their processes, so here only the time spent waiting on the pool is recorded
+        completed = as_completed(futures)
+        while True:
+            with stage_timer('extract_pdf_wait'):
+                future = next(completed, None)
+            if future is None:
+                break
+            file_path = futures[future]
+            try:
+                pdf_hash, pdf_content = future.result()
+            except Exception as e:
+                print(f"Error extracting {file_path}: {e}")
+                continue
+            yield file_path, pdf_hash, pdf_content
+
+# Prompt templates. Everything before the page content is the same for every request of a prompt set, so the
+# provider's automatic prompt caching can reuse it: keep per-request text out of the templates, and note that
+# the system role content is only sent as the system message, which comes first.
+YAML_PROMPT_TEMPLATE = """You are generating structured YAML objects for the purpose of fine-tuning an AI model. The YAML object you generate represents a series of messages in a conversation. Your output must always be in valid YAML format.
+
+Here is an example model for the YAML output.
+**REFRAIN FROM HALLUCINATING OR DEVIATING FROM THE FORMAT OR SYNTAX WITHIN THE EXAMPLE MODEL: **
+
+<exampleModel>
+threadObject:
+    - systemRoleContent: "<the system message of this conversation, word for word>"
+    - userRoleContent: {user_role_content}
+    - assistantRoleContent: "response_to_question"
+</exampleModel>
+
+For userRoleContent, you will generate a specific request or question directly relevant to the following content that requires a response including generated code:
+
+"""
+
+# Prompt for the jsonl output format; the response schema enforces the structure, so only the content is described
+JSON_PROMPT_TEMPLATE = """You are generating a training example for the purpose of fine-tuning an AI model. The example is a conversation of three messages, in this order: system, user, assistant.
+
+The system message content must be the system message of this conversation, word for word.
+The user message is in the style of: {user_role_content}
+The assistant message is the response to the user message.
+
+For the user message, you will generate a specific request or question directly relevant to the following content that requires a response including generated code:
+
+"""
+
+# Providers only cache prompt prefixes of at least this many tokens
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+# Rendered prompt prefixes, keyed by (prompt set name, output format)
+_prompt_prefixes = {}
+
+# Return the prompt up to the page content for a prompt set. It is rendered once per prompt set and format,
+# so every request of a prompt set starts with byte-identical text.
+def prompt_prefix(prompt_set, output_format="yaml"):
+    key = (prompt_set['name'], output_format)
+    if key not in _prompt_prefixes:
+        template = JSON_PROMPT_TEMPLATE if output_format == "jsonl" else YAML_PROMPT_TEMPLATE
+        _prompt_prefixes[key] = template.format(user_role_content=prompt_set['user_role_content'])
+    return _prompt_prefixes[key]
+
+# Build the prompt sent to OpenAI for a single page of pdf content; the page content always comes last
+def build_prompt(pdf_content, prompt_set, output_format="yaml"):
+    return prompt_prefix(prompt_set, output_format) + pdf_content
+
+# Estimate the tokens every request of a prompt set shares, i.e. what the provider's prompt cache can reuse
+def shared_prefix_tokens(prompt_set, output_format="yaml"):
+    return estimate_tokens(prompt_set['system_role_content']) + estimate_tokens(prompt_prefix(prompt_set, output_format))
+
+# Build the keyword arguments for a chat completion request on a single page of pdf content
+def build_request(pdf_content, prompt_set, max_tokens=DEFAULT_MAX_TOKENS, output_format="yaml"):
+    prompt = build_prompt(pdf_content, prompt_set, output_format)
+    request = {
+        "model": "gpt-4o-mini-2024-07-18",
+        "messages": [
+            {"role": "system", "content": prompt_set['system_role_content']},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0.7,
+        "top_p": 1
+    }
+    if output_format == "jsonl":
+        request["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "training_example", "strict": True, "schema": TRAINING_EXAMPLE_SCHEMA}
+        }
+    return request
+
+# Strip the markdown code fences the model likes to wrap around its YAML
+def clean_response_text(response_text):
+    if response_text:
+        response_text = re.sub(r'^```yaml', '', response_text, count=1).strip()
+        response_text = re.sub(r'```$', '', response_text, count=1).strip()
+    return response_text
+
+# Turn a fresh response into the text written to the output file, or None if it is unusable.
+# Both formats count responses_parsed and response_parse_failures, so their failure rates can be compared.
+# YAML responses are kept even when they fail to parse, as before; yaml_to_json.py decides what to do with them.
+def parse_response_text(response_text, output_format="yaml"):
+    if not response_text:
+        return None
+    if output_format == "jsonl":
+        try:
+            example = json.loads(response_text)
+            errors = check_example(example)
+        except ValueError as e:
+            errors = [f"invalid JSON: {e}"]
+        if errors:
+            print(f"Discarding response that is not a valid training example: {'; '.join(errors)}")
+            increment('response_parse_failures')
+            return None
+        increment('responses_parsed')
+        return json.dumps(example)
+
+    response_text = clean_response_text(response_text)
+    try:
+        documents, _ = load_documents(list(clean_yaml_lines(response_text.splitlines(keepends=True))))
+        valid = bool(documents) and all(not check_example(thread_object_messages(document)) for document in documents)
+    except Exception:
+        valid = False
+    increment('responses_parsed' if valid else 'response_parse_failures')
+    return response_text
+
+# True if a response is a training record in the jsonl output format (e.g. when rebuilding outputs from the cache)
+def is_training_record(response_text):
+    try:
+        return not check_example(json.loads(response_text))
+    except ValueError:
+        return False
+
+# Look up a request in the response cache; returns (cache_key, cached response or None)
+def lookup_cached_response(response_cache, request, page_ref):
+    if response_cache is None:
+        return None, None
+    cache_key = response_cache_key(request)
+    cached_response = get_cached_response(response_cache, cache_key)
+    if cached_response is not None:
+        increment('response_cache_hits')
+        if page_ref:
+            record_page(response_cache, page_ref, cache_key)
+    return cache_key, cached_response
+
+# Store a fresh response in the response cache (failed requests are not cached, so reruns retry them)
+def store_response(response_cache, cache_key, request, response_text, page_ref):
+    if response_cache is None or not response_text:
+        return
+    put_cached_response(response_cache, cache_key, request['model'], response_text)
+    if page_ref:
+        record_page(response_cache, page_ref, cache_key)
+
+# Once every request unit of a (PDF file + prompt set) has a response, drop the page records earlier runs left
+# behind, so --resume rebuilds the output from exactly the pages of this run
+def prune_cached_pages(response_cache, file_path, pdf_hash, prompt_set_name, unit_count):
+    if response_cache is not None:
+        prune_pages(response_cache, os.path.basename(file_path), prompt_set_name, pdf_hash, unit_count)
+
+# Consume a streamed completion chunk by chunk and return (text, usage); the time to the first token is recorded separately
+def read_stream(stream, start):
+    parts = []
+    usage = None
+    for chunk in stream:
+        # With include_usage, the last chunk carries the usage and no choices
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            if not parts:
+                record_request('chat_completion_first_token', start)
+            parts.append(chunk.choices[0].delta.content)
+    return ''.join(parts) if parts else None, usage
+
+# Async counterpart of read_stream
+async def read_stream_async(stream, start):
+    parts = []
+    usage = None
+    async for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            if not parts:
+                record_request('chat_completion_first_token', start)
+            parts.append(chunk.choices[0].delta.content)
+    return ''.join(parts) if parts else None, usage
+
+# Tokens a request counts against the tokens-per-minute limit: its prompt plus the completion budget
+def request_tokens(request):
+    return sum(estimate_tokens(message['content']) for message in request['messages']) + request.get('max_tokens', 0)
+
+# Run one chat completion and return (response text, usage). Streaming is not part of the request dict,
+# so streamed and non-streamed responses share their cache entries. The call goes through the rate limiter,
+# which waits for budget, retries 429s and transient errors, and learns the limits from the response headers.
+def create_completion(client, request, stream=False, rate_limiter=None):
+    stream_args = {'stream': True, 'stream_options': {"include_usage": True}} if stream else {}
+    attempt = {}
+
+    def send():
+        attempt['start'] = time.time()
+        try:
+            return client.chat.completions.with_raw_response.create(**request, **stream_args)
+        except Exception:
+            record_request('chat_completion', attempt['start'], error=True)
+            raise
+
+    raw_response = call_with_rate_limit(rate_limiter, request['model'], send, request_tokens(request))
+    start = attempt['start']
+    try:
+        if stream:
+            response_text, usage = read_stream(raw_response.parse(), start)
+        else:
+            response = raw_response.parse()
+            response_text, usage = response.choices[0].message.content if response.choices else None, response.usage
+    except Exception:
+        record_request('chat_completion', start, error=True)
+        raise
+    record_request('chat_completion', start, usage)
+    return response_text, usage
+
+# Async counterpart of create_completion
+async def create_completion_async(client, request, stream=False, rate_limiter=None):
+    stream_args = {'stream': True, 'stream_options': {"include_usage": True}} if stream else {}
+    attempt = {}
+
+    async def send():
+        attempt['start'] = time.time()
+        try:
+            return await client.chat.completions.with_raw_response.create(**request, **stream_args)
+        except Exception:
+            record_request('chat_completion', attempt['start'], error=True)
+            raise
+
+    raw_response = await call_with_rate_limit_async(rate_limiter, request['model'], send, request_tokens(request))
+    start = attempt['start']
+    try:
+        if stream:
+            response_text, usage = await read_stream_async(raw_response.parse(), start)
+        else:
+            response = raw_response.parse()
+            response_text, usage = response.choices[0].message.content if response.choices else None, response.usage
+    except Exception:
+        record_request('chat_completion', start, error=True)
+        raise
+    record_request('chat_completion', start, usage)
+    return response_text, usage
 
 # Send pdf content to OpenAI and return the response
-def send_to_openai(client, pdf_content, prompt_set):
+def send_to_openai(client, pdf_content, prompt_set, response_cache=None, page_ref=None, max_tokens=DEFAULT_MAX_TOKENS, output_format="yaml", stream=False,
+                   rate_limiter=None):
     try:
         # Construct the prompt
-        prompt = f"""
-        You are generating structured YAML objects for the purpose of fine-tuning an AI model. The YAML object you generate represents a series of messages in a conversation. Your output must always be in valid YAML format.
-
-        Here is an example model for the YAML output.
-        **REFRAIN FROM HALLUCINATING OR DEVIATING FROM THE FORMAT OR SYNTAX WITHIN THE EXAMPLE MODEL: **
-
-        <exampleModel>
-        threadObject:
-            - systemRoleContent: {prompt_set['system_role_content']}
-            - userRoleContent: {prompt_set['user_role_content']}
-            - assistantRoleContent: "response_to_question"
-        </exampleModel>
-
-        For userRoleContent, you will generate a specific request or question directly relevant to the following content that requires a response including generated code:
-        
-        {pdf_content}
-        """
-        response = client.chat.completions.create(
-            model="gpt-4o-mini-2024-07-18",
-            messages=[
-                {"role": "system", "content": prompt_set['system_role_content']},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=4000,
-            temperature=0.7,
-            top_p=1
-        )
-
-        response_text = response.choices[0].message.content if response.choices else None
-
-        # Clean the response text
-        if response_text:
-            response_text = re.sub(r'^```yaml', '', response_text, count=1).strip()
-            response_text = re.sub(r'```$', '', response_text, count=1).strip()
+        request = build_request(pdf_content, prompt_set, max_tokens, output_format)
+        cache_key, cached_response = lookup_cached_response(response_cache, request, page_ref)
+        if cached_response is not None:
+            return cached_response
+
+        response_text, _ = create_completion(client, request, stream, rate_limiter)
 
+        # Clean (and in the jsonl format, validate) the response text
+        response_text = parse_response_text(response_text, output_format)
+        store_response(response_cache, cache_key, request, response_text, page_ref)
         return response_text
     
     except Exception as e:
         print("An error occurred:", e)
+        increment('failed_requests')
         return None
 
-# Generate a unique filename for the output YAML file
-def generate_unique_filename(base_filename, prompt_set_name):
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{base_filename}_{prompt_set_name}_{timestamp}_fine_tuning.yaml"
+# Async counterpart of send_to_openai; the semaphore caps the number of in-flight requests
+async def send_to_openai_async(client, pdf_content, prompt_set, semaphore, response_cache=None, page_ref=None, max_tokens=DEFAULT_MAX_TOKENS, output_format="yaml", stream=False,
+                               rate_limiter=None):
+    request = build_request(pdf_content, prompt_set, max_tokens, output_format)
+    cache_key, cached_response = lookup_cached_response(response_cache, request, page_ref)
+    if cached_response is not None:
+        return cached_response
+
+    async with semaphore:
+        try:
+            response_text, _ = await create_completion_async(client, request, stream, rate_limiter)
+            response_text = parse_response_text(response_text, output_format)
+            store_response(response_cache, cache_key, request, response_text, page_ref)
+            return response_text
+
+        except Exception as e:
+            print("An error occurred:", e)
+            increment('failed_requests')
+            return None
+
+# Generate the filename for the output YAML (or JSONL) file.
+# The name is stable across runs so a rerun replaces its previous output instead of adding a duplicate.
+def generate_output_filename(base_filename, prompt_set_name, output_format="yaml"):
+    return f"{base_filename}_{prompt_set_name}_fine_tuning.{output_format}"
+
+# Return the output path for one (PDF file + prompt set) combination
+def get_output_file_path(file_path, output_dir, prompt_set_name, output_format="yaml"):
+    base_filename = os.path.basename(file_path).replace('.pdf', '')
+    return os.path.join(output_dir, generate_output_filename(base_filename, prompt_set_name, output_format))
+
+# Return the default page cache folder of a PDF directory (the page_cache_directory load_config sets up)
+def get_page_cache_dir(directory_path):
+    return os.path.join(directory_path, 'page_cache')
+
+# Return the folder process_pdf writes to: yaml_files, or for the jsonl format the jsonl_files folder
+# combine_jsonl_files.py reads (the same paths load_config sets up)
+def get_output_dir(directory_path, output_format="yaml"):
+    yaml_dir = os.path.join(directory_path, 'yaml_files')
+    if output_format == "jsonl":
+        return os.path.join(yaml_dir, 'cleaned_yaml_files', 'json_files', 'jsonl_files')
+    return yaml_dir
 
-# Process a single PDF file with a given prompt set
-def process_pdf(client, file_path, output_dir, prompt_set_list):
+# Write the responses for one (PDF file + prompt set) combination to a YAML file, or one record per line to a JSONL file.
+# Used where all responses are already at hand (batch results, --resume); the file is replaced atomically.
+def write_responses(file_path, output_dir, prompt_set_name, all_responses, output_format="yaml"):
+    output_file_path = get_output_file_path(file_path, output_dir, prompt_set_name, output_format)
+    writer = open_output(output_file_path, output_format=output_format)
+    for page_num, response in enumerate(all_responses):
+        add_response(writer, page_num, response)
+    finish_output(writer)
+    return output_file_path
+
+# Identifies everything an output file is built from (the work queue's job id)
+def output_fingerprint(pdf_hash, prompt_set, request_units, output_format="yaml"):
+    return hash_params({'pdf_hash': pdf_hash, 'prompt_set': prompt_set, 'output_format': output_format, 'request_units': request_units})
+
+# Identifies what every page of a partially written output depends on. The requests themselves are checked
+# page by page with request_unit_key, since pages are streamed and not all known when the output is opened.
+def resume_fingerprint(pdf_hash, prompt_set, output_format="yaml"):
+    return hash_params({'pdf_hash': pdf_hash, 'prompt_set': prompt_set, 'output_format': output_format})
+
+# Short key of one request unit, recorded with each page of a partially written output
+def request_unit_key(pdf_page_content, max_tokens):
+    return hash_params([pdf_page_content, max_tokens])[:16]
+
+# The PDF page numbers (0-based) of the pages a page_spec selects, in the order they are extracted
+def selected_page_numbers(file_path, page_spec=None):
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        return select_pages(reader, page_spec) if page_spec is not None else list(range(len(reader.pages)))
+
+# Skip pages that are near-duplicates of pages already sent, in this PDF or an earlier one.
+# Pages are checked as they arrive, so the reader can stream them; the count is reported once they run out.
+# With a page selection, the PDF's own page numbers are looked up so the dedup report points at the right pages.
+def skip_duplicates(file_path, pdf_content, dedup_index=None, page_spec=None):
+    if dedup_index is None:
+        yield from pdf_content
+        return
+    document = os.path.basename(file_path)
+    page_numbers = selected_page_numbers(file_path, page_spec) if page_spec is not None else None
+    dropped_before = len(dedup_index['dropped'])
+    for position, page_text in enumerate(pdf_content):
+        with stage_timer('dedup_pages'):
+            keep = keep_page(dedup_index, document, page_numbers[position] if page_numbers else position, page_text)
+        if keep:
+            yield page_text
+    dropped = len(dedup_index['dropped']) - dropped_before
+    if dropped:
+        print(f"Skipped {dropped} near-duplicate pages of {document}")
+
+# List form of skip_duplicates
+def drop_duplicates(file_path, pdf_content, dedup_index=None, page_spec=None):
+    return list(skip_duplicates(file_path, pdf_content, dedup_index, page_spec))
+
+# Index the pages of the PDFs a run skips as up to date, so the PDFs it does process (e.g. one just added to
+# the folder) are still deduplicated against them. Their text comes from the page cache.
+def seed_dedup_index(dedup_index, pdf_paths, cache_dir=None, page_selection=None):
+    if dedup_index is None:
+        return
+    for file_path in pdf_paths:
+        page_spec = page_spec_for(page_selection, file_path)
+        try:
+            pdf_content = read_pdf_cached(file_path, cache_dir, None, page_spec)
+            page_numbers = selected_page_numbers(file_path, page_spec)
+        except Exception as e:
+            print(f"Error reading {file_path} for deduplication: {e}")
+            continue
+        with stage_timer('dedup_pages'):
+            for page_num, page_text in zip(page_numbers, pdf_content):
+                index_page(dedup_index, os.path.basename(file_path), page_num, page_text)
+
+def write_dedup_report(dedup_index, directory_path):
+    """Writes the pages dropped as near-duplicates to dedup_report.json in the PDF directory."""
+    if dedup_index is None:
+        return
+    report_path = os.path.join(directory_path, 'dedup_report.json')
+    with open(report_path, 'w') as report_file:
+        json.dump(dedup_index['dropped'], report_file, indent=4)
+    print(f"Dropped {len(dedup_index['dropped'])} near-duplicate pages. Report saved to {report_path}")
+
+# Turn page texts into request units, as (content, max_tokens) pairs, yielded as pages arrive. Without a token
+# budget every page is its own request; with one, pages are packed into token-budgeted chunks and the savings reported.
+def iter_request_units(file_path, pdf_content, prompt_set_list, token_budget=None, output_format="yaml"):
+    if not token_budget:
+        for pdf_page_content in pdf_content:
+            yield pdf_page_content, DEFAULT_MAX_TOKENS
+        return
+
+    page_count = chunk_count = 0
+    for chunk in iter_packed_chunks(pdf_content, token_budget):
+        page_count = chunk['pages'][-1] + 1
+        chunk_count += 1
+        yield chunk['text'], scale_max_tokens(chunk['tokens'])
+
+    requests_saved = page_count - chunk_count
+    # Every request repeats the system prompt and example-model preamble, so each saved request saves that overhead
+    prompt_overhead = sum(
+        estimate_tokens(message['content'])
+        for prompt_set in prompt_set_list
+        for message in build_request('', prompt_set, output_format=output_format)['messages']
+    )
+    print(f"Packed {page_count} pages of {os.path.basename(file_path)} into {chunk_count} requests per prompt set: "
+          f"saved {requests_saved * len(prompt_set_list)} requests and ~{requests_saved * prompt_overhead} prompt tokens")
+
+# List form of iter_request_units
+def build_request_units(file_path, pdf_content, prompt_set_list, token_budget=None, output_format="yaml"):
+    return list(iter_request_units(file_path, pdf_content, prompt_set_list, token_budget, output_format))
+
+# Process a single PDF file with a given prompt set.
+# Returns the names of the prompt sets for which every page got a response.
+# Pages are read lazily and each one is sent with every prompt set as soon as it is extracted, so the first
+# request goes out right after the first page is read. Responses are written to the output files as they
+# complete, see utils/output_writer.py.
+def process_pdf(client, file_path, output_dir, prompt_set_list, cache_dir=None, response_cache=None, extracted=None, token_budget=None, dedup_index=None,
+                output_format="yaml", fsync_every=DEFAULT_FSYNC_EVERY, stream=False, page_spec=None, rate_limiter=None):
     for prompt_set in prompt_set_list:
-        if isinstance(prompt_set, dict):
-            prompt_set_name = prompt_set['name']
-            pdf_content = read_pdf(file_path)
-            all_responses = []
-            print(f"Processing {os.path.basename(file_path)} with prompt set: {prompt_set['name']}")
-
-            for page_num, pdf_page_content in enumerate(pdf_content):
-                print(f"Processing page {page_num + 1}/{len(pdf_content)}")
-                thread_object_content = send_to_openai(client, pdf_page_content, prompt_set)
-                if thread_object_content:
-                    all_responses.append(thread_object_content)
-
-            base_filename = os.path.basename(file_path).replace('.pdf', '')
-            unique_filename = generate_unique_filename(base_filename, prompt_set_name)
-            output_file_path = os.path.join(output_dir, unique_filename)
-
-            with open(output_file_path, 'a', encoding='utf-8') as output_file:
-                for i, response in enumerate(all_responses):
-                    output_file.write(response)
-                    if i < len(all_responses) - 1:
-                        output_file.write('\n---\n')  # Newline and delimiter separator
-            
-            print(f"Finished processing {os.path.basename(file_path)} with prompt: {prompt_set_name}. \nOutput saved to {output_file_path}")
-        else:
+        if not isinstance(prompt_set, dict):
+            raise TypeError("Expected prompt_set to be a dictionary")
+
+    # extracted is an already extracted (pdf_hash, pdf_content) pair, e.g. from iter_extracted_pdfs
+    if extracted is not None:
+        pdf_hash, pdf_content = extracted
+    else:
+        pdf_hash = hash_file(file_path)
+        pdf_content = iter_pdf_pages_cached(file_path, cache_dir, pdf_hash, page_spec)
+    document = os.path.basename(file_path)
+    print(f"Processing {document} with prompt sets: {', '.join(prompt_set['name'] for prompt_set in prompt_set_list)}")
+
+    writers = {
+        prompt_set['name']: open_output(get_output_file_path(file_path, output_dir, prompt_set['name'], output_format),
+                                        resume_fingerprint(pdf_hash, prompt_set, output_format), output_format, fsync_every)
+        for prompt_set in prompt_set_list
+    }
+    request_units = iter_request_units(file_path, skip_duplicates(file_path, pdf_content, dedup_index, page_spec), prompt_set_list, token_budget, output_format)
+    unit_count = 0
+    for page_num, (pdf_page_content, max_tokens) in enumerate(request_units):
+        unit_count += 1
+        unit_key = request_unit_key(pdf_page_content, max_tokens)
+        for prompt_set in prompt_set_list:
+            writer = writers[prompt_set['name']]
+            if resumed_page(writer, page_num, unit_key):
+                continue
+            print(f"Processing request {page_num + 1} of {document} with prompt set: {prompt_set['name']}")
+            page_ref = {'document': document, 'pdf_hash': pdf_hash, 'prompt_set': prompt_set['name'], 'page_num': page_num}
+            thread_object_content = send_to_openai(client, pdf_page_content, prompt_set, response_cache, page_ref, max_tokens, output_format, stream, rate_limiter)
+            add_response(writer, page_num, thread_object_content, unit_key)
+
+    completed = []
+    for prompt_set_name, writer in writers.items():
+        # A prompt set with failed requests keeps its partial output, which the next run completes
+        if finish_output(writer) == unit_count:
+            completed.append(prompt_set_name)
+            prune_cached_pages(response_cache, file_path, pdf_hash, prompt_set_name, unit_count)
+            print(f"Finished processing {document} with prompt: {prompt_set_name}. \nOutput saved to {writer['path']}")
+    return completed
+
+# Extract a PDF in the extraction pool (or a worker thread) so other PDFs' requests keep flowing meanwhile.
+# Returns (pdf_hash, pdf_content), or None if the PDF could not be read.
+async def extract_pdf_async(file_path, cache_dir=None, executor=None, page_spec=None):
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, extract_pdf, file_path, cache_dir, page_spec)
+    except Exception as e:
+        print(f"Error extracting {file_path}: {e}")
+        return None
+
+# Async counterpart of process_pdf: every (page, prompt set) request is dispatched concurrently.
+# The output writer puts responses back in page order as they complete, so each output file keeps page order.
+async def process_pdf_async(client, file_path, output_dir, prompt_set_list, semaphore, cache_dir=None, response_cache=None, executor=None, token_budget=None, dedup_index=None,
+                            output_format="yaml", fsync_every=DEFAULT_FSYNC_EVERY, stream=False, page_spec=None, rate_limiter=None, extracted=None):
+    for prompt_set in prompt_set_list:
+        if not isinstance(prompt_set, dict):
             raise TypeError("Expected prompt_set to be a dictionary")
-        
 
-def process_directory(client, directory_path: str, prompt_sets: List[Dict[str, str]]):
-    """Processes all PDF files within a directory using multiple prompt sets and saves the fine-tuning data in a new folder."""
-    output_dir = os.path.join(directory_path, 'yaml_files')
+    # extracted is an already extracted (pdf_hash, pdf_content) pair, e.g. from extract_pdf_async
+    if extracted is None:
+        extracted = await extract_pdf_async(file_path, cache_dir, executor, page_spec)
+        if extracted is None:
+            return []
+    pdf_hash, pdf_content = extracted
+    print(f"Processing {os.path.basename(file_path)} ({len(pdf_content)} pages) with {len(prompt_set_list)} prompt sets")
+    pdf_content = drop_duplicates(file_path, pdf_content, dedup_index, page_spec)
+    request_units = build_request_units(file_path, pdf_content, prompt_set_list, token_budget, output_format)
+
+    async def run_prompt_set(prompt_set):
+        output_file_path = get_output_file_path(file_path, output_dir, prompt_set['name'], output_format)
+        writer = open_output(output_file_path, resume_fingerprint(pdf_hash, prompt_set, output_format), output_format, fsync_every)
+        # Checked in page order before anything is dispatched, as resumed_page requires
+        unit_keys = [request_unit_key(pdf_page_content, max_tokens) for pdf_page_content, max_tokens in request_units]
+        to_send = [page_num for page_num, unit_key in enumerate(unit_keys) if not resumed_page(writer, page_num, unit_key)]
+
+        async def run_page(page_num):
+            pdf_page_content, max_tokens = request_units[page_num]
+            page_ref = {'document': os.path.basename(file_path), 'pdf_hash': pdf_hash, 'prompt_set': prompt_set['name'], 'page_num': page_num}
+            response = await send_to_openai_async(client, pdf_page_content, prompt_set, semaphore, response_cache, page_ref, max_tokens, output_format, stream,
+                                                  rate_limiter)
+            add_response(writer, page_num, response, unit_keys[page_num])
+
+        await asyncio.gather(*(run_page(page_num) for page_num in to_send))
+        if finish_output(writer) != len(request_units):
+            return None
+        prune_cached_pages(response_cache, file_path, pdf_hash, prompt_set['name'], len(request_units))
+        print(f"Finished processing {os.path.basename(file_path)} with prompt: {prompt_set['name']}. \nOutput saved to {output_file_path}")
+        return prompt_set['name']
+
+    results = await asyncio.gather(*(run_prompt_set(prompt_set) for prompt_set in prompt_set_list))
+    return [prompt_set_name for prompt_set_name in results if prompt_set_name]
+
+# Return the prompt sets whose output for this PDF is missing or out of date according to the manifest.
+# The recorded parameters include the PDF's page selection, the chunk token budget and the dedup threshold,
+# so changing any of them makes the outputs stale.
+def stale_prompt_sets(manifest, file_path, output_dir, prompt_sets, output_format="yaml", page_spec=None, token_budget=None, dedup_threshold=None):
+    if manifest is None:
+        return list(prompt_sets)
+    return [
+        prompt_set for prompt_set in prompt_sets
+        if is_stale(manifest, 'process_pdf', get_output_file_path(file_path, output_dir, prompt_set['name'], output_format), [file_path],
+                    pdf_output_params(prompt_set, page_spec, token_budget, dedup_threshold))
+    ]
+
+# Record the outputs of fully processed prompt sets so the next run can skip them
+def record_completed(manifest, file_path, output_dir, prompt_sets, completed, output_format="yaml", page_spec=None, token_budget=None, dedup_threshold=None):
+    if manifest is None:
+        return
+    for prompt_set in prompt_sets:
+        if prompt_set['name'] in completed:
+            output_file_path = get_output_file_path(file_path, output_dir, prompt_set['name'], output_format)
+            record_output(manifest, 'process_pdf', output_file_path, [file_path], pdf_output_params(prompt_set, page_spec, token_budget, dedup_threshold))
+
+# Work out which PDFs still need which prompt sets; PDFs with nothing stale are skipped entirely
+def plan_pdf_work(manifest, pdf_paths, output_dir, prompt_sets, output_format="yaml", page_selection=None, token_budget=None, dedup_threshold=None):
+    pending = {}
+    for file_path in pdf_paths:
+        stale = stale_prompt_sets(manifest, file_path, output_dir, prompt_sets, output_format, page_spec_for(page_selection, file_path),
+                                  token_budget, dedup_threshold)
+        if stale:
+            pending[file_path] = stale
+    skipped = len(pdf_paths) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} PDF files whose outputs are up to date")
+    return pending
+
+def process_directory(client, directory_path: str, prompt_sets: List[Dict[str, str]], response_cache=None, extraction_workers: int = 1, manifest=None, token_budget=None, dedup_threshold=None,
+                      output_format: str = "yaml", fsync_every: int = DEFAULT_FSYNC_EVERY, stream: bool = False, page_selection=None, rate_limiter=None, cache_dir=None):
+    """
+    Processes all PDF files within a directory using multiple prompt sets and saves the fine-tuning data in a new folder.
+
+    Each PDF is read lazily while its requests are sent. With more than one extraction worker, the following
+    PDFs are extracted into the page cache in the background meanwhile.
+    """
+    output_dir = get_output_dir(directory_path, output_format)
+    cache_dir = cache_dir or get_page_cache_dir(directory_path)
     os.makedirs(output_dir, exist_ok=True)
 
-    for file_name in os.listdir(directory_path):
-        if file_name.endswith('.pdf'):
-            file_path = os.path.join(directory_path, file_name)
-            process_pdf(client, file_path, output_dir, prompt_sets)
+    dedup_index = new_dedup_index(dedup_threshold) if dedup_threshold else None
+    pdf_paths = list_pdf_files(directory_path)
+    pending = plan_pdf_work(manifest, pdf_paths, output_dir, prompt_sets, output_format, page_selection, token_budget, dedup_threshold)
+    seed_dedup_index(dedup_index, [file_path for file_path in pdf_paths if file_path not in pending], cache_dir, page_selection)
+    executor = ProcessPoolExecutor(max_workers=extraction_workers) if extraction_workers > 1 else None
+    prefetched = {}
+    if executor is not None:
+        prefetched = {file_path: executor.submit(prefetch_pdf, file_path, cache_dir, page_spec_for(page_selection, file_path))
+                      for file_path in list(pending)[1:]}
+    try:
+        for file_path in pending:
+            page_spec = page_spec_for(page_selection, file_path)
+            future = prefetched.pop(file_path, None)
+            # A prefetch that has not started yet is dropped and the PDF read lazily here instead
+            if future is not None and not future.cancel():
+                with stage_timer('extract_pdf_wait'):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Error extracting {file_path}: {e}")
+                        continue
+            try:
+                completed = process_pdf(client, file_path, output_dir, pending[file_path], cache_dir, response_cache, None, token_budget, dedup_index,
+                                        output_format, fsync_every, stream, page_spec, rate_limiter)
+            except Exception as e:
+                print(f"Error processing {file_path}: {e}")
+                continue
+            record_completed(manifest, file_path, output_dir, pending[file_path], completed, output_format, page_spec, token_budget, dedup_threshold)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    write_dedup_report(dedup_index, directory_path)
+
+async def process_directory_async(client, directory_path: str, prompt_sets: List[Dict[str, str]], max_concurrent_requests: int = 8, response_cache=None, extraction_workers: int = 1, manifest=None, token_budget=None, dedup_threshold=None,
+                                  output_format: str = "yaml", fsync_every: int = DEFAULT_FSYNC_EVERY, stream: bool = False, page_selection=None, rate_limiter=None,
+                                  max_concurrent_pdfs: int = DEFAULT_MAX_CONCURRENT_PDFS, cache_dir=None):
+    """
+    Async counterpart of process_directory: fans out (pdf, page, prompt_set) requests with a concurrency limit.
+
+    At most max_concurrent_pdfs PDFs are extracted or in flight at once, so the page texts held in memory
+    and the output files kept open stay bounded however many PDFs the directory holds. PDFs are extracted
+    concurrently but deduplicated in file order, so the same pages are dropped as in the sync mode.
+    """
+    output_dir = get_output_dir(directory_path, output_format)
+    cache_dir = cache_dir or get_page_cache_dir(directory_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    executor = ProcessPoolExecutor(max_workers=extraction_workers) if extraction_workers > 1 else None
+    dedup_index = new_dedup_index(dedup_threshold) if dedup_threshold else None
+    pdf_paths = list_pdf_files(directory_path)
+    pending = plan_pdf_work(manifest, pdf_paths, output_dir, prompt_sets, output_format, page_selection, token_budget, dedup_threshold)
+    seed_dedup_index(dedup_index, [file_path for file_path in pdf_paths if file_path not in pending], cache_dir, page_selection)
+
+    pdf_slots = asyncio.Semaphore(max(1, max_concurrent_pdfs))
+
+    # Each PDF holds a slot from the start of its extraction until its last response is written. Its turn to
+    # deduplicate comes once the previous PDF has been deduplicated, whichever extraction finishes first.
+    async def run_pdf(file_path, dedup_turn, next_dedup_turn):
+        page_spec = page_spec_for(page_selection, file_path)
+        try:
+            try:
+                extracted = await extract_pdf_async(file_path, cache_dir, executor, page_spec)
+                if dedup_index is not None:
+                    await dedup_turn.wait()
+                    if extracted is not None:
+                        pdf_hash, pdf_content = extracted
+                        extracted = pdf_hash, drop_duplicates(file_path, pdf_content, dedup_index, page_spec)
+            finally:
+                next_dedup_turn.set()
+            if extracted is None:
+                return
+            completed = await process_pdf_async(client, file_path, output_dir, pending[file_path], semaphore, cache_dir, response_cache, executor, token_budget, None,
+                                                output_format, fsync_every, stream, page_spec, rate_limiter, extracted)
+            record_completed(manifest, file_path, output_dir, pending[file_path], completed, output_format, page_spec, token_budget, dedup_threshold)
+        # As in the sync mode, a PDF that fails is reported and the others carry on
+        except Exception as e:
+            print(f"Error processing {file_path}: {e}")
+        finally:
+            pdf_slots.release()
+
+    try:
+        tasks = []
+        dedup_turn = asyncio.Event()
+        dedup_turn.set()
+        # Slots are taken in file order, so the PDF whose turn it is to deduplicate always holds one
+        for file_path in pending:
+            await pdf_slots.acquire()
+            next_dedup_turn = asyncio.Event()
+            tasks.append(asyncio.create_task(run_pdf(file_path, dedup_turn, next_dedup_turn)))
+            dedup_turn = next_dedup_turn
+        await asyncio.gather(*tasks)
+        write_dedup_report(dedup_index, directory_path)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def process_directory_batch(client, directory_path: str, prompt_sets: List[Dict[str, str]], response_cache=None, extraction_workers: int = 1,
+                            manifest=None, token_budget=None, dedup_threshold=None, poll_interval: int = 60, max_attempts: int = 3, output_format: str = "yaml",
+                            page_selection=None, rate_limiter=None, cache_dir=None):
+    """
+    Batch API counterpart of process_directory, for bulk runs where cost and rate limits matter more than latency.
+
+    Every (page, prompt set) request not already in the response cache goes into a batch input file that is
+    submitted as an asynchronous batch job. Requests that fail are resubmitted in follow-up batches, up to
+    max_attempts batches in total. The results are written to the same per-PDF files as process_directory.
+    """
+    output_dir = get_output_dir(directory_path, output_format)
+    cache_dir = cache_dir or get_page_cache_dir(directory_path)
+    batch_dir = os.path.join(directory_path, 'batch_files')
+    os.makedirs(output_dir, exist_ok=True)
+
+    dedup_index = new_dedup_index(dedup_threshold) if dedup_threshold else None
+    pdf_paths = list_pdf_files(directory_path)
+    pending = plan_pdf_work(manifest, pdf_paths, output_dir, prompt_sets, output_format, page_selection, token_budget, dedup_threshold)
+    seed_dedup_index(dedup_index, [file_path for file_path in pdf_paths if file_path not in pending], cache_dir, page_selection)
+
+    # One job per (PDF file + prompt set); batch_requests maps each custom_id back to its job and page
+    jobs = []
+    batch_requests = {}
+    for file_path, pdf_hash, pdf_content in iter_extracted_pdfs(list(pending), cache_dir, extraction_workers, page_selection):
+        pdf_content = drop_duplicates(file_path, pdf_content, dedup_index, page_spec_for(page_selection, file_path))
+        request_units = build_request_units(file_path, pdf_content, pending[file_path], token_budget, output_format)
+        for prompt_set in pending[file_path]:
+            job = {'file_path': file_path, 'pdf_hash': pdf_hash, 'prompt_set': prompt_set, 'responses': [None] * len(request_units)}
+            jobs.append(job)
+            for page_num, (pdf_page_content, max_tokens) in enumerate(request_units):
+                page_ref = {'document': os.path.basename(file_path), 'pdf_hash': pdf_hash, 'prompt_set': prompt_set['name'], 'page_num': page_num}
+                request = build_request(pdf_page_content, prompt_set, max_tokens, output_format)
+                cache_key, cached_response = lookup_cached_response(response_cache, request, page_ref)
+                if cached_response is not None:
+                    job['responses'][page_num] = cached_response
+                    continue
+                custom_id = f"request-{len(batch_requests)}"
+                batch_requests[custom_id] = (job, page_num, request, cache_key, page_ref)
+
+    remaining = batch_requests
+    for attempt in range(1, max_attempts + 1):
+        if not remaining:
+            break
+        print(f"Submitting batch attempt {attempt}/{max_attempts} with {len(remaining)} requests")
+        if attempt > 1:
+            increment('retries', len(remaining))
+        results = run_batch(client, {custom_id: entry[2] for custom_id, entry in remaining.items()}, batch_dir, poll_interval, rate_limiter=rate_limiter)
+        for custom_id, body in results.items():
+            job, page_num, request, cache_key, page_ref = remaining[custom_id]
+            usage = body.get('usage') or {}
+            increment('batch_prompt_tokens', usage.get('prompt_tokens', 0))
+            increment('batch_completion_tokens', usage.get('completion_tokens', 0))
+            increment('batch_cached_tokens', (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0))
+            response_text = parse_response_text(response_content(body), output_format)
+            if response_text:
+                job['responses'][page_num] = response_text
+                store_response(response_cache, cache_key, request, response_text, page_ref)
+        remaining = {custom_id: entry for custom_id, entry in remaining.items() if entry[0]['responses'][entry[1]] is None}
+    if remaining:
+        print(f"{len(remaining)} requests still failed after {max_attempts} batch attempts")
+
+    for job in jobs:
+        prompt_set_name = job['prompt_set']['name']
+        all_responses = [response for response in job['responses'] if response]
+        # An output missing pages is not written; the responses received are cached, so a rerun only resubmits the failed requests
+        if len(all_responses) < len(job['responses']):
+            print(f"Not writing {os.path.basename(job['file_path'])} with prompt {prompt_set_name}: "
+                  f"{len(job['responses']) - len(all_responses)} requests got no response; rerun to retry them")
+            continue
+        output_file_path = write_responses(job['file_path'], output_dir, prompt_set_name, all_responses, output_format)
+        print(f"Finished processing {os.path.basename(job['file_path'])} with prompt: {prompt_set_name}. \nOutput saved to {output_file_path}")
+        prune_cached_pages(response_cache, job['file_path'], job['pdf_hash'], prompt_set_name, len(all_responses))
+        record_completed(manifest, job['file_path'], output_dir, [job['prompt_set']], [prompt_set_name], output_format,
+                         page_spec_for(page_selection, job['file_path']), token_budget, dedup_threshold)
+    write_dedup_report(dedup_index, directory_path)
+
+def rebuild_outputs_from_cache(response_cache, output_dir, output_format="yaml"):
+    """
+    Rebuilds the per-PDF output files from the response cache alone, without reading PDFs or calling the API.
+
+    Only documents whose last complete run is cached in full are rebuilt. The others are reported and
+    left alone: documents with no complete run, with pages whose response was evicted, or, in the jsonl
+    format, with pages last processed in the yaml format.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for document, prompt_set_name, responses in iter_cached_documents(response_cache):
+        if responses is None:
+            problem = "no complete run is cached"
+        else:
+            missing = sum(1 for response in responses if response is None or (output_format == "jsonl" and not is_training_record(response)))
+            problem = f"{missing} of its {len(responses)} pages have no usable cached response" if missing else None
+        if problem:
+            print(f"Not rebuilding {document} with prompt {prompt_set_name}: {problem}; rerun without --resume to process it")
+            continue
+        output_file_path = write_responses(document, output_dir, prompt_set_name, responses, output_format)
+        print(f"Rebuilt {output_file_path} from {len(responses)} cached responses")
+
+# Print how many fresh responses could not be parsed into training examples
+def report_parse_failures():
+    counters = metrics_summary()['counters']
+    parsed, failed = counters.get('responses_parsed', 0), counters.get('response_parse_failures', 0)
+    if parsed + failed:
+        print(f"{failed} of {parsed + failed} responses failed to parse ({failed / (parsed + failed):.1%})")
+
+# Print how much of the prompt the provider served from its prompt cache, and what that saved
+def report_prompt_cache(prompt_price=None, cached_prompt_price=None):
+    summary = metrics_summary()
+    totals = summary['requests'].get('chat_completion', {})
+    prompt_tokens = totals.get('prompt_tokens', 0) + summary['counters'].get('batch_prompt_tokens', 0)
+    cached_tokens = totals.get('cached_tokens', 0) + summary['counters'].get('batch_cached_tokens', 0)
+    if not prompt_tokens:
+        return
+    report = f"Prompt cache: {cached_tokens} of {prompt_tokens} prompt tokens were cached ({cached_tokens / prompt_tokens:.1%})"
+    if prompt_price is not None and cached_prompt_price is not None:
+        report += f", saving about ${cached_tokens * (prompt_price - cached_prompt_price) / 1_000_000:.4f}"
+    print(report)
+
+    cached_requests = totals.get('cached_requests', 0)
+    other_requests = totals.get('count', 0) - cached_requests
+    if cached_requests and other_requests:
+        cached_latency = totals['cached_latency_sum'] / cached_requests
+        other_latency = (totals['latency_sum'] - totals['cached_latency_sum']) / other_requests
+        print(f"Mean latency: {cached_latency:.2f}s for requests with cached prompt tokens, {other_latency:.2f}s for the others")
 
 # Main function to process all PDFs in a directory with a specified prompt set list
 def main():
+    parser = argparse.ArgumentParser(description="Generate fine-tuning YAML (or JSONL) files from the PDFs in pdf_directory.")
+    parser.add_argument('--resume', action='store_true', help="Rebuild the outputs from the response cache without calling the API")
+    parser.add_argument('--full', action='store_true', help="Reprocess every PDF, ignoring the manifest")
+    args = parser.parse_args()
+
     # Load configuration from config.yaml
     config = load_config()
     
@@ -127,15 +952,72 @@ def main():
     selected_prompt_set_list = getattr(prompt_sets_module, config['selected_prompt_set_list'])
 
     pdf_directory = config['pdf_directory']
-    output_dir = config['yaml_directory']
-
-    
-    client = init_openai_client()
+    # "yaml" for the threadObject YAML files, "jsonl" for training records written straight to jsonl_files
+    output_format = config.get('output_format', 'yaml')
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}, not {output_format!r}")
+    output_dir = config['jsonl_directory'] if output_format == 'jsonl' else config['yaml_directory']
+    # The provider only caches the prefix every request of a prompt set shares if it is long enough
+    for prompt_set in selected_prompt_set_list:
+        prefix_tokens = shared_prefix_tokens(prompt_set, output_format)
+        if prefix_tokens < MIN_CACHED_PREFIX_TOKENS:
+            print(f"Prompt set {prompt_set['name']} shares ~{prefix_tokens} prompt tokens across requests; "
+                  f"prompt caching only applies from {MIN_CACHED_PREFIX_TOKENS}")
 
     # Make sure output directory exists
     os.makedirs(output_dir, exist_ok=True)
 
-    process_directory(client, pdf_directory, selected_prompt_set_list)
+    response_cache = open_response_cache(config['response_cache_path'])
+    evicted = evict_responses(response_cache, config.get('response_cache_max_size_mb'), config.get('response_cache_max_age_days'))
+    if evicted:
+        print(f"Evicted {evicted} entries from the response cache")
+
+    # Number of processes used for PDF text extraction; null uses every CPU core
+    extraction_workers = config.get('extraction_workers', 1) or os.cpu_count()
+    # Shared with every other process using the same pdf_directory, e.g. work queue workers
+    rate_limiter = init_rate_limiter(config)
+    # Pages to process per PDF file name, as page ranges or outline section titles; other PDFs are read in full
+    page_selection = config.get('page_selection') or {}
+    # Responses written between fsyncs of a partially written output file
+    fsync_every = config.get('fsync_every', DEFAULT_FSYNC_EVERY)
+    # Consume completions as a stream of chunks (not used by the batch mode)
+    stream = config.get('stream_responses', False)
+    # Input-token budget for packing pages into one request; null sends one page per request
+    token_budget = config.get('chunk_token_budget')
+    # Pages at least this similar to a page already seen are skipped; null disables deduplication
+    dedup_threshold = config.get('dedup_threshold')
+
+    # The manifest lets reruns skip (PDF + prompt set) combinations whose inputs have not changed
+    manifest_file = manifest_path(config)
+    manifest = load_manifest(manifest_file)
+    if args.full:
+        manifest['stages'].pop('process_pdf', None)
+
+    try:
+        with profiled(profile_path(config, 'process_pdf')), stage_timer('process_pdf'):
+            if args.resume:
+                rebuild_outputs_from_cache(response_cache, output_dir, output_format)
+            elif config.get('execution_mode', 'sync') == 'batch':
+                client = init_openai_client()
+                process_directory_batch(client, pdf_directory, selected_prompt_set_list, response_cache, extraction_workers, manifest, token_budget,
+                                        dedup_threshold, config.get('batch_poll_interval_seconds', 60), config.get('batch_max_attempts', 3), output_format,
+                                        page_selection, rate_limiter, config['page_cache_directory'])
+            elif config.get('execution_mode', 'sync') == 'async':
+                client = init_async_openai_client()
+                max_concurrent_requests = config.get('max_concurrent_requests', 8)
+                asyncio.run(process_directory_async(client, pdf_directory, selected_prompt_set_list, max_concurrent_requests, response_cache, extraction_workers, manifest, token_budget, dedup_threshold,
+                                                    output_format, fsync_every, stream, page_selection, rate_limiter,
+                                                    config.get('max_concurrent_pdfs', DEFAULT_MAX_CONCURRENT_PDFS), config['page_cache_directory']))
+            else:
+                client = init_openai_client()
+                process_directory(client, pdf_directory, selected_prompt_set_list, response_cache, extraction_workers, manifest, token_budget, dedup_threshold,
+                                  output_format, fsync_every, stream, page_selection, rate_limiter, config['page_cache_directory'])
+            report_parse_failures()
+            report_prompt_cache(config.get('prompt_price_per_million_tokens'), config.get('cached_prompt_price_per_million_tokens'))
+    finally:
+        save_manifest(manifest, manifest_file)
+        response_cache.close()
+        export_metrics(config['metrics_directory'], 'process_pdf')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
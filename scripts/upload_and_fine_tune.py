@@ -1,114 +1,200 @@
-import os
-import time
-import json
-from datetime import datetime
-from openai import OpenAI
-from utils.loader import load_config, init_openai_client
-
-client = init_openai_client()
-
-def upload_file(file_path):
-    """Uploads a file to OpenAI and returns the file ID."""
-    try:
-        with open(file_path, "rb") as f:
-            response = client.files.create(
-                file=f,
-                purpose='fine-tune'
-            )
-        print(response)
-        file_id = response.id
-        print(f"File {file_path} uploaded successfully with ID: {file_id}")
-        return file_id
-    except Exception as e:
-        print(f"Error uploading file {file_path}: {e}")
-        return None
-
-def create_fine_tune(file_id):
-    """Creates a fine-tuning job with the uploaded file ID."""
-    try:
-        response = client.fine_tuning.jobs.create(
-            training_file=file_id,
-            model="gpt-4o-mini-2024-07-18"  # Specify the base model to fine-tune
-        )
-        fine_tune_id = response.id
-        print(f"Fine-tuning job created with ID: {fine_tune_id}")
-        return fine_tune_id
-    except Exception as e:
-        print(f"Error creating fine-tuning job: {e}")
-        return None
-
-def monitor_fine_tune(fine_tune_id):
-    """Monitors the fine-tuning job until it is complete and returns the final status."""
-    final_status = None
-    while True:
-        try:
-            fine_tune_status = client.fine_tuning.jobs.retrieve(fine_tune_id)
-            status = fine_tune_status.status
-            print(f"Fine-tune job status: {status}")
-            if status in ["succeeded", "failed"]:  # Check for terminal statuses
-                final_status = status
-                break
-            time.sleep(30)  # Wait for 30 seconds before checking again
-        except Exception as e:
-            print(f"Error monitoring fine-tuning job: {e}")
-            final_status = "error"
-            break
-    return final_status
-
-def log_fine_tune_jobs(directory, log_entries):
-    """Logs the fine-tune job entries to fine_tune_log.json in the specified directory."""
-    log_file_path = os.path.join(directory, 'fine_tune_log.json')
-    if os.path.exists(log_file_path):
-        with open(log_file_path, 'r') as log_file:
-            existing_entries = json.load(log_file)
-    else:
-        existing_entries = []
-
-    existing_entries.extend(log_entries)
-
-    with open(log_file_path, 'w') as log_file:
-        json.dump(existing_entries, log_file, indent=4, default=str)
-
-def get_fine_tuned_model_id(fine_tune_id):
-    """Retrieves the model ID from a completed fine-tuning job."""
-    try:
-        fine_tune_details = client.fine_tuning.jobs.retrieve(fine_tune_id)
-        model_id = fine_tune_details.fine_tuned_model
-        print(f"Fine-tuned model ID: {model_id}")
-        return model_id
-    except Exception as e:
-        print(f"Error retrieving fine-tuned model ID: {e}")
-        return None
-
-if __name__ == "__main__":
-
-    config = load_config()
-    input_dir = config['combined_jsonl_directory']
-    combined_jsonl_file = os.path.join(input_dir, "combined_data.jsonl")
-
-    log_entries = []
-
-    # Upload the combined JSONL file
-    file_id = upload_file(combined_jsonl_file)
-    if file_id:
-        # Create and monitor the fine-tuning job
-        fine_tune_id = create_fine_tune(file_id)
-        if fine_tune_id:
-            final_status = monitor_fine_tune(fine_tune_id)
-            log_entry = {
-                'timestamp': datetime.now(),
-                'file_id': file_id,
-                'fine_tune_id': fine_tune_id,
-                'status': final_status
-            }
-            log_entries.append(log_entry)
-            log_fine_tune_jobs(input_dir, log_entries)
-            
-            # Retrieve and log the fine-tuned model ID
-            if final_status == "succeeded":
-                model_id = get_fine_tuned_model_id(fine_tune_id)
-                if model_id:
-                    log_entry['model_id'] = model_id
-                    log_fine_tune_jobs(input_dir, log_entries)
-    # fine_tune_id = "ftjob-xe4decKZxiRRom2sROopGOJk"
-    # monitor_fine_tune(fine_tune_id)
+import os
+import time
+import json
+from datetime import datetime
+from openai import OpenAI
+from utils.loader import load_config, init_openai_client
+from scripts.validate_dataset import validate_from_config
+from utils.multipart_upload import multipart_upload, MAX_PART_SIZE
+from utils.rate_limit import call_with_rate_limit, init_rate_limiter, is_transient
+from utils.metrics import stage_timer, record_request, increment, export_metrics, profiled, profile_path
+
+client = init_openai_client()
+# Shared with process_pdf.py and work queue workers, so uploads and monitoring count against the same budgets
+rate_limiter = init_rate_limiter(load_config())
+
+# Fine-tune job statuses after which the job will not change any more
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+def validate_before_upload(config, file_path):
+    """
+    Validates the training file and stops the script before anything is uploaded if it is not valid,
+    so a malformed example fails here in seconds rather than after the job is queued.
+    """
+    with stage_timer('validate_dataset'):
+        report = validate_from_config(config, file_path)
+    if not report['valid']:
+        raise SystemExit(f"{file_path} failed validation; fix the problems above before uploading.")
+
+def upload_file(file_path, part_size=MAX_PART_SIZE, max_workers=4):
+    """
+    Uploads a file to OpenAI and returns the file ID.
+
+    Files larger than one part go through a concurrent, resumable multipart upload.
+    """
+    try:
+        if os.path.getsize(file_path) > part_size:
+            file_id = multipart_upload(client, file_path, 'fine-tune', part_size, max_workers, rate_limiter=rate_limiter)
+            print(f"File {file_path} uploaded successfully with ID: {file_id}")
+            return file_id
+
+        def send():
+            with open(file_path, "rb") as f:
+                return client.files.create(
+                    file=f,
+                    purpose='fine-tune'
+                )
+
+        start = time.time()
+        response = call_with_rate_limit(rate_limiter, 'files', send)
+        record_request('file_upload', start)
+        increment('bytes_uploaded', os.path.getsize(file_path))
+        print(response)
+        file_id = response.id
+        print(f"File {file_path} uploaded successfully with ID: {file_id}")
+        return file_id
+    except Exception as e:
+        print(f"Error uploading file {file_path}: {e}")
+        return None
+
+def create_fine_tune(file_id):
+    """Creates a fine-tuning job with the uploaded file ID."""
+    try:
+        response = call_with_rate_limit(rate_limiter, 'fine_tuning', lambda: client.fine_tuning.jobs.create(
+            training_file=file_id,
+            model="gpt-4o-mini-2024-07-18"  # Specify the base model to fine-tune
+        ))
+        fine_tune_id = response.id
+        print(f"Fine-tuning job created with ID: {fine_tune_id}")
+        return fine_tune_id
+    except Exception as e:
+        print(f"Error creating fine-tuning job: {e}")
+        return None
+
+def fetch_new_events(fine_tune_id, last_event_id=None):
+    """Returns the job's events newer than last_event_id, oldest first."""
+    start = time.time()
+    events = call_with_rate_limit(rate_limiter, 'fine_tuning', lambda: client.fine_tuning.jobs.list_events(fine_tuning_job_id=fine_tune_id, limit=100)).data
+    record_request('list_events', start)
+    new_events = []
+    for event in events:  # The API lists events newest first
+        if event.id == last_event_id:
+            break
+        new_events.append(event)
+    return list(reversed(new_events))
+
+def monitor_fine_tunes(fine_tune_ids, min_interval=5, max_interval=120, sleep=time.sleep):
+    """
+    Monitors several fine-tuning jobs until all of them are complete and returns their final statuses.
+
+    Each job's event stream is printed as it arrives. The job status is only re-checked when new
+    events show up or the interval is at its maximum, and the poll interval doubles (up to max_interval) while nothing happens and
+    drops back to min_interval as soon as there is activity. Calls are retried through call_with_rate_limit, and a
+    job whose calls still fail transiently is polled again next time.
+
+    :param sleep: Function waiting between polls, called with the interval in seconds.
+    :return: Dict mapping fine-tune job ID to its final status ("error" if monitoring failed for good).
+    """
+    final_statuses = {}
+    last_event_ids = {fine_tune_id: None for fine_tune_id in fine_tune_ids}
+    checked_ids = set()
+    interval = min_interval
+    while len(final_statuses) < len(fine_tune_ids):
+        activity = False
+        for fine_tune_id in fine_tune_ids:
+            if fine_tune_id in final_statuses:
+                continue
+            try:
+                new_events = fetch_new_events(fine_tune_id, last_event_ids[fine_tune_id])
+                for event in new_events:
+                    print(f"[{fine_tune_id}] {event.message}")
+                checked = fine_tune_id in checked_ids
+                if new_events:
+                    activity = True
+                    last_event_ids[fine_tune_id] = new_events[-1].id
+                # Status changes come with a new event, so quiet jobs are only re-fetched once the backoff maxes out
+                if new_events or not checked or interval >= max_interval:
+                    status = call_with_rate_limit(rate_limiter, 'fine_tuning', lambda: client.fine_tuning.jobs.retrieve(fine_tune_id)).status
+                    checked_ids.add(fine_tune_id)
+                    print(f"Fine-tune job {fine_tune_id} status: {status}")
+                    if status in TERMINAL_STATUSES:
+                        final_statuses[fine_tune_id] = status
+            except Exception as e:
+                if is_transient(e):
+                    print(f"Error monitoring fine-tuning job {fine_tune_id}: {e}; checking again at the next poll")
+                    continue
+                print(f"Error monitoring fine-tuning job {fine_tune_id}: {e}")
+                final_statuses[fine_tune_id] = "error"
+
+        if len(final_statuses) < len(fine_tune_ids):
+            interval = min_interval if activity else min(interval * 2, max_interval)
+            sleep(interval)
+    return final_statuses
+
+def monitor_fine_tune(fine_tune_id):
+    """Monitors the fine-tuning job until it is complete and returns the final status."""
+    return monitor_fine_tunes([fine_tune_id])[fine_tune_id]
+
+def log_fine_tune_jobs(directory, log_entries):
+    """Logs the fine-tune job entries to fine_tune_log.json in the specified directory."""
+    log_file_path = os.path.join(directory, 'fine_tune_log.json')
+    if os.path.exists(log_file_path):
+        with open(log_file_path, 'r') as log_file:
+            existing_entries = json.load(log_file)
+    else:
+        existing_entries = []
+
+    existing_entries.extend(log_entries)
+
+    with open(log_file_path, 'w') as log_file:
+        json.dump(existing_entries, log_file, indent=4, default=str)
+
+def get_fine_tuned_model_id(fine_tune_id):
+    """Retrieves the model ID from a completed fine-tuning job."""
+    try:
+        fine_tune_details = call_with_rate_limit(rate_limiter, 'fine_tuning', lambda: client.fine_tuning.jobs.retrieve(fine_tune_id))
+        model_id = fine_tune_details.fine_tuned_model
+        print(f"Fine-tuned model ID: {model_id}")
+        return model_id
+    except Exception as e:
+        print(f"Error retrieving fine-tuned model ID: {e}")
+        return None
+
+if __name__ == "__main__":
+
+    config = load_config()
+    input_dir = config['combined_jsonl_directory']
+    combined_jsonl_file = os.path.join(input_dir, "combined_data.jsonl")
+
+    log_entries = []
+
+    validate_before_upload(config, combined_jsonl_file)
+
+    # Upload the combined JSONL file; monitoring mostly sleeps, so only the upload is profiled
+    with profiled(profile_path(config, 'upload_and_fine_tune')), stage_timer('upload_file'):
+        file_id = upload_file(combined_jsonl_file, config.get('upload_part_mb', 64) * 1024 * 1024, config.get('upload_workers', 4))
+    export_metrics(config['metrics_directory'], 'upload_and_fine_tune')
+    if file_id:
+        # Create and monitor the fine-tuning job
+        fine_tune_id = create_fine_tune(file_id)
+        if fine_tune_id:
+            with stage_timer('monitor_fine_tune'):
+                final_status = monitor_fine_tune(fine_tune_id)
+            export_metrics(config['metrics_directory'], 'upload_and_fine_tune')
+            log_entry = {
+                'timestamp': datetime.now(),
+                'file_id': file_id,
+                'fine_tune_id': fine_tune_id,
+                'status': final_status
+            }
+            log_entries.append(log_entry)
+            log_fine_tune_jobs(input_dir, log_entries)
+            
+            # Retrieve and log the fine-tuned model ID
+            if final_status == "succeeded":
+                model_id = get_fine_tuned_model_id(fine_tune_id)
+                if model_id:
+                    log_entry['model_id'] = model_id
+                    log_fine_tune_jobs(input_dir, log_entries)
+    # fine_tune_id = "ftjob-xe4decKZxiRRom2sROopGOJk"
+    # monitor_fine_tune(fine_tune_id)
@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import argparse
+from utils.loader import load_config
+from utils.chunking import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # Optional; without it token counts are estimated from the text length
+    tiktoken = None
+
+# Chat formatting overhead the API adds around each message and each example
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_EXAMPLE = 3
+VALID_ROLES = ("system", "user", "assistant")
+# The fine-tuning API rejects training files with fewer examples than this
+MIN_EXAMPLES = 10
+# Only the first errors are listed line by line; the rest are just counted
+MAX_REPORTED_ERRORS = 20
+# Tokenizer of the gpt-4o models that are fine-tuned
+TOKENIZER_ENCODING = "o200k_base"
+# Valid examples are tokenized this many at a time
+TOKENIZE_BATCH_SIZE = 1000
+
+def check_example(example):
+    """
+    Checks one training example against the chat fine-tuning format.
+
+    :param example: Parsed JSONL record.
+    :return: List of error descriptions; empty if the example is valid.
+    """
+    if not isinstance(example, dict):
+        return ["record is not a JSON object"]
+    messages = example.get('messages')
+    if not isinstance(messages, list) or not messages:
+        return ["missing or empty 'messages' list"]
+
+    errors = []
+    roles = []
+    for i, message in enumerate(messages):
+        if not isinstance(message, dict):
+            errors.append(f"message {i} is not an object")
+            continue
+        role = message.get('role')
+        content = message.get('content')
+        if role is None:
+            errors.append(f"message {i} has no role")
+        elif role not in VALID_ROLES:
+            errors.append(f"message {i} has unknown role {role!r}")
+        if not isinstance(content, str):
+            errors.append(f"message {i} ({role}) content is {type(content).__name__}, not a string")
+        elif not content.strip():
+            errors.append(f"message {i} ({role}) has empty content")
+        roles.append(role)
+
+    # Expected order: an optional system message, then user/assistant turns, ending with the assistant
+    conversation = roles[1:] if roles and roles[0] == 'system' else roles
+    if 'system' in conversation:
+        errors.append("system message is not the first message")
+    if 'assistant' not in conversation:
+        errors.append("no assistant message")
+    elif conversation[-1] != 'assistant':
+        errors.append("conversation does not end with an assistant message")
+    if conversation and conversation[0] != 'user':
+        errors.append("conversation does not start with a user message")
+    for previous, current in zip(conversation, conversation[1:]):
+        if previous == current and previous in ('user', 'assistant'):
+            errors.append(f"two consecutive {current} messages")
+            break
+    return errors
+
+def error_kind(error):
+    """Collapse an error description into its kind, e.g. 'message 3 (user) has no role' -> 'message N has no role'."""
+    kind = re.sub(r'\(.*?\)', '', error)
+    kind = re.sub(r'\d+', 'N', kind)
+    return ' '.join(kind.split())
+
+def load_tokenizer():
+    """Returns the tiktoken encoding of the fine-tuned models, or None if tiktoken is not installed or the encoding cannot be loaded."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        print(f"Could not load the {TOKENIZER_ENCODING} tokenizer ({e}); estimating token counts instead")
+        return None
+
+def count_example_tokens(examples, tokenizer=None):
+    """
+    Counts the prompt tokens of valid examples, including chat formatting overhead.
+
+    :param examples: Valid examples, as checked by check_example.
+    :param tokenizer: tiktoken encoding; the message contents of all examples are encoded in one batch.
+                      If None, tokens are estimated from the text length.
+    :return: List of token counts, one per example.
+    """
+    contents = [message['content'] for example in examples for message in example['messages']]
+    if tokenizer is not None:
+        content_tokens = [len(tokens) for tokens in tokenizer.encode_batch(contents, disallowed_special=())]
+    else:
+        content_tokens = [estimate_tokens(content) for content in contents]
+
+    token_counts = []
+    position = 0
+    for example in examples:
+        message_tokens = content_tokens[position:position + len(example['messages'])]
+        position += len(example['messages'])
+        token_counts.append(TOKENS_PER_EXAMPLE + sum(TOKENS_PER_MESSAGE + tokens for tokens in message_tokens))
+    return token_counts
+
+def histogram_median(histogram):
+    """Returns the median of the values counted in a {value: count} histogram (the upper one for an even count)."""
+    remaining = sum(histogram.values()) // 2
+    for value in sorted(histogram):
+        remaining -= histogram[value]
+        if remaining < 0:
+            return value
+    return 0
+
+def validate_dataset(file_path, max_example_tokens=65536, n_epochs=3, price_per_million_tokens=3.0, tokenizer=None):
+    """
+    Validates a training JSONL file in one streaming pass and profiles its token counts.
+
+    :param file_path: Path to the JSONL file, e.g. combined_data.jsonl.
+    :param max_example_tokens: Examples longer than this are reported as errors.
+    :param n_epochs: Epochs used for the training token and cost estimate.
+    :param price_per_million_tokens: Training price used for the cost estimate.
+    :param tokenizer: tiktoken encoding used to count tokens (see load_tokenizer). If None, token counts are estimated.
+    :return: Report dict; report['valid'] is False if the file must not be uploaded.
+    """
+    error_counts = {}
+    error_samples = []
+    example_count = 0
+    invalid_count = 0
+    # Token count -> number of examples; its size depends on the spread of token counts, not on the dataset size
+    token_histogram = {}
+    dataset_tokens = 0
+    pending = []  # (line number, example) of valid examples waiting to be tokenized
+
+    def record_errors(line_num, errors):
+        nonlocal invalid_count
+        if errors:
+            invalid_count += 1
+        for error in errors:
+            kind = error_kind(error)
+            error_counts[kind] = error_counts.get(kind, 0) + 1
+            if len(error_samples) < MAX_REPORTED_ERRORS:
+                error_samples.append(f"line {line_num}: {error}")
+
+    def count_pending():
+        nonlocal dataset_tokens
+        token_counts = count_example_tokens([example for _, example in pending], tokenizer)
+        for (line_num, _), tokens in zip(pending, token_counts):
+            token_histogram[tokens] = token_histogram.get(tokens, 0) + 1
+            dataset_tokens += tokens
+            if tokens > max_example_tokens:
+                record_errors(line_num, [f"example has {'' if tokenizer else '~'}{tokens} tokens, over the {max_example_tokens} limit"])
+        pending.clear()
+
+    with open(file_path, 'r', encoding='utf-8') as jsonl_file:
+        for line_num, line in enumerate(jsonl_file, start=1):
+            if not line.strip():
+                continue
+            example_count += 1
+            try:
+                example = json.loads(line)
+            except json.JSONDecodeError as e:
+                errors = [f"invalid JSON ({e.msg})"]
+            else:
+                errors = check_example(example)
+                if not errors:
+                    pending.append((line_num, example))
+                    if len(pending) >= TOKENIZE_BATCH_SIZE:
+                        count_pending()
+            record_errors(line_num, errors)
+    count_pending()
+
+    if example_count < MIN_EXAMPLES:
+        error_counts[f"fewer than {MIN_EXAMPLES} examples"] = 1
+
+    report = {
+        'file': file_path,
+        'examples': example_count,
+        'invalid_examples': invalid_count,
+        'errors': error_counts,
+        'error_samples': error_samples,
+        'tokens_estimated': tokenizer is None,
+        'dataset_tokens': dataset_tokens,
+        'training_tokens': dataset_tokens * n_epochs,
+        'estimated_cost': round(dataset_tokens * n_epochs * price_per_million_tokens / 1_000_000, 2),
+        'min_tokens': min(token_histogram, default=0),
+        'median_tokens': histogram_median(token_histogram),
+        'max_tokens': max(token_histogram, default=0),
+        'valid': not error_counts,
+    }
+    return report
+
+def print_report(report):
+    """Prints a validation report in a human-readable form."""
+    print(f"Validated {report['examples']} examples in {report['file']}")
+    if report['errors']:
+        print(f"Found problems in {report['invalid_examples']} examples:")
+        for error, count in sorted(report['errors'].items(), key=lambda item: -item[1]):
+            print(f"    {count} x {error}")
+        for sample in report['error_samples']:
+            print(f"    {sample}")
+    if report['tokens_estimated']:
+        print(f"Token counts are estimated from the text length; install tiktoken to count them with the {TOKENIZER_ENCODING} tokenizer")
+    label = "estimated" if report['tokens_estimated'] else TOKENIZER_ENCODING
+    print(f"Tokens per example ({label}): min {report['min_tokens']}, median {report['median_tokens']}, max {report['max_tokens']}")
+    print(f"Training tokens ({label}): {report['training_tokens']} (~${report['estimated_cost']})")
+
+def validate_from_config(config, file_path):
+    """Runs validate_dataset with the limits and pricing from config.yaml and prints the report."""
+    report = validate_dataset(
+        file_path,
+        config.get('max_example_tokens', 65536),
+        config.get('fine_tune_epochs', 3),
+        config.get('training_price_per_million_tokens', 3.0),
+        load_tokenizer(),
+    )
+    print_report(report)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate a training JSONL file before uploading it.")
+    parser.add_argument('file', nargs='?', help="JSONL file to validate (defaults to combined_data.jsonl)")
+    args = parser.parse_args()
+
+    config = load_config()
+    file_path = args.file or os.path.join(config['combined_jsonl_directory'], 'combined_data.jsonl')
+    report = validate_from_config(config, file_path)
+    raise SystemExit(0 if report['valid'] else 1)
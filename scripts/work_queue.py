@@ -0,0 +1,209 @@
+import os
+import time
+import socket
+import argparse
+import threading
+import importlib
+from utils.loader import load_config, init_openai_client
+from utils.response_cache import open_response_cache
+from utils.manifest import manifest_path, load_manifest, save_manifest
+from utils.dedup import new_dedup_index
+from utils.page_selection import page_spec_for
+from utils.rate_limit import init_rate_limiter
+from utils.metrics import stage_timer, increment, export_metrics
+from utils.work_queue import (open_work_queue, enqueue_job, claim_task, heartbeat, complete_task, fail_task,
+                              retry_failed_tasks, has_unsettled_tasks, iter_settled_jobs, mark_assembled, queue_status)
+from scripts.process_pdf import (OUTPUT_FORMATS, list_pdf_files, iter_extracted_pdfs, drop_duplicates, seed_dedup_index, write_dedup_report,
+                                 build_request_units, plan_pdf_work, record_completed, get_output_dir, get_page_cache_dir, output_fingerprint,
+                                 send_to_openai, write_responses, prune_cached_pages, report_parse_failures)
+
+def enqueue_directory(conn, directory_path, prompt_sets, extraction_workers=1, manifest=None, token_budget=None, dedup_threshold=None, output_format="yaml",
+                      page_selection=None, cache_dir=None):
+    """
+    Extracts the PDFs whose outputs are stale and queues one task per (request unit, prompt set).
+
+    Request units are built exactly as process_pdf.py builds them (deduplication and page packing included),
+    and their text is stored in the queue, so workers do not need to read the PDFs.
+
+    :return: (jobs added, tasks added)
+    """
+    output_dir = get_output_dir(directory_path, output_format)
+    cache_dir = cache_dir or get_page_cache_dir(directory_path)
+    dedup_index = new_dedup_index(dedup_threshold) if dedup_threshold else None
+    pdf_paths = list_pdf_files(directory_path)
+    pending = plan_pdf_work(manifest, pdf_paths, output_dir, prompt_sets, output_format, page_selection, token_budget, dedup_threshold)
+    seed_dedup_index(dedup_index, [file_path for file_path in pdf_paths if file_path not in pending], cache_dir, page_selection)
+
+    jobs_added = tasks_added = 0
+    for file_path, pdf_hash, pdf_content in iter_extracted_pdfs(list(pending), cache_dir, extraction_workers, page_selection):
+        pdf_content = drop_duplicates(file_path, pdf_content, dedup_index, page_spec_for(page_selection, file_path))
+        request_units = build_request_units(file_path, pdf_content, pending[file_path], token_budget, output_format)
+        for prompt_set in pending[file_path]:
+            job_id = output_fingerprint(pdf_hash, prompt_set, request_units, output_format)
+            # Jobs already in the queue (same PDF version, prompt set and requests) are not queued twice
+            if enqueue_job(conn, job_id, file_path, pdf_hash, prompt_set, output_format, request_units):
+                jobs_added += 1
+                tasks_added += len(request_units)
+    write_dedup_report(dedup_index, directory_path)
+    return jobs_added, tasks_added
+
+def _send_heartbeats(db_path, worker, lease_seconds, stop):
+    """Extends the worker's leases every third of the lease period until stop is set. Runs on its own connection."""
+    conn = open_work_queue(db_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            heartbeat(conn, worker, lease_seconds)
+    finally:
+        conn.close()
+
+def run_worker(db_path, client, worker, response_cache=None, lease_seconds=300, max_attempts=3, stream=False, poll_seconds=5, rate_limiter=None):
+    """
+    Claims and runs tasks until none are pending or leased.
+
+    While other workers still hold leases, the worker keeps polling, so it can take over tasks whose
+    worker died once their lease expires. A task without a usable response goes back to the queue
+    until it has used max_attempts. Workers sharing a rate limiter keep their combined request and
+    token rates under the account limits.
+
+    :return: Number of tasks this worker completed.
+    """
+    conn = open_work_queue(db_path)
+    stop = threading.Event()
+    heartbeat_thread = threading.Thread(target=_send_heartbeats, args=(db_path, worker, lease_seconds, stop), daemon=True)
+    heartbeat_thread.start()
+    completed = 0
+    try:
+        while True:
+            task = claim_task(conn, worker, lease_seconds, max_attempts)
+            if task is None:
+                if not has_unsettled_tasks(conn):
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            document = os.path.basename(task['pdf_path'])
+            print(f"{worker}: {document} request {task['page_num'] + 1} with {task['prompt_set']['name']} (attempt {task['attempt']})")
+            page_ref = {'document': document, 'pdf_hash': task['pdf_hash'], 'prompt_set': task['prompt_set']['name'], 'page_num': task['page_num']}
+            with stage_timer('queue_task'):
+                response = send_to_openai(client, task['content'], task['prompt_set'], response_cache, page_ref,
+                                          task['max_tokens'], task['output_format'], stream, rate_limiter)
+            if response:
+                if complete_task(conn, task, worker, response):
+                    completed += 1
+                else:
+                    print(f"{worker}: lease on {document} request {task['page_num'] + 1} expired; another worker took it over")
+            elif fail_task(conn, task, worker, "no usable response", max_attempts) == 'pending':
+                increment('retries')
+    finally:
+        stop.set()
+        heartbeat_thread.join()
+        conn.close()
+    return completed
+
+def assemble_outputs(conn, directory_path, manifest=None, page_selection=None, response_cache=None, token_budget=None, dedup_threshold=None):
+    """
+    Writes the output file of every job whose tasks have all settled, in the same place and format
+    as process_pdf.py. Jobs with failed tasks are reported and left unassembled, as process_pdf.py
+    leaves an output with missing pages unfinished, until 'retry' and the workers fill them in.
+    The page selection, token budget and dedup threshold are recorded with each output, as process_pdf.py does.
+
+    :return: Number of output files written.
+    """
+    written = 0
+    for job, responses in iter_settled_jobs(conn):
+        prompt_set = job['prompt_set']
+        failed = sum(1 for response in responses if not response)
+        if failed:
+            print(f"Not assembling {os.path.basename(job['pdf_path'])} with prompt {prompt_set['name']}: {failed} requests failed; "
+                  f"run 'retry' and the workers again to fill them in")
+            continue
+        output_dir = get_output_dir(directory_path, job['output_format'])
+        os.makedirs(output_dir, exist_ok=True)
+        output_file_path = write_responses(job['pdf_path'], output_dir, prompt_set['name'], responses, job['output_format'])
+        prune_cached_pages(response_cache, job['pdf_path'], job['pdf_hash'], prompt_set['name'], job['task_count'])
+        record_completed(manifest, job['pdf_path'], output_dir, [prompt_set], [prompt_set['name']], job['output_format'],
+                         page_spec_for(page_selection, job['pdf_path']), token_budget, dedup_threshold)
+        print(f"Assembled {output_file_path}")
+        mark_assembled(conn, job['job_id'])
+        written += 1
+    return written
+
+def print_status(status):
+    """Prints a queue_status summary."""
+    tasks = status['tasks']
+    total = sum(tasks.values())
+    if not total:
+        print("The queue is empty")
+        return
+    print(f"Tasks: {tasks['done']}/{total} done ({tasks['done'] / total:.1%}), {tasks['pending']} pending, "
+          f"{tasks['leased']} leased, {tasks['failed']} failed")
+    print(f"Jobs: {status['assembled_jobs']}/{status['jobs']} assembled")
+    print(f"Throughput: {status['recent_tasks_per_second']:.2f} tasks/s over the last 5 minutes"
+          + (f", {status['overall_tasks_per_second']:.2f} tasks/s overall" if status['overall_tasks_per_second'] else ""))
+    if status['eta_seconds']:
+        print(f"Estimated time remaining: {status['eta_seconds'] / 60:.1f} minutes")
+    for worker, leased in sorted(status['active_workers'].items()):
+        print(f"    {worker}: {leased} leased tasks")
+    for error, count in status['top_errors']:
+        print(f"    {count} tasks: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Share the process_pdf.py work between any number of workers through a SQLite queue.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('enqueue', help="Queue the requests of every PDF whose outputs are stale")
+    worker_parser = subparsers.add_parser('worker', help="Claim and run queued requests until the queue is drained")
+    worker_parser.add_argument('--name', help="Worker name shown by status (defaults to <host>-<pid>)")
+    subparsers.add_parser('assemble', help="Write the output files of finished jobs")
+    subparsers.add_parser('status', help="Show progress and throughput")
+    subparsers.add_parser('retry', help="Requeue failed requests")
+    args = parser.parse_args()
+
+    config = load_config()
+    output_format = config.get('output_format', 'yaml')
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}, not {output_format!r}")
+    db_path = config['work_queue_path']
+    conn = open_work_queue(db_path)
+
+    try:
+        if args.command == 'enqueue':
+            prompt_sets_module = importlib.import_module('config.prompt_sets')
+            prompt_sets = getattr(prompt_sets_module, config['selected_prompt_set_list'])
+            manifest = load_manifest(manifest_path(config))
+            jobs_added, tasks_added = enqueue_directory(conn, config['pdf_directory'], prompt_sets, config.get('extraction_workers', 1) or os.cpu_count(),
+                                                        manifest, config.get('chunk_token_budget'), config.get('dedup_threshold'), output_format,
+                                                        config.get('page_selection'), config['page_cache_directory'])
+            save_manifest(manifest, manifest_path(config))
+            print(f"Queued {jobs_added} jobs with {tasks_added} requests in {db_path}")
+        elif args.command == 'worker':
+            worker = args.name or f"{socket.gethostname()}-{os.getpid()}"
+            response_cache = open_response_cache(config['response_cache_path'])
+            try:
+                with stage_timer('queue_worker'):
+                    completed = run_worker(db_path, init_openai_client(), worker, response_cache, config.get('task_lease_seconds', 300),
+                                           config.get('task_max_attempts', 3), config.get('stream_responses', False),
+                                           rate_limiter=init_rate_limiter(config))
+                print(f"{worker} completed {completed} requests")
+                report_parse_failures()
+            finally:
+                response_cache.close()
+                export_metrics(config['metrics_directory'], f"work_queue_{worker}")
+        elif args.command == 'assemble':
+            manifest = load_manifest(manifest_path(config))
+            response_cache = open_response_cache(config['response_cache_path'])
+            try:
+                written = assemble_outputs(conn, config['pdf_directory'], manifest, config.get('page_selection'), response_cache,
+                                           config.get('chunk_token_budget'), config.get('dedup_threshold'))
+            finally:
+                response_cache.close()
+            save_manifest(manifest, manifest_path(config))
+            print(f"Wrote {written} output files")
+        elif args.command == 'status':
+            print_status(queue_status(conn))
+        elif args.command == 'retry':
+            print(f"Requeued {retry_failed_tasks(conn)} failed requests")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
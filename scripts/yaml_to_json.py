@@ -1,8 +1,52 @@
 import os
-import yaml
 import json
 import glob
 from utils.loader import load_config
+from utils.yaml_ingest import load_documents, ROLE_KEYS
+from utils.manifest import manifest_path, load_manifest, save_manifest, is_stale, record_output
+from utils.metrics import stage_timer, increment, export_metrics, profiled, profile_path
+
+# Message role for each threadObject key
+ROLES = {'systemRoleContent': 'system', 'userRoleContent': 'user', 'assistantRoleContent': 'assistant'}
+
+def clean_yaml_lines(lines):
+    """
+    Fixes indentation issues line by line, yielding the cleaned lines.
+
+    :param lines: Iterable of raw YAML lines (with line endings).
+    :return: Generator of cleaned YAML lines.
+    """
+    inside_thread_object = False
+    for line in lines:
+        stripped_line = line.strip()
+        
+        if stripped_line == '---':
+            # Ensure delimiters are not indented
+            yield line
+            continue
+        
+        if stripped_line.startswith('threadObject:'):
+            inside_thread_object = True
+            yield line
+            continue
+        
+        if inside_thread_object:
+            if stripped_line.startswith('- '):
+                yield line
+                continue
+            
+            if stripped_line.startswith(('systemRoleContent', 'userRoleContent', 'assistantRoleContent')):
+                if not line.startswith(' '):
+                    yield '    ' + line  # Indent with 4 spaces
+                else:
+                    yield line
+            else:
+                if not line.startswith('    '):
+                    yield '        ' + line  # Indent with 8 spaces
+                else:
+                    yield line
+        else:
+            yield line
 
 def clean_yaml_file(yaml_file_path, cleaned_dir):
     """
@@ -16,37 +60,7 @@ def clean_yaml_file(yaml_file_path, cleaned_dir):
     cleaned_file_path = os.path.join(cleaned_dir, f"{base_name}_cleaned.yaml")
     
     with open(yaml_file_path, 'r') as yaml_file, open(cleaned_file_path, 'w') as cleaned_file:
-        inside_thread_object = False
-        for line in yaml_file:
-            stripped_line = line.strip()
-            
-            if stripped_line == '---':
-                # Ensure delimiters are not indented
-                cleaned_file.write(line)
-                continue
-            
-            if stripped_line.startswith('threadObject:'):
-                inside_thread_object = True
-                cleaned_file.write(line)
-                continue
-            
-            if inside_thread_object:
-                if stripped_line.startswith('- '):
-                    cleaned_file.write(line)
-                    continue
-                
-                if stripped_line.startswith(('systemRoleContent', 'userRoleContent', 'assistantRoleContent')):
-                    if not line.startswith(' '):
-                        cleaned_file.write('    ' + line)  # Indent with 4 spaces
-                    else:
-                        cleaned_file.write(line)
-                else:
-                    if not line.startswith('    '):
-                        cleaned_file.write('        ' + line)  # Indent with 8 spaces
-                    else:
-                        cleaned_file.write(line)
-            else:
-                cleaned_file.write(line)
+        cleaned_file.writelines(clean_yaml_lines(yaml_file))
     
     return cleaned_file_path
 
@@ -58,19 +72,41 @@ def yaml_to_json(yaml_file_path, json_file_path, cleaned_dir):
     :param json_file_path: Path to the output JSON file.
     :param cleaned_dir: Directory to save the cleaned YAML file.
     """
-    # Clean the YAML file
-    cleaned_yaml_file_path = clean_yaml_file(yaml_file_path, cleaned_dir)
+    # Clean the YAML file, keeping the cleaned lines so they are parsed without reading the file back
+    with stage_timer('clean_yaml'):
+        base_name = os.path.splitext(os.path.basename(yaml_file_path))[0]
+        cleaned_yaml_file_path = os.path.join(cleaned_dir, f"{base_name}_cleaned.yaml")
+        with open(yaml_file_path, 'r') as yaml_file:
+            cleaned_lines = list(clean_yaml_lines(yaml_file))
+        with open(cleaned_yaml_file_path, 'w') as cleaned_file:
+            cleaned_file.writelines(cleaned_lines)
 
-    # Read the cleaned YAML file
-    with open(cleaned_yaml_file_path, 'r') as yaml_file:
-        data = list(yaml.safe_load_all(yaml_file))
+    # Parse the cleaned YAML
+    with stage_timer('parse_yaml'):
+        data, fast_count = load_documents(cleaned_lines)
+    increment('yaml_fast_path_documents', fast_count)
+    increment('yaml_loader_documents', sum(1 for document in data if document is not None) - fast_count)
 
     # Ensure the output directory exists
     os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
 
     # Write the data to a JSON file
-    with open(json_file_path, 'w') as json_file:
+    with stage_timer('write_json'), open(json_file_path, 'w') as json_file:
         json.dump(data, json_file, indent=4)
+    increment('bytes_written', os.path.getsize(cleaned_yaml_file_path) + os.path.getsize(json_file_path))
+
+def thread_object_messages(data):
+    """
+    Maps a parsed threadObject document to the fine-tuning messages format.
+
+    Documents of the usual shape are mapped directly; anything else goes through replace_keys,
+    which gives the same result for the usual shape.
+    """
+    if isinstance(data, dict) and len(data) == 1 and isinstance(data.get('threadObject'), list):
+        items = data['threadObject']
+        if all(isinstance(item, dict) and len(item) == 1 and next(iter(item)) in ROLE_KEYS for item in items):
+            return {'messages': [{'role': ROLES[key], 'content': value} for item in items for key, value in item.items()]}
+    return replace_keys(data)
 
 def replace_keys(data):
     """
@@ -112,11 +148,22 @@ if __name__ == "__main__":
     
     # Ensure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
+
+    # Only files whose YAML changed since the last run are converted again
+    manifest_file = manifest_path(config)
+    manifest = load_manifest(manifest_file)
     
     # Process each YAML file in the directory
-    for yaml_file_path in glob.glob(os.path.join(input_dir, '*.yaml')):
-        base_name = os.path.splitext(os.path.basename(yaml_file_path))[0]
-        json_file_path = os.path.join(output_dir, f"{base_name}.json")
-        
-        # Load and process the YAML data
-        yaml_to_json(yaml_file_path, json_file_path, cleaned_dir)
\ No newline at end of file
+    with profiled(profile_path(config, 'yaml_to_json')), stage_timer('yaml_to_json'):
+        for yaml_file_path in sorted(glob.glob(os.path.join(input_dir, '*.yaml'))):
+            base_name = os.path.splitext(os.path.basename(yaml_file_path))[0]
+            json_file_path = os.path.join(output_dir, f"{base_name}.json")
+            if not is_stale(manifest, 'yaml_to_json', json_file_path, [yaml_file_path]):
+                continue
+
+            # Load and process the YAML data
+            yaml_to_json(yaml_file_path, json_file_path, cleaned_dir)
+            record_output(manifest, 'yaml_to_json', json_file_path, [yaml_file_path])
+
+    save_manifest(manifest, manifest_file)
+    export_metrics(config['metrics_directory'], 'yaml_to_json')
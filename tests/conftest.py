@@ -0,0 +1,49 @@
+import sys
+import importlib
+import pytest
+from utils.mock_openai_server import start_mock_server
+from utils.synthetic_pdf import generate_synthetic_pdfs
+from scripts.benchmark import write_benchmark_config
+
+# A prompt set list shaped like the ones in config/prompt_sets.py
+PROMPT_SETS = [
+    {
+        "name": "test_registers",
+        "user_role_content": "Explain how to configure the peripheral described on this page",
+        "system_role_content": "You are an embedded systems engineer.",
+    },
+]
+
+@pytest.fixture
+def mock_server():
+    """Starts mock OpenAI servers with the given start_mock_server options and stops them after the test."""
+    servers = []
+
+    def start(**options):
+        options.setdefault('latency_ms', 0)
+        server, base_url = start_mock_server(**options)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def pdf_directory(tmp_path):
+    """A PDF directory with three small synthetic PDFs of six pages each."""
+    directory = tmp_path / "datasheets"
+    generate_synthetic_pdfs(str(directory), pdf_count=3, pages_per_pdf=6, words_per_page=60)
+    return str(directory)
+
+@pytest.fixture
+def upload_script(mock_server, tmp_path, monkeypatch):
+    """upload_and_fine_tune loaded against a mock server, with its rate limiter in tmp_path. Returns (module, server)."""
+    server, base_url = mock_server()
+    write_benchmark_config(str(tmp_path), base_url, {})
+    monkeypatch.chdir(tmp_path)
+    sys.modules.pop('scripts.upload_and_fine_tune', None)
+    module = importlib.import_module('scripts.upload_and_fine_tune')
+    yield module, server
+    sys.modules.pop('scripts.upload_and_fine_tune', None)
@@ -0,0 +1,45 @@
+import os
+import pytest
+from openai import OpenAI
+import utils.batch as batch_module
+import scripts.process_pdf as process_pdf
+from tests.conftest import PROMPT_SETS
+
+def test_failed_batch_requests_are_resubmitted(mock_server, pdf_directory):
+    server, base_url = mock_server(error_rate=0.3, seed=1)
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+    process_pdf.process_directory_batch(client, pdf_directory, PROMPT_SETS, poll_interval=0, max_attempts=6)
+
+    counts = server.state['counts']
+    # Some of the 18 requests failed in the first batch and went out again in follow-up batches
+    assert counts['batches'] > 1
+    assert counts['batch_requests'] == 18 + counts['errors']
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    for file_path in process_pdf.list_pdf_files(pdf_directory):
+        with open(process_pdf.get_output_file_path(file_path, output_dir, PROMPT_SETS[0]['name'])) as output_file:
+            assert output_file.read().count('threadObject:') == 6
+
+    # Every batch's input, output and error files are deleted once its results are collected
+    assert server.state['files'] == {}
+    assert counts['files_deleted'] > counts['files_uploaded']
+    assert os.listdir(os.path.join(pdf_directory, 'batch_files')) == []
+
+def test_rerun_collects_batches_an_interrupted_run_submitted(mock_server, pdf_directory, monkeypatch):
+    server, base_url = mock_server()
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch:
+        patch.setattr(batch_module, 'wait_for_batch', interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            process_pdf.process_directory_batch(client, pdf_directory, PROMPT_SETS, poll_interval=0)
+    assert os.path.exists(os.path.join(pdf_directory, 'batch_files', batch_module.SUBMITTED_BATCHES_FILE))
+
+    process_pdf.process_directory_batch(client, pdf_directory, PROMPT_SETS, poll_interval=0)
+    # The rerun collected the first run's batch rather than submitting the requests again
+    assert server.state['counts']['batches'] == 1
+    assert server.state['counts']['batch_requests'] == 18
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    assert len(os.listdir(output_dir)) == 3
+    assert os.listdir(os.path.join(pdf_directory, 'batch_files')) == []
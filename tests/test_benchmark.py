@@ -0,0 +1,14 @@
+import pytest
+from scripts.benchmark import run_benchmark
+
+@pytest.mark.parametrize("overrides", [
+    {'execution_mode': 'sync'},
+    {'execution_mode': 'async', 'output_format': 'jsonl'},
+    {'execution_mode': 'batch'},
+])
+def test_benchmark_completes(overrides):
+    result = run_benchmark(pdf_count=2, pages_per_pdf=6, words_per_page=60, latency_ms=0, config_overrides=overrides)
+    assert result['completed'], result['work_dir']
+    assert result['stages']['validate_dataset']['exit_code'] == 0
+    # One request per page and prompt set; the replies differ, so validation saw one example for each
+    assert result['server_counts']['chat_completions'] == 2 * 6 * 2
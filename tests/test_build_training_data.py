@@ -0,0 +1,68 @@
+import os
+import json
+from scripts.yaml_to_json import yaml_to_json, thread_object_messages
+from scripts.json_to_jsonl import convert_directory_to_jsonl
+from scripts.build_training_data import build_training_data
+
+# Raw process_pdf.py outputs: indentation the cleaning step has to fix, block scalars, quoted and
+# non-string values, and empty documents
+YAML_FILES = {
+    'datasheet_a': (
+        "threadObject:\n"
+        "  - systemRoleContent: You are an embedded systems engineer.\n"
+        "  - userRoleContent: What does bit 3 of CTRL do?\n"
+        "  - assistantRoleContent: |\n"
+        "      It enables the FIFO.\n"
+        "\n"
+        "      Clear it before changing the baud rate.\n"
+        "---\n"
+        "threadObject:\n"
+        "- userRoleContent: How is the UART clocked?\n"
+        "- assistantRoleContent: |\n"
+        "  From the peripheral clock,\n"
+        "  divided by BRR.\n"
+        "---\n"
+        "---\n"
+        "threadObject:\n"
+        "  - userRoleContent: \"Reset value: 0x00?\"\n"
+        "  - assistantRoleContent: 42\n"
+    ),
+    'datasheet_b': (
+        "---\n"
+        "threadObject:\n"
+        "    - userRoleContent: 'It''s 3.3 V, right?'\n"
+        "    - assistantRoleContent: Yes, with a 10 % tolerance.\n"
+    ),
+    'empty': "",
+}
+
+def test_debug_intermediates_match_the_step_by_step_scripts(tmp_path):
+    yaml_dir = tmp_path / "yaml"
+    yaml_dir.mkdir()
+    for name, text in YAML_FILES.items():
+        (yaml_dir / f"{name}.yaml").write_text(text)
+
+    # yaml_to_json.py, then json_to_jsonl.py
+    step_dir = tmp_path / "step"
+    (step_dir / "cleaned_yaml").mkdir(parents=True)
+    for name in YAML_FILES:
+        yaml_to_json(str(yaml_dir / f"{name}.yaml"), str(step_dir / "json" / f"{name}.json"), str(step_dir / "cleaned_yaml"))
+    convert_directory_to_jsonl(str(step_dir / "json"), str(step_dir / "jsonl"))
+
+    debug_dir = tmp_path / "debug"
+    debug_dirs = {'cleaned_yaml_directory': str(debug_dir / "cleaned_yaml"), 'json_directory': str(debug_dir / "json"),
+                  'jsonl_directory': str(debug_dir / "jsonl")}
+    combined_path = build_training_data(str(yaml_dir), str(debug_dir / "combined_jsonl"), debug_dirs)
+
+    for directory in ("cleaned_yaml", "json", "jsonl"):
+        file_names = sorted(os.listdir(step_dir / directory))
+        assert sorted(os.listdir(debug_dir / directory)) == file_names
+        for file_name in file_names:
+            assert (debug_dir / directory / file_name).read_bytes() == (step_dir / directory / file_name).read_bytes(), file_name
+
+    # The combined file holds the per-file records in file order, as training examples, without the empty documents
+    expected = [thread_object_messages(json.loads(line)) for name in sorted(YAML_FILES)
+                for line in (step_dir / "jsonl" / f"{name}.jsonl").read_text().splitlines() if line != "null"]
+    with open(combined_path) as combined_file:
+        assert [json.loads(line) for line in combined_file] == expected
+    assert len(expected) == 4
@@ -0,0 +1,45 @@
+import os
+import json
+import random
+from openai import OpenAI
+import scripts.process_pdf as process_pdf
+from utils.manifest import load_manifest
+from utils.synthetic_pdf import synthetic_page_text, write_synthetic_pdf
+from tests.conftest import PROMPT_SETS
+
+def read_report(directory):
+    with open(os.path.join(directory, 'dedup_report.json')) as report_file:
+        return [(entry['document'], entry['page'], entry['duplicate_of']['document'], entry['duplicate_of']['page'])
+                for entry in json.load(report_file)]
+
+def test_report_uses_pdf_page_numbers_with_a_page_selection(mock_server, tmp_path):
+    server, base_url = mock_server()
+    directory = str(tmp_path / "datasheets")
+    os.makedirs(directory)
+    rng = random.Random(0)
+    pages = [synthetic_page_text(rng, 60) for _ in range(5)]
+    # Page 4 repeats page 2; page 1 is not selected
+    write_synthetic_pdf(os.path.join(directory, "a.pdf"), pages[:3] + [pages[1]] + pages[4:])
+
+    process_pdf.process_directory(OpenAI(api_key='test', base_url=base_url, max_retries=0), directory, PROMPT_SETS,
+                                  dedup_threshold=0.9, page_selection={"a.pdf": "2-5"})
+    assert read_report(directory) == [("a.pdf", 4, "a.pdf", 2)]
+    assert server.state['counts']['chat_completions'] == 3
+
+def test_new_pdf_is_deduplicated_against_pdfs_already_processed(mock_server, tmp_path):
+    server, base_url = mock_server()
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+    directory = str(tmp_path / "datasheets")
+    os.makedirs(directory)
+    rng = random.Random(0)
+    pages = [synthetic_page_text(rng, 60) for _ in range(6)]
+    write_synthetic_pdf(os.path.join(directory, "a.pdf"), pages[:3])
+    manifest = load_manifest(str(tmp_path / "manifest.json"))
+    process_pdf.process_directory(client, directory, PROMPT_SETS, manifest=manifest, dedup_threshold=0.9)
+
+    # A new datasheet repeating a page of the one already processed, which this run skips as up to date
+    write_synthetic_pdf(os.path.join(directory, "b.pdf"), pages[3:5] + [pages[2]])
+    requests_before = server.state['counts']['chat_completions']
+    process_pdf.process_directory(client, directory, PROMPT_SETS, manifest=manifest, dedup_threshold=0.9)
+    assert read_report(directory) == [("b.pdf", 3, "a.pdf", 3)]
+    assert server.state['counts']['chat_completions'] - requests_before == 2
@@ -0,0 +1,28 @@
+from utils.rate_limit import open_rate_limiter
+
+def test_monitor_backs_off_while_quiet_and_stops_at_terminal_states(upload_script):
+    module, server = upload_script
+    # One step per poll of a job's events; None is a poll with nothing new
+    steps = {
+        module.create_fine_tune('file-a'): [None, None, None, None, ("Training started", "running"), None, ("Done", "succeeded")],
+        module.create_fine_tune('file-b'): [None, ("Training failed", "failed")],
+    }
+    for fine_tune_id, job_steps in steps.items():
+        server.state['fine_tunes'][fine_tune_id]['steps'] = job_steps
+
+    sleeps = []
+    final_statuses = module.monitor_fine_tunes(list(steps), min_interval=1, max_interval=4, sleep=sleeps.append)
+
+    assert final_statuses == dict(zip(steps, ["succeeded", "failed"]))
+    # Creation events, then job b's failure, then two quiet polls, then job a starting, then one quiet poll
+    assert sleeps == [1, 1, 2, 4, 1, 2]
+
+def test_monitor_keeps_polling_through_transient_errors(upload_script, tmp_path):
+    module, server = upload_script
+    module.rate_limiter = open_rate_limiter(str(tmp_path / "retry_only.sqlite"), max_retries=0)
+    fine_tune_ids = [module.create_fine_tune('file-a'), module.create_fine_tune('file-b')]
+    server.state['error_rate'] = 0.5
+
+    assert module.monitor_fine_tunes(fine_tune_ids, min_interval=1, max_interval=4, sleep=lambda interval: None) == \
+        {fine_tune_id: "succeeded" for fine_tune_id in fine_tune_ids}
+    assert server.state['counts']['errors'] > 0
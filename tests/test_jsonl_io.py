@@ -0,0 +1,92 @@
+import os
+import json
+import utils.jsonl_io as jsonl_io
+from utils.manifest import load_manifest
+from scripts.combine_jsonl_files import combine_jsonl_files
+
+def records(start, stop):
+    """Newline-terminated JSONL records numbered start to stop - 1."""
+    return [json.dumps({'messages': [{'role': 'user', 'content': f"question {i}"}]}).encode() + b'\n' for i in range(start, stop)]
+
+def write_lines(path, lines):
+    with open(path, 'wb') as output_file:
+        output_file.writelines(lines)
+    return str(path)
+
+def read_lines(path):
+    with open(path, 'rb') as input_file:
+        return input_file.readlines()
+
+def test_appending_to_the_combined_file_drops_records_it_already_has(tmp_path):
+    manifest = load_manifest(str(tmp_path / "manifest.json"))
+    write_lines(tmp_path / "a.jsonl", records(0, 10))
+    output_file_path = combine_jsonl_files(str(tmp_path), manifest)
+    assert read_lines(output_file_path) == records(0, 10)
+
+    # b.jsonl repeats half of a.jsonl and has a duplicate of its own
+    write_lines(tmp_path / "b.jsonl", records(5, 15) + records(14, 15))
+    combine_jsonl_files(str(tmp_path), manifest)
+    assert read_lines(output_file_path) == records(0, 15)
+    assert manifest['stages']['combine_jsonl_files'][output_file_path]['inputs'].keys() == {str(tmp_path / "a.jsonl"), str(tmp_path / "b.jsonl")}
+
+def test_external_shuffle_is_a_seeded_permutation(tmp_path):
+    lines = records(0, 2000)
+    input_path = write_lines(tmp_path / "combined.jsonl", lines)
+    # About 10 KB per bucket, so the roughly 130 KB file is scattered across temporary buckets
+    shuffled = list(jsonl_io.external_shuffle(input_path, seed=3, memory_mb=0.01))
+
+    assert sorted(shuffled) == sorted(lines)
+    assert shuffled != lines
+    assert list(jsonl_io.external_shuffle(input_path, seed=3, memory_mb=0.01)) == shuffled
+    assert sorted(jsonl_io.external_shuffle(input_path, seed=3)) == sorted(lines)
+    # The bucket files are removed afterwards
+    assert os.listdir(tmp_path) == ["combined.jsonl"]
+
+def test_shards_stay_under_the_size_cap(tmp_path):
+    lines = records(0, 500)
+    result = jsonl_io.write_splits(lines, str(tmp_path), shard_max_mb=0.005)
+
+    max_bytes = 0.005 * 1024 * 1024
+    assert len(result['shards']) > 1
+    assert all(os.path.getsize(path) <= max_bytes for path in result['shards'])
+    assert [line for path in result['shards'] for line in read_lines(path)] == lines
+    assert result['counts'] == {'train': 500, 'validation': 0}
+
+    # A rerun with a larger cap leaves no shards of the first run behind
+    result = jsonl_io.write_splits(lines, str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["train_shard_000.jsonl"]
+
+def test_validation_fraction_splits_the_records(tmp_path):
+    lines = records(0, 2000)
+    result = jsonl_io.write_splits(lines, str(tmp_path), validation_fraction=0.1, seed=5)
+
+    train = [line for path in result['shards'] for line in read_lines(path)]
+    validation = read_lines(result['validation'])
+    assert sorted(train + validation) == sorted(lines)
+    assert result['counts'] == {'train': len(train), 'validation': len(validation)}
+    assert 150 < len(validation) < 250
+
+    # Turning the split off removes the validation file of the earlier run
+    result = jsonl_io.write_splits(lines, str(tmp_path), validation_fraction=0.0)
+    assert result['validation'] is None
+    assert not os.path.exists(tmp_path / "validation.jsonl")
+
+def test_zero_copy_matches_the_buffered_copy(tmp_path, monkeypatch):
+    inputs = [write_lines(tmp_path / "a.jsonl", records(0, 50)),
+              write_lines(tmp_path / "empty.jsonl", []),
+              write_lines(tmp_path / "unterminated.jsonl", records(50, 60) + [b'{"last": true}'])]
+
+    def combine(output_path):
+        with open(output_path, 'wb') as output_file:
+            output_file.write(b'{"header": true}\n')
+            written = [jsonl_io.copy_file_bytes(path, output_file) for path in inputs]
+        return written, read_lines(output_path)
+
+    zero_copy = combine(tmp_path / "zero_copy.out")
+    monkeypatch.delattr(os, 'copy_file_range', raising=False)
+    monkeypatch.delattr(os, 'sendfile', raising=False)
+    buffered = combine(tmp_path / "buffered.out")
+
+    assert zero_copy == buffered
+    assert buffered[1][-1] == b'{"last": true}\n'
+    assert buffered[0][2] == os.path.getsize(inputs[2]) + 1
@@ -0,0 +1,30 @@
+import os
+import pytest
+from openai import OpenAI
+from utils.multipart_upload import multipart_upload
+from utils.rate_limit import open_rate_limiter
+
+PART_SIZE = 64 * 1024
+
+def test_interrupted_upload_resumes_from_saved_state(mock_server, tmp_path):
+    server, base_url = mock_server(error_rate=0.4, seed=3)
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+    file_path = str(tmp_path / "combined_data.jsonl")
+    content = os.urandom(10 * PART_SIZE + 123)
+    with open(file_path, 'wb') as upload_file:
+        upload_file.write(content)
+
+    # Without retries, the parts the mock fails interrupt the upload
+    with pytest.raises(IOError, match="rerun to resume"):
+        multipart_upload(client, file_path, part_size=PART_SIZE, rate_limiter=open_rate_limiter(str(tmp_path / "rate_limits.sqlite"), max_retries=0))
+    assert os.path.exists(f"{file_path}.upload_state.json")
+    parts_sent = server.state['counts']['upload_parts']
+    assert 0 < parts_sent < 11
+
+    server.state['error_rate'] = 0.0
+    file_id = multipart_upload(client, file_path, part_size=PART_SIZE)
+    # Only the missing parts were sent again, to the same upload, and the mock checked the assembled file's MD5
+    assert server.state['counts']['upload_parts'] == 11
+    assert len(server.state['uploads']) == 1
+    assert client.files.content(file_id).content == content
+    assert not os.path.exists(f"{file_path}.upload_state.json")
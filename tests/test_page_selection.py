@@ -0,0 +1,67 @@
+import pytest
+import PyPDF2
+from utils.page_selection import parse_page_ranges, select_pages, outline_entries
+from utils.synthetic_pdf import write_synthetic_pdf
+from scripts.process_pdf import read_pdf
+
+@pytest.mark.parametrize('spec, expected', [
+    ("3", [2]),
+    ("1-3, 5", [0, 1, 2, 4]),
+    (" 2 - 4 ,7 ", [1, 2, 3, 6]),
+    # Overlapping and repeated ranges select each page once, in page order
+    ("4-6, 1-5, 5", [0, 1, 2, 3, 4, 5]),
+    ("8-9, 2", [1, 7, 8]),
+    # Ranges past the end are clipped; ranges entirely past it select nothing
+    ("9-20", [8, 9]),
+    ("11-15, 30", []),
+    ("10", [9]),
+])
+def test_parse_page_ranges(spec, expected):
+    assert parse_page_ranges(spec, page_count=10) == expected
+
+@pytest.mark.parametrize('spec', ["5-3", "0", "0-2", "-2", "3-", "a-b", "1,,2", "", "1.5"])
+def test_invalid_page_ranges_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_page_ranges(spec, page_count=10)
+
+@pytest.fixture
+def outlined_pdf(tmp_path):
+    """A ten-page PDF whose page N reads "page N", with a two-level outline."""
+    plain_path = tmp_path / "plain.pdf"
+    write_synthetic_pdf(str(plain_path), [[f"page {i + 1}"] for i in range(10)])
+
+    writer = PyPDF2.PdfWriter()
+    for page in PyPDF2.PdfReader(str(plain_path)).pages:
+        writer.add_page(page)
+    writer.add_outline_item("Introduction", 0)
+    registers = writer.add_outline_item("Registers", 2)
+    writer.add_outline_item("CTRL register", 3, parent=registers)
+    writer.add_outline_item("STATUS register", 5, parent=registers)
+    writer.add_outline_item("Electrical characteristics", 7)
+    pdf_path = tmp_path / "outlined.pdf"
+    with open(pdf_path, 'wb') as pdf_file:
+        writer.write(pdf_file)
+    return str(pdf_path)
+
+def test_outline_sections_select_their_pages(outlined_pdf, capsys):
+    reader = PyPDF2.PdfReader(outlined_pdf)
+    assert outline_entries(reader) == [(0, "Introduction", 0), (0, "Registers", 2), (1, "CTRL register", 3),
+                                       (1, "STATUS register", 5), (0, "Electrical characteristics", 7)]
+
+    # A chapter runs to the next chapter and includes its subsections
+    assert select_pages(reader, ["Registers"]) == [2, 3, 4, 5, 6]
+    # A subsection runs to the next subsection or the next chapter, whichever comes first
+    assert select_pages(reader, ["ctrl"]) == [3, 4]
+    assert select_pages(reader, ["STATUS"]) == [5, 6]
+    # The last section runs to the end of the document; titles match case-insensitively by prefix
+    assert select_pages(reader, ["electrical", "intro"]) == [0, 1, 7, 8, 9]
+    # Overlapping sections select each page once
+    assert select_pages(reader, ["Registers", "CTRL"]) == [2, 3, 4, 5, 6]
+
+    assert select_pages(reader, ["Timers"]) == []
+    assert "No outline entries match 'Timers'" in capsys.readouterr().out
+
+def test_outline_selection_extracts_the_selected_pages(outlined_pdf):
+    pages = read_pdf(outlined_pdf, ["STATUS", "Electrical"])
+    assert [page.split()[-1] for page in pages] == ["6", "7", "8", "9", "10"]
+    assert [page.split()[-1] for page in read_pdf(outlined_pdf, "2, 4-5")] == ["2", "4", "5"]
@@ -0,0 +1,76 @@
+import os
+from openai import OpenAI
+import scripts.process_pdf as process_pdf
+from utils.response_cache import open_response_cache, record_page, prune_pages, evict_responses
+from utils.manifest import load_manifest
+from tests.conftest import PROMPT_SETS
+
+def test_page_cache_directory_is_used(mock_server, pdf_directory, tmp_path):
+    server, base_url = mock_server()
+    cache_dir = str(tmp_path / "page_cache_elsewhere")
+    process_pdf.process_directory(OpenAI(api_key='test', base_url=base_url, max_retries=0), pdf_directory, PROMPT_SETS, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 3
+    assert not os.path.exists(process_pdf.get_page_cache_dir(pdf_directory))
+
+def test_resume_rebuilds_only_the_last_complete_run(mock_server, pdf_directory, tmp_path):
+    server, base_url = mock_server()
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+    response_cache = open_response_cache(str(tmp_path / "response_cache.sqlite"))
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    try:
+        process_pdf.process_directory(client, pdf_directory, PROMPT_SETS, response_cache)
+        # Packing the pages leaves fewer request units than the first run recorded
+        process_pdf.process_directory(client, pdf_directory, PROMPT_SETS, response_cache, token_budget=1000)
+        packed = {name: open(os.path.join(output_dir, name)).read() for name in os.listdir(output_dir)}
+
+        rebuilt_dir = str(tmp_path / "rebuilt")
+        process_pdf.rebuild_outputs_from_cache(response_cache, rebuilt_dir)
+        rebuilt = {name: open(os.path.join(rebuilt_dir, name)).read() for name in os.listdir(rebuilt_dir)}
+    finally:
+        response_cache.close()
+    assert rebuilt == packed
+
+def test_resume_skips_documents_with_evicted_pages(mock_server, pdf_directory, tmp_path):
+    server, base_url = mock_server()
+    response_cache = open_response_cache(str(tmp_path / "response_cache.sqlite"))
+    rebuilt_dir = str(tmp_path / "rebuilt")
+    try:
+        process_pdf.process_directory(OpenAI(api_key='test', base_url=base_url, max_retries=0), pdf_directory, PROMPT_SETS, response_cache)
+        # Evict the response of one page of the first PDF
+        cache_key = response_cache.execute("SELECT cache_key FROM pages ORDER BY document, page_num LIMIT 1 OFFSET 2").fetchone()[0]
+        response_cache.execute("DELETE FROM responses WHERE cache_key = ?", (cache_key,))
+        evict_responses(response_cache)
+        process_pdf.rebuild_outputs_from_cache(response_cache, rebuilt_dir)
+    finally:
+        response_cache.close()
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    assert sorted(os.listdir(rebuilt_dir)) == sorted(os.listdir(output_dir))[1:]
+    for name in os.listdir(rebuilt_dir):
+        assert open(os.path.join(rebuilt_dir, name)).read() == open(os.path.join(output_dir, name)).read()
+
+def test_prune_pages_keeps_only_the_current_run(tmp_path):
+    conn = open_response_cache(str(tmp_path / "response_cache.sqlite"))
+    for pdf_hash, page_count in (("old", 5), ("new", 3)):
+        for page_num in range(page_count):
+            record_page(conn, {'document': "a.pdf", 'prompt_set': "set", 'page_num': page_num, 'pdf_hash': pdf_hash}, f"{pdf_hash}-{page_num}")
+    record_page(conn, {'document': "b.pdf", 'prompt_set': "set", 'page_num': 4, 'pdf_hash': "old"}, "other")
+
+    # The new version overwrote pages 0-2; its page 2 and the old version's pages 3 and 4 are dropped
+    assert prune_pages(conn, "a.pdf", "set", "new", 2) == 3
+    rows = conn.execute("SELECT document, page_num, pdf_hash FROM pages ORDER BY document, page_num").fetchall()
+    conn.close()
+    # Other documents are untouched
+    assert rows == [("a.pdf", 0, "new"), ("a.pdf", 1, "new"), ("b.pdf", 4, "old")]
+
+def test_changed_settings_make_outputs_stale(pdf_directory, tmp_path):
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    pdf_paths = process_pdf.list_pdf_files(pdf_directory)
+    manifest = load_manifest(str(tmp_path / "manifest.json"))
+    os.makedirs(output_dir)
+    for file_path in pdf_paths:
+        open(process_pdf.get_output_file_path(file_path, output_dir, PROMPT_SETS[0]['name']), 'w').close()
+        process_pdf.record_completed(manifest, file_path, output_dir, PROMPT_SETS, [PROMPT_SETS[0]['name']], "yaml", None, 1000, 0.9)
+
+    assert process_pdf.plan_pdf_work(manifest, pdf_paths, output_dir, PROMPT_SETS, "yaml", None, 1000, 0.9) == {}
+    assert len(process_pdf.plan_pdf_work(manifest, pdf_paths, output_dir, PROMPT_SETS, "yaml", None, 2000, 0.9)) == 3
+    assert len(process_pdf.plan_pdf_work(manifest, pdf_paths, output_dir, PROMPT_SETS, "yaml", None, 1000, None)) == 3
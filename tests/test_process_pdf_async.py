@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import random
+import asyncio
+from openai import AsyncOpenAI
+import scripts.process_pdf as process_pdf
+from utils.synthetic_pdf import synthetic_page_text, write_synthetic_pdf
+from tests.conftest import PROMPT_SETS
+
+def read_outputs(directory_path):
+    output_dir = process_pdf.get_output_dir(directory_path)
+    return {name: open(os.path.join(output_dir, name)).read() for name in sorted(os.listdir(output_dir)) if name.endswith('.yaml')}
+
+def run_async(base_url, directory_path, max_concurrent_requests, **options):
+    async def run():
+        async with AsyncOpenAI(api_key='test', base_url=base_url, max_retries=0) as client:
+            await process_pdf.process_directory_async(client, directory_path, PROMPT_SETS, max_concurrent_requests, **options)
+    start = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - start
+
+def test_throughput_scales_with_concurrency(mock_server, pdf_directory):
+    server, base_url = mock_server(latency_ms=100)
+    rates = {}
+    outputs = {}
+    for concurrency in (1, 4, 16):
+        completed_before = server.state['counts']['chat_completions']
+        elapsed = run_async(base_url, pdf_directory, concurrency)
+        requests = server.state['counts']['chat_completions'] - completed_before
+        assert requests == 18
+        rates[concurrency] = requests / elapsed
+        outputs[concurrency] = read_outputs(pdf_directory)
+
+    assert rates[1] < rates[4] < rates[16]
+    assert rates[16] > 3 * rates[1]
+    # Concurrency changes the order responses complete in, never the output files
+    assert len(outputs[1]) == 3
+    assert outputs[1] == outputs[4] == outputs[16]
+
+def test_pdfs_in_flight_are_bounded(mock_server, pdf_directory, monkeypatch):
+    server, base_url = mock_server(latency_ms=20)
+    active = peak = 0
+    original = process_pdf.process_pdf_async
+
+    async def counting_process_pdf_async(*args, **kwargs):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            active -= 1
+
+    monkeypatch.setattr(process_pdf, 'process_pdf_async', counting_process_pdf_async)
+    run_async(base_url, pdf_directory, 16, max_concurrent_pdfs=2)
+    assert peak == 2
+    assert len(read_outputs(pdf_directory)) == 3
+
+def test_dedup_follows_file_order(mock_server, tmp_path, monkeypatch):
+    server, base_url = mock_server()
+    directory_path = str(tmp_path / "datasheets")
+    os.makedirs(directory_path)
+    rng = random.Random(0)
+    pages = [synthetic_page_text(rng, 60) for _ in range(4)]
+    for pdf_num in range(2):
+        write_synthetic_pdf(os.path.join(directory_path, f"synthetic_{pdf_num:03d}.pdf"), pages)
+    original = process_pdf.extract_pdf
+
+    def slow_first_extraction(file_path, *args):
+        # The first PDF finishes extracting last
+        if file_path.endswith("synthetic_000.pdf"):
+            time.sleep(0.3)
+        return original(file_path, *args)
+
+    monkeypatch.setattr(process_pdf, 'extract_pdf', slow_first_extraction)
+    run_async(base_url, directory_path, 4, dedup_threshold=0.9)
+    with open(os.path.join(directory_path, 'dedup_report.json')) as report_file:
+        dropped = json.load(report_file)
+    # As in the sync mode, the copies in the second PDF are the ones dropped
+    assert [(entry['document'], entry['page']) for entry in dropped] == [("synthetic_001.pdf", page) for page in range(1, 5)]
+
+def test_a_failing_pdf_does_not_stop_the_others(mock_server, pdf_directory):
+    server, base_url = mock_server()
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    first_pdf = process_pdf.list_pdf_files(pdf_directory)[0]
+    # The first PDF's output cannot be opened
+    os.makedirs(process_pdf.get_output_file_path(first_pdf, output_dir, PROMPT_SETS[0]['name']) + ".partial")
+
+    run_async(base_url, pdf_directory, 4)
+    assert len(read_outputs(pdf_directory)) == 2
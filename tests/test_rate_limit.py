@@ -0,0 +1,89 @@
+import os
+import time
+import asyncio
+import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from openai import OpenAI, AsyncOpenAI
+import scripts.process_pdf as process_pdf
+from utils.rate_limit import open_rate_limiter, wait_for_budget_async
+from utils.synthetic_pdf import generate_synthetic_pdfs
+from tests.conftest import PROMPT_SETS
+
+def test_waiting_for_the_database_does_not_block_the_event_loop(tmp_path):
+    db_path = str(tmp_path / "rate_limit.sqlite")
+    limiter = open_rate_limiter(db_path)
+    # Another process holds the write lock for half a second
+    other = sqlite3.connect(db_path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    async def run():
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.05)
+
+        ticker = asyncio.create_task(tick())
+        asyncio.get_running_loop().call_later(0.5, other.rollback)
+        await wait_for_budget_async(limiter, 'gpt-test')
+        ticker.cancel()
+        return ticks
+
+    ticks = asyncio.run(run())
+    other.close()
+    assert len(ticks) >= 5
+    assert max(later - earlier for earlier, later in zip(ticks, ticks[1:])) < 0.3
+
+def _outputs(output_dir):
+    return sorted(os.listdir(output_dir)) if os.path.exists(output_dir) else []
+
+def test_failed_pages_leave_the_output_partial_until_a_rerun(mock_server, pdf_directory, tmp_path):
+    server, base_url = mock_server(error_rate=0.3)
+    limiter = open_rate_limiter(str(tmp_path / "rate_limit.sqlite"), max_retries=0)
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+
+    process_pdf.process_directory(client, pdf_directory, PROMPT_SETS, rate_limiter=limiter)
+    assert any(name.endswith('.partial') for name in _outputs(output_dir))
+    for name in _outputs(output_dir):
+        if name.endswith('.yaml'):
+            assert open(os.path.join(output_dir, name)).read().count('\n---\n') == 5
+
+    server.state['error_rate'] = 0.0
+    asyncio.run(process_pdf.process_directory_async(AsyncOpenAI(api_key='test', base_url=base_url, max_retries=0), pdf_directory,
+                                                    PROMPT_SETS, rate_limiter=limiter))
+    names = _outputs(output_dir)
+    assert len(names) == 3 and all(name.endswith('.yaml') for name in names)
+    for name in names:
+        assert open(os.path.join(output_dir, name)).read().count('\n---\n') == 5
+
+def _process_with_shared_limiter(base_url, pdf_directory, rate_limit_path):
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+    start = time.time()
+    process_pdf.process_directory(client, pdf_directory, PROMPT_SETS, rate_limiter=open_rate_limiter(rate_limit_path))
+    return start, time.time()
+
+def test_worker_processes_share_the_budget_and_stay_under_the_limit(mock_server, tmp_path):
+    requests_per_minute = 600
+    server, base_url = mock_server(requests_per_minute=requests_per_minute)
+    # The account has been busy, so there is almost no budget left at the start
+    server.state['rate_limits']['requests'] = 3
+    directories = [str(tmp_path / f"worker_{worker}") for worker in range(3)]
+    for directory in directories:
+        generate_synthetic_pdfs(directory, pdf_count=2, pages_per_pdf=10, words_per_page=60)
+
+    rate_limit_path = str(tmp_path / "rate_limits.sqlite")
+    with ProcessPoolExecutor(len(directories), mp_context=multiprocessing.get_context('spawn')) as pool:
+        spans = list(pool.map(_process_with_shared_limiter, [base_url] * len(directories), directories, [rate_limit_path] * len(directories)))
+
+    for directory in directories:
+        names = _outputs(process_pdf.get_output_dir(directory))
+        assert len(names) == 2 and all(name.endswith('.yaml') for name in names)
+        for name in names:
+            assert open(os.path.join(process_pdf.get_output_dir(directory), name)).read().count('\n---\n') == 9
+    assert server.state['counts']['rate_limited'] <= 2
+    # 60 requests in the time it took, against a limit of 10 per second
+    rate = server.state['counts']['chat_completions'] / (max(end for _, end in spans) - min(start for start, _ in spans))
+    assert 0.75 * requests_per_minute / 60 < rate <= requests_per_minute / 60
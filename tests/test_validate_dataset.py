@@ -0,0 +1,87 @@
+import json
+import pytest
+import scripts.validate_dataset as validate_dataset
+
+def example(*turns):
+    """A training record with the given (role, content) messages."""
+    return {'messages': [{'role': role, 'content': content} for role, content in turns]}
+
+VALID_EXAMPLE = example(("system", "You are an embedded systems engineer."), ("user", "How is the UART clocked?"),
+                        ("assistant", "From the peripheral clock, divided by the baud rate register."))
+
+def write_dataset(path, records):
+    """Writes records to a JSONL file; strings are written as they are, anything else as JSON."""
+    with open(path, 'w', encoding='utf-8') as jsonl_file:
+        for record in records:
+            jsonl_file.write((record if isinstance(record, str) else json.dumps(record)) + "\n")
+    return str(path)
+
+@pytest.mark.parametrize('bad_record, expected_kind', [
+    ('{"messages": [', "invalid JSON"),
+    (example(("assistant", "The answer."), ("user", "The question?")), "conversation does not end with an assistant message"),
+    (example(("user", "The question?"), ("system", "Late instructions."), ("assistant", "The answer.")), "system message is not the first message"),
+    (example(("user", "The question?"), ("user", "Again?"), ("assistant", "The answer.")), "two consecutive user messages"),
+    (example(("user", "   "), ("assistant", "The answer.")), "message N has empty content"),
+])
+def test_each_error_kind_is_reported_with_its_line(tmp_path, bad_record, expected_kind):
+    path = write_dataset(tmp_path / "data.jsonl", [VALID_EXAMPLE] * 12 + [bad_record])
+    report = validate_dataset.validate_dataset(path)
+
+    assert not report['valid']
+    assert report['examples'] == 13
+    assert report['invalid_examples'] == 1
+    assert any(kind.startswith(expected_kind) for kind in report['errors'])
+    assert report['error_samples'][0].startswith("line 13: ")
+
+def test_small_or_oversized_datasets_are_invalid(tmp_path):
+    report = validate_dataset.validate_dataset(write_dataset(tmp_path / "small.jsonl", [VALID_EXAMPLE] * 3))
+    assert report['errors'] == {f"fewer than {validate_dataset.MIN_EXAMPLES} examples": 1}
+
+    report = validate_dataset.validate_dataset(write_dataset(tmp_path / "long.jsonl", [VALID_EXAMPLE] * 12), max_example_tokens=10)
+    assert report['invalid_examples'] == 12
+    assert list(report['errors']) == ["example has ~N tokens, over the N limit"]
+
+def test_token_counts_are_labelled_estimated_without_a_tokenizer(tmp_path):
+    records = [example(("user", "q" * 40 * i), ("assistant", "a" * 40 * i)) for i in range(1, 12)]
+    report = validate_dataset.validate_dataset(write_dataset(tmp_path / "data.jsonl", records))
+
+    assert report['valid']
+    assert report['tokens_estimated']
+    # 3 per example, 4 per message and 10 estimated tokens per 40 characters
+    assert (report['min_tokens'], report['median_tokens'], report['max_tokens']) == (31, 131, 231)
+    assert report['dataset_tokens'] == sum(11 + 20 * i for i in range(1, 12))
+
+class WordTokenizer:
+    """Stands in for a tiktoken encoding: one token per word, and records the size of each batch."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def encode_batch(self, texts, disallowed_special=()):
+        self.batch_sizes.append(len(texts))
+        return [text.split() for text in texts]
+
+def test_tokenizer_counts_examples_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(validate_dataset, 'TOKENIZE_BATCH_SIZE', 4)
+    records = [example(("user", "word " * i), ("assistant", "word")) for i in range(1, 11)] + ['not json']
+    tokenizer = WordTokenizer()
+    report = validate_dataset.validate_dataset(write_dataset(tmp_path / "data.jsonl", records), max_example_tokens=16, tokenizer=tokenizer)
+
+    # Two messages per example, four examples per batch and the last two examples at the end of the file
+    assert tokenizer.batch_sizes == [8, 8, 4]
+    assert not report['tokens_estimated']
+    assert (report['min_tokens'], report['median_tokens'], report['max_tokens']) == (13, 18, 22)
+    # Examples over the limit are reported with their exact count, like any other error
+    assert report['errors'] == {"example has N tokens, over the N limit": 6, "invalid JSON": 1}
+    assert "line 5: example has 17 tokens, over the 16 limit" in report['error_samples']
+
+def test_upload_is_refused_when_validation_fails(upload_script, tmp_path):
+    module, server = upload_script
+    invalid_path = write_dataset(tmp_path / "invalid.jsonl", [VALID_EXAMPLE] * 12 + [example(("user", "Only a question?"))])
+    with pytest.raises(SystemExit):
+        module.validate_before_upload({}, invalid_path)
+
+    valid_path = write_dataset(tmp_path / "valid.jsonl", [VALID_EXAMPLE] * 12)
+    module.validate_before_upload({}, valid_path)
+    # Validation alone never talks to the API
+    assert server.state['counts']['requests'] == 0
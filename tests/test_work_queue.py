@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from openai import OpenAI
+import scripts.process_pdf as process_pdf
+from scripts.work_queue import enqueue_directory, run_worker, assemble_outputs
+from utils.work_queue import (open_work_queue, enqueue_job, claim_task, heartbeat, complete_task, retry_failed_tasks,
+                              mark_assembled, queue_status)
+from utils.rate_limit import open_rate_limiter
+from tests.conftest import PROMPT_SETS
+
+def enqueue_units(conn, unit_count):
+    enqueue_job(conn, "job", "a.pdf", "hash", PROMPT_SETS[0], "yaml", [(f"page {page_num}", 100) for page_num in range(unit_count)])
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    conn = open_work_queue(str(tmp_path / "queue.sqlite"))
+    enqueue_units(conn, 1)
+    task = claim_task(conn, "dead-worker", lease_seconds=0.1)
+    assert claim_task(conn, "worker", lease_seconds=0.1) is None
+
+    time.sleep(0.2)
+    reclaimed = claim_task(conn, "worker")
+    assert (reclaimed['page_num'], reclaimed['attempt']) == (0, 2)
+    # The first worker's late response is not stored over the new lease
+    assert not complete_task(conn, task, "dead-worker", "late")
+    assert complete_task(conn, reclaimed, "worker", "response")
+
+def test_heartbeat_extends_the_lease(tmp_path):
+    conn = open_work_queue(str(tmp_path / "queue.sqlite"))
+    enqueue_units(conn, 1)
+    task = claim_task(conn, "worker", lease_seconds=0.3)
+    for _ in range(3):
+        time.sleep(0.15)
+        assert heartbeat(conn, "worker", lease_seconds=0.3) == 1
+    assert claim_task(conn, "other-worker") is None
+    assert complete_task(conn, task, "worker", "response")
+
+def test_lease_expiring_after_the_last_attempt_fails_the_task(tmp_path):
+    conn = open_work_queue(str(tmp_path / "queue.sqlite"))
+    enqueue_units(conn, 1)
+    for _ in range(2):
+        assert claim_task(conn, "dying-worker", lease_seconds=0.05, max_attempts=2) is not None
+        time.sleep(0.1)
+    assert claim_task(conn, "worker", max_attempts=2) is None
+    assert queue_status(conn)['tasks']['failed'] == 1
+
+def _claim_all(db_path, worker, start_at):
+    conn = open_work_queue(db_path)
+    time.sleep(max(0.0, start_at - time.time()))
+    claimed = []
+    while (task := claim_task(conn, worker)) is not None:
+        claimed.append(task['page_num'])
+        time.sleep(0.005)  # The request a real worker sends between claims
+    conn.close()
+    return claimed
+
+def test_concurrent_claims_never_share_a_task(tmp_path):
+    db_path = str(tmp_path / "queue.sqlite")
+    enqueue_units(open_work_queue(db_path), 300)
+    workers = [f"worker-{i}" for i in range(4)]
+    # The worker processes start claiming together, once all of them are up
+    start_at = time.time() + 2
+    with ProcessPoolExecutor(len(workers), mp_context=multiprocessing.get_context('spawn')) as pool:
+        claims = list(pool.map(_claim_all, [db_path] * len(workers), workers, [start_at] * len(workers)))
+    assert sorted(page_num for claimed in claims for page_num in claimed) == list(range(300))
+    assert sum(1 for claimed in claims if claimed) > 1
+
+def test_workers_with_heartbeats_keep_slow_requests(mock_server, pdf_directory, tmp_path):
+    # Every request outlasts the lease, so only the heartbeats keep the other worker from taking it over
+    server, base_url = mock_server(latency_ms=500)
+    db_path = str(tmp_path / "queue.sqlite")
+    conn = open_work_queue(db_path)
+    enqueue_directory(conn, pdf_directory, PROMPT_SETS)
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+    completed = {}
+    threads = [threading.Thread(target=lambda worker=worker: completed.update({worker: run_worker(db_path, client, worker, lease_seconds=0.2, poll_seconds=0.05)}))
+               for worker in ("worker-1", "worker-2")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(completed.values()) == 18
+    assert server.state['counts']['chat_completions'] == 18
+
+def test_failed_jobs_are_assembled_only_after_retry(mock_server, pdf_directory, tmp_path):
+    server, base_url = mock_server(error_rate=1.0)
+    db_path = str(tmp_path / "queue.sqlite")
+    conn = open_work_queue(db_path)
+    enqueue_directory(conn, pdf_directory, PROMPT_SETS)
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0)
+    rate_limiter = open_rate_limiter(str(tmp_path / "rate_limits.sqlite"), max_retries=0)
+
+    assert run_worker(db_path, client, "worker", max_attempts=2, poll_seconds=0.05, rate_limiter=rate_limiter) == 0
+    # Every task used its two attempts and failed
+    assert server.state['counts']['errors'] == 36
+    assert queue_status(conn)['tasks']['failed'] == 18
+    output_dir = process_pdf.get_output_dir(pdf_directory)
+    assert assemble_outputs(conn, pdf_directory) == 0
+    assert not os.path.exists(output_dir) or os.listdir(output_dir) == []
+
+    # A job an earlier version assembled with its failed requests left out is reassembled after the retry
+    job_id = conn.execute("SELECT job_id FROM jobs LIMIT 1").fetchone()[0]
+    mark_assembled(conn, job_id)
+    assert retry_failed_tasks(conn) == 18
+    assert conn.execute("SELECT COUNT(*) FROM jobs WHERE assembled_at IS NOT NULL").fetchone()[0] == 0
+
+    server.state['error_rate'] = 0.0
+    assert run_worker(db_path, client, "worker", poll_seconds=0.05, rate_limiter=rate_limiter) == 18
+    assert assemble_outputs(conn, pdf_directory) == 3
+    for name in os.listdir(output_dir):
+        assert open(os.path.join(output_dir, name)).read().count('threadObject:') == 6
@@ -0,0 +1,92 @@
+import random
+import pytest
+import yaml
+from utils.yaml_ingest import parse_thread_object, load_document, load_documents
+
+def document(*items, indent=2):
+    """A threadObject document with one '- key: value' line per (key, value) pair; value is the raw YAML text after the colon."""
+    return "threadObject:\n" + "".join(f"{' ' * indent}- {key}:{value}\n" for key, value in items)
+
+# Documents the dedicated parser reads itself
+FAST_PATH_DOCUMENTS = {
+    'plain scalars': document(("systemRoleContent", " You are an engineer."), ("userRoleContent", " What does bit 3 do?"),
+                              ("assistantRoleContent", " It enables the FIFO.")),
+    'double quoted': document(("userRoleContent", ' "Set \\"EN\\" to 1: then wait\\n\\tfor READY"'), ("assistantRoleContent", ' "# not a comment"')),
+    'single quoted': document(("userRoleContent", " 'It''s 3.3 V: see table 4'"), ("assistantRoleContent", " 'yes'")),
+    'quoted numbers and booleans': document(("userRoleContent", ' "42"'), ("assistantRoleContent", " 'true'")),
+    'literal block': document(("userRoleContent", " |\n      Configure the clock.\n\n        Indented line.\n      Last line."),
+                              ("assistantRoleContent", " Done.")),
+    'strip and keep chomping': document(("userRoleContent", " |-\n      No trailing newline."),
+                                        ("assistantRoleContent", " |+\n      Trailing newlines kept.\n\n")),
+    'block at the end of the file without a newline': "threadObject:\n  - userRoleContent: Q?\n  - assistantRoleContent: |\n      Last line",
+    'zero indentation': document(("userRoleContent", " Q?"), ("assistantRoleContent", " A."), indent=0),
+    'odd indentation': document(("userRoleContent", " |\n        Deeper block."), ("assistantRoleContent", " A."), indent=3),
+    'blank lines and trailing spaces': "\nthreadObject:   \n\n  - userRoleContent: Q?\n\n  - assistantRoleContent:   A.  \n",
+    'unicode': document(("userRoleContent", " Ω-Widerstand bei 25 °C?"), ("assistantRoleContent", " 10 kΩ ± 1 %")),
+}
+
+# Documents the loader has to read; they must come out exactly as yaml.safe_load reads them
+FALLBACK_DOCUMENTS = {
+    'unquoted number': document(("userRoleContent", " 42"), ("assistantRoleContent", " A.")),
+    'unquoted boolean and null': document(("userRoleContent", " yes"), ("assistantRoleContent", " null")),
+    'unquoted date': document(("userRoleContent", " 2024-01-31"), ("assistantRoleContent", " A.")),
+    'comment after a value': document(("userRoleContent", " Q? # asked twice"), ("assistantRoleContent", " A.")),
+    'folded block': document(("userRoleContent", " >\n      Folded\n      text."), ("assistantRoleContent", " A.")),
+    'block with indentation indicator': document(("userRoleContent", " |2\n        Two extra spaces."), ("assistantRoleContent", " A.")),
+    'unicode escape': document(("userRoleContent", ' "\\u00b5s"'), ("assistantRoleContent", " A.")),
+    'multi-line plain scalar': "threadObject:\n  - userRoleContent: first line\n      continued\n  - assistantRoleContent: A.\n",
+    'nested sequence': "threadObject:\n  - userRoleContent:\n    - Q?\n  - assistantRoleContent: A.\n",
+    'flow mapping': document(("userRoleContent", " {a: 1}"), ("assistantRoleContent", " A.")),
+    'anchor and alias': document(("userRoleContent", " &q Q?"), ("assistantRoleContent", " *q")),
+    'other top-level key': "thread:\n  - userRoleContent: Q?\n",
+    'extra key': "threadObject:\n  - userRoleContent: Q?\n  - note: ignore me\n",
+    'line separator': document(("userRoleContent", ' "a\u2028b"'), ("assistantRoleContent", " A.")),
+}
+
+@pytest.mark.parametrize('name', FAST_PATH_DOCUMENTS)
+def test_fast_path_matches_safe_load(name):
+    text = FAST_PATH_DOCUMENTS[name]
+    parsed = parse_thread_object(text.splitlines(keepends=True))
+    assert parsed is not None
+    assert parsed == yaml.safe_load(text)
+
+@pytest.mark.parametrize('name', FALLBACK_DOCUMENTS)
+def test_documents_outside_the_fast_path_fall_back_to_the_loader(name):
+    text = FALLBACK_DOCUMENTS[name]
+    assert parse_thread_object(text.splitlines(keepends=True)) is None
+    assert load_document(text) == yaml.safe_load(text)
+
+def test_malformed_documents_raise_the_loader_error():
+    text = "threadObject:\n  - userRoleContent: Q?\n    - assistantRoleContent: A.\n"
+    assert parse_thread_object(text.splitlines(keepends=True)) is None
+    with pytest.raises(yaml.YAMLError):
+        load_document(text)
+
+def test_load_documents_matches_safe_load_all():
+    texts = list(FAST_PATH_DOCUMENTS.values()) + list(FALLBACK_DOCUMENTS.values())
+    text = "".join(body if body.endswith("\n") else body + "\n" for body in texts).replace("threadObject:", "---\nthreadObject:")
+    documents, fast_count = load_documents(text.splitlines(keepends=True))
+    assert documents == list(yaml.safe_load_all(text))
+    assert fast_count == len(FAST_PATH_DOCUMENTS)
+
+def test_random_documents_parse_like_safe_load():
+    rng = random.Random(7)
+    paths = {'fast': 0, 'loader': 0}
+    values = [" plain text", " 'single ''quoted'''", ' "double \\"quoted\\"\\n"', " 12", " off", " a: b", " -dash", " #hash",
+              " |\n{i}  line one\n\n{i}    indented\n", " |-\n{i}  stripped\n", " |+\n{i}  kept\n\n", " >\n{i}  folded\n", "", " ~"]
+    for _ in range(500):
+        indent = " " * rng.randint(0, 4)
+        items = [(rng.choice(["systemRoleContent", "userRoleContent", "assistantRoleContent"]),
+                  rng.choice(values).replace("{i}", indent + " ")) for _ in range(rng.randint(1, 4))]
+        text = "threadObject:\n" + "".join(f"{indent}- {key}:{value}" + ("" if value.endswith("\n") else "\n") for key, value in items)
+        parsed = parse_thread_object(text.splitlines(keepends=True))
+        try:
+            expected = yaml.safe_load(text)
+        except yaml.YAMLError:
+            assert parsed is None, text
+            continue
+        assert parsed is None or parsed == expected, text
+        assert load_document(text) == expected, text
+        paths['loader' if parsed is None else 'fast'] += 1
+    # The mix exercises both paths
+    assert paths['fast'] > 50 and paths['loader'] > 50
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+from utils.metrics import stage_timer
+from utils.rate_limit import call_with_rate_limit
+from utils.response_cache import response_cache_key
+
+# The Batch API accepts at most this many requests per input file
+BATCH_MAX_REQUESTS = 50000
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Batches submitted but not yet collected, kept in the work directory so a rerun collects them instead of paying twice
+SUBMITTED_BATCHES_FILE = "submitted_batches.json"
+
+def write_batch_input(requests, file_path, endpoint="/v1/chat/completions"):
+    """
+    Writes requests to a Batch API input JSONL file.
+
+    :param requests: Dict mapping custom_id to the request body (chat completion keyword arguments).
+    :param file_path: Path of the JSONL file to write.
+    :param endpoint: API endpoint every request is sent to.
+    """
+    with open(file_path, 'w', encoding='utf-8') as batch_file:
+        for custom_id, body in requests.items():
+            batch_file.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": endpoint, "body": body}))
+            batch_file.write('\n')
+
+def _upload_batch_input(client, input_file_path):
+    # Opened per attempt, so a retried upload sends the file from the start
+    with open(input_file_path, 'rb') as f:
+        return client.files.create(file=f, purpose='batch')
+
+def submit_batch(client, input_file_path, endpoint="/v1/chat/completions", rate_limiter=None):
+    """Uploads a batch input file and creates a batch job. Returns the batch ID."""
+    input_file = call_with_rate_limit(rate_limiter, 'files', lambda: _upload_batch_input(client, input_file_path))
+    batch = call_with_rate_limit(rate_limiter, 'batches', lambda: client.batches.create(input_file_id=input_file.id, endpoint=endpoint,
+                                                                                        completion_window="24h"))
+    print(f"Batch {batch.id} submitted from {input_file_path}")
+    return batch.id
+
+def wait_for_batch(client, batch_id, poll_interval=60, rate_limiter=None):
+    """Polls a batch job until it reaches a terminal status and returns the final batch object."""
+    while True:
+        batch = call_with_rate_limit(rate_limiter, 'batches', lambda: client.batches.retrieve(batch_id))
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} requests done)" if counts else ""
+        print(f"Batch {batch_id} status: {batch.status}{progress}")
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+def read_batch_results(client, batch, rate_limiter=None):
+    """
+    Downloads the output of a finished batch.
+
+    :return: Dict mapping custom_id to the response body, for requests that succeeded.
+    """
+    results = {}
+    if batch.output_file_id:
+        output_text = call_with_rate_limit(rate_limiter, 'files', lambda: client.files.content(batch.output_file_id)).text
+        for line in output_text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get('response') or {}
+            if response.get('status_code') == 200 and not result.get('error'):
+                results[result['custom_id']] = response['body']
+    return results
+
+def delete_batch_files(client, batch, input_file_path=None, rate_limiter=None):
+    """
+    Deletes the files of a batch whose results have been collected: its uploaded input file, its output
+    and error files, and the local input file. Files that cannot be deleted are reported and left in place.
+    """
+    for file_id in (batch.input_file_id, batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        try:
+            call_with_rate_limit(rate_limiter, 'files', lambda: client.files.delete(file_id))
+        except Exception as e:
+            print(f"Error deleting batch file {file_id}: {e}")
+    if input_file_path and os.path.exists(input_file_path):
+        os.remove(input_file_path)
+
+def _load_submitted(work_dir):
+    path = os.path.join(work_dir, SUBMITTED_BATCHES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as submitted_file:
+        return json.load(submitted_file)
+
+def _save_submitted(work_dir, submitted):
+    """Atomically rewrites the record of the batches submitted but not yet collected, removing it once there are none."""
+    path = os.path.join(work_dir, SUBMITTED_BATCHES_FILE)
+    if not submitted:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(f"{path}.tmp", 'w') as submitted_file:
+        json.dump(submitted, submitted_file)
+    os.replace(f"{path}.tmp", path)
+
+def _collect_batch(client, batch_id, poll_interval, rate_limiter):
+    """Waits for a batch and returns (batch, results), or None if it could not be collected."""
+    try:
+        with stage_timer('batch_wait'):
+            batch = wait_for_batch(client, batch_id, poll_interval, rate_limiter)
+        return batch, read_batch_results(client, batch, rate_limiter)
+    except Exception as e:
+        print(f"Error collecting batch {batch_id}: {e}")
+        return None
+
+def response_content(body):
+    """Return the message content of a chat completion response body, or None."""
+    choices = body.get('choices') or []
+    return choices[0]['message']['content'] if choices else None
+
+def run_batch(client, requests, work_dir, poll_interval=60, endpoint="/v1/chat/completions", rate_limiter=None):
+    """
+    Submits requests as one or more batch jobs, waits for them and collects the results.
+
+    Requests are split into input files of at most BATCH_MAX_REQUESTS lines. All jobs are
+    submitted before polling starts, so they run side by side. Once a job's results are collected,
+    its input, output and error files are deleted.
+
+    Submitted jobs are recorded in work_dir until they are collected. If a run stops while polling
+    (interrupted, or the API failing), the next run collects those jobs first and only submits the
+    requests they did not answer.
+
+    :param client: OpenAI client.
+    :param requests: Dict mapping custom_id to the request body.
+    :param work_dir: Directory for the batch input files.
+    :param poll_interval: Seconds between status checks.
+    :param rate_limiter: Shared rate limiter (see utils/rate_limit.py); None only retries failed calls.
+    :return: Dict mapping custom_id to the response body, for requests that succeeded.
+             Requests missing from it failed and can be resubmitted.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    # Requests are matched to an earlier run's batches by their cache key, since custom IDs are not stable across runs
+    custom_ids_by_key = {}
+    for custom_id, body in requests.items():
+        custom_ids_by_key.setdefault(response_cache_key(body), []).append(custom_id)
+
+    submitted = _load_submitted(work_dir)
+    results = {}
+    for batch_id, record in list(submitted.items()):
+        print(f"Collecting batch {batch_id} submitted by an earlier run")
+        collected = _collect_batch(client, batch_id, poll_interval, rate_limiter)
+        if collected is None:
+            continue
+        batch, batch_results = collected
+        for custom_id, body in batch_results.items():
+            for requested_id in custom_ids_by_key.get(record['keys'].get(custom_id), []):
+                results[requested_id] = body
+        delete_batch_files(client, batch, record['input_file_path'], rate_limiter)
+        del submitted[batch_id]
+        _save_submitted(work_dir, submitted)
+
+    custom_ids = [custom_id for custom_id in requests if custom_id not in results]
+    new_batch_ids = []
+    for start in range(0, len(custom_ids), BATCH_MAX_REQUESTS):
+        part = {custom_id: requests[custom_id] for custom_id in custom_ids[start:start + BATCH_MAX_REQUESTS]}
+        input_file_path = os.path.join(work_dir, f"batch_input_{int(time.time())}_{start // BATCH_MAX_REQUESTS}.jsonl")
+        write_batch_input(part, input_file_path, endpoint)
+        try:
+            batch_id = submit_batch(client, input_file_path, endpoint, rate_limiter)
+        except Exception as e:
+            print(f"Error submitting batch {input_file_path}: {e}")
+            continue
+        new_batch_ids.append(batch_id)
+        submitted[batch_id] = {'input_file_path': input_file_path, 'keys': {custom_id: response_cache_key(body) for custom_id, body in part.items()}}
+        _save_submitted(work_dir, submitted)
+
+    for batch_id in new_batch_ids:
+        collected = _collect_batch(client, batch_id, poll_interval, rate_limiter)
+        if collected is None:
+            continue
+        batch, batch_results = collected
+        results.update(batch_results)
+        # Failed requests are resubmitted in a new input file, so nothing of this batch is needed any more
+        delete_batch_files(client, batch, submitted[batch_id]['input_file_path'], rate_limiter)
+        del submitted[batch_id]
+        _save_submitted(work_dir, submitted)
+    return results
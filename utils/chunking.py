@@ -0,0 +1,75 @@
+import math
+
+# Rough characters-per-token ratio for English prose and datasheet tables with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in a string without calling a tokenizer."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def split_oversized_text(text, token_budget):
+    """
+    Splits text that does not fit in the budget into pieces that do, on line boundaries
+    where possible and at a hard character limit otherwise.
+
+    :param text: Page text.
+    :param token_budget: Maximum estimated tokens per piece.
+    :return: List of text pieces.
+    """
+    max_chars = token_budget * CHARS_PER_TOKEN
+    pieces = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if len(current) + len(line) > max_chars:
+            pieces.append(current)
+            current = ''
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+def iter_packed_chunks(pages, token_budget):
+    """
+    Packs consecutive pages into chunks that fit an input-token budget, yielding each chunk as soon as
+    it is complete, so pages can be streamed in from the PDF reader.
+
+    Small pages are joined together; a page larger than the budget is split across several chunks.
+
+    :param pages: Iterable of page text strings, in page order.
+    :param token_budget: Maximum estimated content tokens per chunk.
+    :return: Generator of chunks, each a dict with 'text', 'pages' (0-based page numbers) and 'tokens'.
+    """
+    current = None
+    for page_num, page_text in enumerate(pages):
+        page_tokens = estimate_tokens(page_text)
+        if page_tokens > token_budget:
+            if current:
+                yield current
+                current = None
+            for piece in split_oversized_text(page_text, token_budget):
+                yield {'text': piece, 'pages': [page_num], 'tokens': estimate_tokens(piece)}
+            continue
+
+        if current and current['tokens'] + page_tokens > token_budget:
+            yield current
+            current = None
+        if current is None:
+            current = {'text': page_text, 'pages': [page_num], 'tokens': page_tokens}
+        else:
+            current['text'] += '\n\n' + page_text
+            current['pages'].append(page_num)
+            current['tokens'] += page_tokens
+    if current:
+        yield current
+
+def scale_max_tokens(chunk_tokens, floor=1000, ceiling=4000):
+    """Scale the completion budget with the amount of content in a chunk, within [floor, ceiling]."""
+    return max(floor, min(ceiling, chunk_tokens * 2))
@@ -0,0 +1,104 @@
+import re
+import zlib
+import random
+
+# MinHash signature length and LSH banding; 16 bands of 4 rows finds pages with Jaccard
+# similarity around 0.7 and above with high probability
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Fixed seed so signatures are comparable across runs
+_rng = random.Random(1234)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+def shingle_hashes(text):
+    """Return the set of hashed word 5-grams of a page, after normalising case and whitespace."""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {zlib.crc32(' '.join(words).encode('utf-8'))} if words else set()
+    return {zlib.crc32(' '.join(words[i:i + SHINGLE_SIZE]).encode('utf-8')) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash_signature(text):
+    """Return the MinHash signature of a page, or None if it has no words to compare."""
+    hashes = shingle_hashes(text)
+    if not hashes:
+        return None
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def estimate_similarity(signature_a, signature_b):
+    """Estimate the Jaccard similarity of two pages from their signatures."""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERMUTATIONS
+
+def new_dedup_index(threshold):
+    """
+    Creates an empty near-duplicate index.
+
+    :param threshold: Minimum estimated Jaccard similarity for a page to count as a duplicate.
+    :return: Index dict used by find_duplicate and add_page.
+    """
+    return {'threshold': threshold, 'buckets': {}, 'pages': [], 'dropped': []}
+
+def _band_keys(signature):
+    rows = NUM_PERMUTATIONS // LSH_BANDS
+    return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(LSH_BANDS)]
+
+def find_duplicate(index, signature):
+    """
+    Looks for an indexed page similar to the given signature.
+
+    :return: (page_ref, similarity) of the most similar page above the threshold, or (None, 0.0).
+    """
+    candidates = set()
+    for key in _band_keys(signature):
+        candidates.update(index['buckets'].get(key, ()))
+
+    best_ref, best_similarity = None, 0.0
+    for candidate in candidates:
+        candidate_ref, candidate_signature = index['pages'][candidate]
+        similarity = estimate_similarity(signature, candidate_signature)
+        if similarity >= index['threshold'] and similarity > best_similarity:
+            best_ref, best_similarity = candidate_ref, similarity
+    return best_ref, best_similarity
+
+def add_page(index, signature, page_ref):
+    """Adds a page signature to the index under a reference such as {'document': ..., 'page': ...}."""
+    position = len(index['pages'])
+    index['pages'].append((page_ref, signature))
+    for key in _band_keys(signature):
+        index['buckets'].setdefault(key, []).append(position)
+
+def keep_page(index, document, page_num, page_text):
+    """
+    Checks one page against the pages seen so far and indexes it if it is new.
+
+    A page that is a near-duplicate of a page already seen, within this document or an earlier one,
+    is recorded in index['dropped'] for the dedup report.
+
+    :param page_num: 0-based number of the page in the PDF.
+    :return: True if the page should be kept.
+    """
+    signature = minhash_signature(page_text)
+    if signature is None:
+        return True
+    duplicate_of, similarity = find_duplicate(index, signature)
+    if duplicate_of is not None:
+        index['dropped'].append({
+            'document': document,
+            'page': page_num + 1,
+            'duplicate_of': duplicate_of,
+            'similarity': round(similarity, 3),
+        })
+        return False
+    add_page(index, signature, {'document': document, 'page': page_num + 1})
+    return True
+
+def index_page(index, document, page_num, page_text):
+    """
+    Indexes a page an earlier run already sent, so later pages are checked against it. A page that
+    duplicates one indexed before is left out, as that run dropped it; nothing goes into the dedup report.
+    """
+    signature = minhash_signature(page_text)
+    if signature is not None and find_duplicate(index, signature)[0] is None:
+        add_page(index, signature, {'document': document, 'page': page_num + 1})
@@ -0,0 +1,166 @@
+import os
+import math
+import random
+import shutil
+import hashlib
+import tempfile
+
+# Buffer size for bulk copies and line-by-line reads of large JSONL files
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+def copy_file_bytes(input_file_path, output_file):
+    """
+    Appends the raw bytes of a file to an open binary file, using copy_file_range/sendfile
+    (zero-copy in the kernel) where the platform supports it and large buffered copies otherwise.
+
+    A trailing newline is added if the input does not end with one, so JSONL records never merge.
+
+    :return: Number of bytes written.
+    """
+    size = os.path.getsize(input_file_path)
+    if size == 0:
+        return 0
+
+    with open(input_file_path, 'rb') as input_file:
+        output_file.flush()
+        copied = 0
+        if hasattr(os, 'copy_file_range') or hasattr(os, 'sendfile'):
+            try:
+                zero_copy = os.copy_file_range if hasattr(os, 'copy_file_range') else _sendfile
+                while copied < size:
+                    sent = zero_copy(input_file.fileno(), output_file.fileno(), size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                output_file.seek(0, os.SEEK_END)
+            except OSError:
+                # e.g. unsupported filesystem pair; fall back to a buffered copy of the rest
+                output_file.seek(0, os.SEEK_END)
+        if copied < size:
+            input_file.seek(copied)
+            shutil.copyfileobj(input_file, output_file, COPY_BUFFER_SIZE)
+
+        input_file.seek(-1, os.SEEK_END)
+        if input_file.read(1) != b'\n':
+            output_file.write(b'\n')
+            return size + 1
+    return size
+
+def _sendfile(in_fd, out_fd, count):
+    return os.sendfile(out_fd, in_fd, None, count)
+
+def line_digest(line):
+    """Return a compact digest identifying a JSONL record, ignoring its line ending."""
+    return hashlib.blake2b(line.rstrip(b'\r\n'), digest_size=8).digest()
+
+def iter_jsonl_lines(file_path):
+    """Yield the non-blank lines of a JSONL file as bytes, newline-terminated."""
+    with open(file_path, 'rb', buffering=COPY_BUFFER_SIZE) as input_file:
+        for line in input_file:
+            if not line.strip():
+                continue
+            yield line if line.endswith(b'\n') else line + b'\n'
+
+def append_unique_lines(input_file_path, output_file, seen):
+    """
+    Appends the records of a JSONL file that are not in `seen`, adding their digests to it.
+
+    :return: (records written, duplicate records dropped)
+    """
+    written = dropped = 0
+    for line in iter_jsonl_lines(input_file_path):
+        digest = line_digest(line)
+        if digest in seen:
+            dropped += 1
+            continue
+        seen.add(digest)
+        output_file.write(line)
+        written += 1
+    return written, dropped
+
+def load_seen_digests(file_path):
+    """Return the set of record digests already present in a JSONL file."""
+    if not os.path.exists(file_path):
+        return set()
+    return {line_digest(line) for line in iter_jsonl_lines(file_path)}
+
+def external_shuffle(input_file_path, seed=None, memory_mb=256):
+    """
+    Yields the lines of a JSONL file in random order while holding at most about memory_mb in memory.
+
+    Lines are first scattered at random into temporary bucket files sized to fit the memory budget,
+    then each bucket is loaded, shuffled and emitted in turn.
+    """
+    rng = random.Random(seed)
+    size = os.path.getsize(input_file_path)
+    bucket_count = max(1, math.ceil(size / (memory_mb * 1024 * 1024)))
+    if bucket_count == 1:
+        lines = list(iter_jsonl_lines(input_file_path))
+        rng.shuffle(lines)
+        yield from lines
+        return
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(input_file_path))) as temp_dir:
+        buckets = [open(os.path.join(temp_dir, f"bucket_{i}.jsonl"), 'wb') for i in range(bucket_count)]
+        try:
+            for line in iter_jsonl_lines(input_file_path):
+                buckets[rng.randrange(bucket_count)].write(line)
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        for i in range(bucket_count):
+            with open(os.path.join(temp_dir, f"bucket_{i}.jsonl"), 'rb') as bucket:
+                lines = bucket.readlines()
+            rng.shuffle(lines)
+            yield from lines
+
+def write_splits(lines, output_dir, validation_fraction=0.0, shard_max_mb=None, seed=None):
+    """
+    Writes records into size-capped training shards plus an optional validation file.
+
+    :param lines: Iterable of newline-terminated JSONL records (bytes).
+    :param output_dir: Directory for train_shard_NNN.jsonl and validation.jsonl.
+    :param validation_fraction: Fraction of records sent to validation.jsonl.
+    :param shard_max_mb: Maximum size of each training shard; None writes a single shard.
+    :param seed: Seed for the train/validation assignment.
+    :return: Dict with the shard paths, validation path and record counts.
+    """
+    rng = random.Random(seed)
+    max_bytes = shard_max_mb * 1024 * 1024 if shard_max_mb else None
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Remove shards from a previous run so a smaller dataset does not leave stale ones behind,
+    # and its validation file, which is rewritten below or must go if there is no validation split any more
+    for file_name in os.listdir(output_dir):
+        if (file_name.startswith('train_shard_') and file_name.endswith('.jsonl')) or file_name == 'validation.jsonl':
+            os.remove(os.path.join(output_dir, file_name))
+
+    shard_paths = []
+    shard_file = None
+    shard_size = 0
+    validation_path = os.path.join(output_dir, 'validation.jsonl') if validation_fraction else None
+    validation_file = open(validation_path, 'wb') if validation_path else None
+    counts = {'train': 0, 'validation': 0}
+    try:
+        for line in lines:
+            if validation_file is not None and rng.random() < validation_fraction:
+                validation_file.write(line)
+                counts['validation'] += 1
+                continue
+            if shard_file is None or (max_bytes and shard_size > 0 and shard_size + len(line) > max_bytes):
+                if shard_file is not None:
+                    shard_file.close()
+                shard_paths.append(os.path.join(output_dir, f"train_shard_{len(shard_paths):03d}.jsonl"))
+                shard_file = open(shard_paths[-1], 'wb')
+                shard_size = 0
+            shard_file.write(line)
+            shard_size += len(line)
+            counts['train'] += 1
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+        if validation_file is not None:
+            validation_file.close()
+
+    return {'shards': shard_paths, 'validation': validation_path, 'counts': counts}
@@ -1,6 +1,6 @@
 import os
 import yaml
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
 def load_config(file_path='config/config.yaml'):
     """Load configuration from a YAML file and set up directory paths."""
@@ -9,6 +9,12 @@ def load_config(file_path='config/config.yaml'):
 
     pdf_dir = config['pdf_directory']
     yaml_dir = os.path.join(pdf_dir, 'yaml_files')
+    # Extracted page text can be kept elsewhere, e.g. on a faster disk, by setting page_cache_directory
+    page_cache_dir = config.get('page_cache_directory') or os.path.join(pdf_dir, 'page_cache')
+    response_cache_path = os.path.join(pdf_dir, 'response_cache.sqlite')
+    metrics_dir = os.path.join(pdf_dir, 'metrics')
+    work_queue_path = os.path.join(pdf_dir, 'work_queue.sqlite')
+    rate_limit_path = os.path.join(pdf_dir, 'rate_limits.sqlite')
     cleaned_yaml_dir = os.path.join(yaml_dir, 'cleaned_yaml_files')
     json_dir = os.path.join(cleaned_yaml_dir, 'json_files')
     jsonl_dir = os.path.join(json_dir, 'jsonl_files')
@@ -18,6 +24,11 @@ def load_config(file_path='config/config.yaml'):
     
 
     config['yaml_directory'] = yaml_dir
+    config['page_cache_directory'] = page_cache_dir
+    config['response_cache_path'] = response_cache_path
+    config['metrics_directory'] = metrics_dir
+    config['work_queue_path'] = work_queue_path
+    config['rate_limit_path'] = rate_limit_path
     config['cleaned_yaml_directory'] = cleaned_yaml_dir
     config['json_directory'] = json_dir
     config['jsonl_directory'] = jsonl_dir
@@ -31,9 +42,15 @@ def load_secrets(file_path='config/secrets.yaml'):
     with open(file_path, 'r') as file:
         return yaml.safe_load(file)
     
-# Initialize OpenAI client
+# Initialize OpenAI client. Retries are left to utils/rate_limit.py, which shares rate limit state between processes
 def init_openai_client():
     secrets = load_secrets('config/secrets.yaml')
-    client = OpenAI(api_key = secrets['api_key'])
+    client = OpenAI(api_key = secrets['api_key'], base_url = secrets.get('base_url'), max_retries = 0)
+    return client
+
+# Initialize async OpenAI client (used by the async execution mode)
+def init_async_openai_client():
+    secrets = load_secrets('config/secrets.yaml')
+    client = AsyncOpenAI(api_key = secrets['api_key'], base_url = secrets.get('base_url'), max_retries = 0)
     return client
 
@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+from utils.page_cache import hash_file
+
+# The pipeline as a dependency graph: each stage reads the files in one config directory and
+# writes into another (see load_config). `depends_on` names the stage that produces the inputs.
+PIPELINE_STAGES = {
+    'process_pdf': {'input_directory': 'pdf_directory', 'input_extension': '.pdf', 'output_directory': 'yaml_directory', 'depends_on': None},
+    'yaml_to_json': {'input_directory': 'yaml_directory', 'input_extension': '.yaml', 'output_directory': 'json_directory', 'depends_on': 'process_pdf'},
+    'json_to_jsonl': {'input_directory': 'json_directory', 'input_extension': '.json', 'output_directory': 'jsonl_directory', 'depends_on': 'yaml_to_json'},
+    'combine_jsonl_files': {'input_directory': 'jsonl_directory', 'input_extension': '.jsonl', 'output_directory': 'combined_jsonl_directory', 'depends_on': 'json_to_jsonl'},
+    'build_training_data': {'input_directory': 'yaml_directory', 'input_extension': '.yaml', 'output_directory': 'combined_jsonl_directory', 'depends_on': 'process_pdf'},
+}
+
+def manifest_path(config):
+    """Return the manifest path for a loaded config."""
+    return os.path.join(config['pdf_directory'], 'manifest.json')
+
+def load_manifest(file_path):
+    """Load the manifest, or return an empty one if it does not exist yet."""
+    if not os.path.exists(file_path):
+        return {'stages': {}, 'file_hashes': {}}
+    with open(file_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+def save_manifest(manifest, file_path):
+    """Atomically write the manifest to disk."""
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    os.replace(temp_path, file_path)
+
+def hash_params(params):
+    """Return a stable hash of a JSON-serialisable parameter set, e.g. a prompt set definition."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def pdf_output_params(prompt_set, page_spec=None, token_budget=None, dedup_threshold=None):
+    """
+    Manifest parameters of a process_pdf output: the prompt set, plus whichever of the page selection,
+    the chunk token budget and the dedup threshold are set, so changing any of them makes the output stale.
+    Without any of them the prompt set alone is used, as in manifests written before they existed.
+    """
+    settings = {'page_selection': page_spec, 'chunk_token_budget': token_budget or None, 'dedup_threshold': dedup_threshold or None}
+    settings = {key: value for key, value in settings.items() if value is not None}
+    return dict(settings, prompt_set=prompt_set) if settings else prompt_set
+
+def file_fingerprint(manifest, file_path):
+    """
+    Returns the content hash of a file.
+
+    Hashes are memoised in the manifest by (size, mtime), so unchanged files are not re-read.
+    """
+    stat = os.stat(file_path)
+    cached = manifest['file_hashes'].get(file_path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+    sha256 = hash_file(file_path)
+    manifest['file_hashes'][file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+    return sha256
+
+def is_stale(manifest, stage, output_path, input_paths, params=None):
+    """
+    Checks whether an output has to be rebuilt.
+
+    :param manifest: Manifest returned by load_manifest.
+    :param stage: Stage name from PIPELINE_STAGES.
+    :param output_path: Output file produced by the stage.
+    :param input_paths: Input files the output is built from.
+    :param params: Optional parameters the output depends on (e.g. a prompt set).
+    :return: True if the output is missing or was modified, or any input or parameter changed since it was recorded.
+    """
+    entry = manifest['stages'].get(stage, {}).get(output_path)
+    if entry is None or not os.path.exists(output_path) or file_fingerprint(manifest, output_path) != entry['output']:
+        return True
+    if params is not None and entry.get('params') != hash_params(params):
+        return True
+    recorded_inputs = entry['inputs']
+    if set(recorded_inputs) != set(input_paths):
+        return True
+    return any(not os.path.exists(path) or file_fingerprint(manifest, path) != recorded_inputs[path] for path in input_paths)
+
+def record_output(manifest, stage, output_path, input_paths, params=None):
+    """Records the inputs (and parameters) an output was built from, along with the output's own hash."""
+    manifest['stages'].setdefault(stage, {})[output_path] = {
+        'output': file_fingerprint(manifest, output_path),
+        'inputs': {path: file_fingerprint(manifest, path) for path in input_paths},
+        'params': hash_params(params) if params is not None else None,
+    }
+
+def plan_incremental_update(manifest, stage, output_path, input_paths):
+    """
+    Decides how to bring a combined output up to date with its (ordered) inputs.
+
+    :return: ('skip', []) if nothing changed, ('append', new_inputs) if the only change is
+             inputs added after the recorded ones, otherwise ('rebuild', input_paths).
+    """
+    entry = manifest['stages'].get(stage, {}).get(output_path)
+    # Another stage (or a person) may have rewritten the output since it was recorded
+    if entry is None or not os.path.exists(output_path) or file_fingerprint(manifest, output_path) != entry['output']:
+        return 'rebuild', list(input_paths)
+
+    recorded_inputs = entry['inputs']
+    for path, sha256 in recorded_inputs.items():
+        if path not in input_paths or not os.path.exists(path) or file_fingerprint(manifest, path) != sha256:
+            return 'rebuild', list(input_paths)
+
+    new_inputs = [path for path in input_paths if path not in recorded_inputs]
+    return ('append', new_inputs) if new_inputs else ('skip', [])
+
+def list_stage_inputs(config, stage):
+    """Return the input files of a stage, sorted by name."""
+    stage_info = PIPELINE_STAGES[stage]
+    input_dir = config[stage_info['input_directory']]
+    if not os.path.isdir(input_dir):
+        return []
+    return [os.path.join(input_dir, file_name) for file_name in sorted(os.listdir(input_dir))
+            if file_name.endswith(stage_info['input_extension'])]
+
+def stale_inputs(config, manifest, stage, param_sets=None):
+    """
+    Returns the input files of a stage that are not covered by an up-to-date output.
+
+    An input is up to date when a recorded output of the stage lists it with its current hash.
+    If param_sets is given (e.g. the selected prompt sets), there must be such an output for
+    every parameter set. param_sets may also be a function returning the parameter sets of an input path.
+    """
+    current = set()
+    for entry in manifest['stages'].get(stage, {}).values():
+        for path, sha256 in entry['inputs'].items():
+            current.add((path, sha256, entry['params']))
+
+    stale = []
+    for path in list_stage_inputs(config, stage):
+        sha256 = file_fingerprint(manifest, path)
+        if param_sets is None:
+            if not any(path == recorded_path and sha256 == recorded_sha256 for recorded_path, recorded_sha256, _ in current):
+                stale.append(path)
+            continue
+        required_params = [hash_params(params) for params in (param_sets(path) if callable(param_sets) else param_sets)]
+        if any((path, sha256, params_hash) not in current for params_hash in required_params):
+            stale.append(path)
+    return stale
+
+def stage_order():
+    """Return the stage names in dependency order."""
+    ordered = []
+    def visit(stage):
+        if stage in ordered:
+            return
+        dependency = PIPELINE_STAGES[stage]['depends_on']
+        if dependency:
+            visit(dependency)
+        ordered.append(stage)
+    for stage in PIPELINE_STAGES:
+        visit(stage)
+    return ordered
+
+def downstream_stages(stage):
+    """Return every stage that (transitively) depends on the given stage."""
+    dependents = [name for name, info in PIPELINE_STAGES.items() if info['depends_on'] == stage]
+    for dependent in list(dependents):
+        dependents.extend(downstream_stages(dependent))
+    return dependents
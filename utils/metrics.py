@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Number of functions listed when a profile is printed
+PROFILE_TOP_FUNCTIONS = 25
+
+# Metrics of the current process. Requests can be recorded from upload threads, hence the lock.
+_metrics = {'stages': {}, 'requests': {}, 'counters': {}, 'spans': []}
+_lock = threading.Lock()
+
+def _add_span(name, category, start, duration, args=None):
+    span = {'name': name, 'cat': category, 'ph': 'X', 'ts': int(start * 1_000_000), 'dur': int(duration * 1_000_000),
+            'pid': os.getpid(), 'tid': threading.get_ident()}
+    if args:
+        span['args'] = args
+    _metrics['spans'].append(span)
+
+@contextmanager
+def stage_timer(stage, **span_args):
+    """
+    Records the wall time and CPU time of this process spent inside the block under `stage`.
+
+    Work done in extraction pool processes shows up as wall time only.
+    """
+    start, wall_start, cpu_start = time.time(), time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        with _lock:
+            totals = _metrics['stages'].setdefault(stage, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            totals['calls'] += 1
+            totals['wall_seconds'] += wall
+            totals['cpu_seconds'] += cpu
+            _add_span(stage, 'stage', start, wall, span_args)
+
+def record_request(kind, start, usage=None, error=False):
+    """
+    Records one API call.
+
+    :param kind: Kind of call, e.g. 'chat_completion' or 'upload_part'.
+    :param start: time.time() when the call started; the latency is measured up to now.
+    :param usage: The response's usage object, if any, for prompt, cached prompt and completion token counts.
+    :param error: True if the call failed.
+    """
+    latency = time.time() - start
+    with _lock:
+        totals = _metrics['requests'].setdefault(kind, {
+            'count': 0, 'errors': 0, 'latency_sum': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS),
+            'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0, 'cached_requests': 0, 'cached_latency_sum': 0.0,
+        })
+        totals['count'] += 1
+        totals['errors'] += int(error)
+        totals['latency_sum'] += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                totals['buckets'][i] += 1
+        if usage is not None:
+            totals['prompt_tokens'] += getattr(usage, 'prompt_tokens', 0) or 0
+            totals['completion_tokens'] += getattr(usage, 'completion_tokens', 0) or 0
+            # Prompt tokens served from the provider's prompt cache; requests with any are timed separately
+            cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', 0) or 0
+            if cached_tokens:
+                totals['cached_tokens'] += cached_tokens
+                totals['cached_requests'] += 1
+                totals['cached_latency_sum'] += latency
+        _add_span(kind, 'request', start, latency, {'error': True} if error else None)
+
+def increment(counter, value=1):
+    """Adds to a named counter, e.g. bytes_written, retries or response_cache_hits."""
+    with _lock:
+        _metrics['counters'][counter] = _metrics['counters'].get(counter, 0) + value
+
+def metrics_summary():
+    """Returns the stage, request and counter totals recorded so far."""
+    with _lock:
+        return json.loads(json.dumps({key: value for key, value in _metrics.items() if key != 'spans'}))
+
+def prometheus_text(summary):
+    """Formats a metrics summary in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        if not samples:
+            return
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+
+    stages = summary['stages']
+    metric('etl_stage_calls_total', 'counter', 'Times each stage ran.',
+           [f'etl_stage_calls_total{{stage="{stage}"}} {totals["calls"]}' for stage, totals in stages.items()])
+    metric('etl_stage_wall_seconds_total', 'counter', 'Wall time spent in each stage.',
+           [f'etl_stage_wall_seconds_total{{stage="{stage}"}} {totals["wall_seconds"]:.6f}' for stage, totals in stages.items()])
+    metric('etl_stage_cpu_seconds_total', 'counter', 'CPU time of the main process spent in each stage.',
+           [f'etl_stage_cpu_seconds_total{{stage="{stage}"}} {totals["cpu_seconds"]:.6f}' for stage, totals in stages.items()])
+
+    requests = summary['requests']
+    histogram = []
+    for kind, totals in requests.items():
+        for bound, count in zip(LATENCY_BUCKETS, totals['buckets']):
+            histogram.append(f'etl_request_latency_seconds_bucket{{kind="{kind}",le="{bound}"}} {count}')
+        histogram.append(f'etl_request_latency_seconds_bucket{{kind="{kind}",le="+Inf"}} {totals["count"]}')
+        histogram.append(f'etl_request_latency_seconds_sum{{kind="{kind}"}} {totals["latency_sum"]:.6f}')
+        histogram.append(f'etl_request_latency_seconds_count{{kind="{kind}"}} {totals["count"]}')
+    metric('etl_request_latency_seconds', 'histogram', 'Latency of API calls.', histogram)
+    metric('etl_request_errors_total', 'counter', 'API calls that failed.',
+           [f'etl_request_errors_total{{kind="{kind}"}} {totals["errors"]}' for kind, totals in requests.items()])
+    metric('etl_prompt_tokens_total', 'counter', 'Prompt tokens reported by the API.',
+           [f'etl_prompt_tokens_total{{kind="{kind}"}} {totals["prompt_tokens"]}' for kind, totals in requests.items()])
+    metric('etl_cached_prompt_tokens_total', 'counter', 'Prompt tokens served from the provider prompt cache.',
+           [f'etl_cached_prompt_tokens_total{{kind="{kind}"}} {totals["cached_tokens"]}' for kind, totals in requests.items()])
+    metric('etl_completion_tokens_total', 'counter', 'Completion tokens reported by the API.',
+           [f'etl_completion_tokens_total{{kind="{kind}"}} {totals["completion_tokens"]}' for kind, totals in requests.items()])
+
+    for counter, value in summary['counters'].items():
+        metric(f'etl_{counter}_total', 'counter', f'{counter.replace("_", " ").capitalize()}.', [f'etl_{counter}_total {value}'])
+    return '\n'.join(lines) + '\n'
+
+def export_metrics(directory, run_name):
+    """
+    Writes what has been recorded as <run_name>_trace.json and <run_name>.prom in `directory`.
+
+    The trace uses the Chrome trace event format, so it opens in chrome://tracing or Perfetto;
+    its "metrics" key holds the same totals as the Prometheus file.
+
+    :return: (trace path, Prometheus file path)
+    """
+    os.makedirs(directory, exist_ok=True)
+    summary = metrics_summary()
+    with _lock:
+        spans = list(_metrics['spans'])
+
+    trace_path = os.path.join(directory, f"{run_name}_trace.json")
+    with open(trace_path, 'w') as trace_file:
+        json.dump({'traceEvents': spans, 'displayTimeUnit': 'ms', 'metrics': summary}, trace_file)
+
+    prometheus_path = os.path.join(directory, f"{run_name}.prom")
+    with open(prometheus_path, 'w') as prometheus_file:
+        prometheus_file.write(prometheus_text(summary))
+    print(f"Metrics saved to {trace_path} and {prometheus_path}")
+    return trace_path, prometheus_path
+
+@contextmanager
+def profiled(output_path=None):
+    """
+    Runs the block under cProfile when output_path is given, saving the stats there
+    (viewable with snakeviz or pstats) and printing the most expensive functions.
+    """
+    if not output_path:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        profiler.dump_stats(output_path)
+        print(f"Profile saved to {output_path}")
+        pstats.Stats(output_path).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+def profile_path(config, run_name):
+    """Returns where to save the profile of a run, or None if profiling is off in config.yaml."""
+    if not config.get('profile'):
+        return None
+    return os.path.join(config['metrics_directory'], f"{run_name}.prof")
@@ -0,0 +1,410 @@
+import re
+import json
+import time
+import hashlib
+import random
+import argparse
+import threading
+from email import policy
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A reply in the threadObject format process_pdf.py asks the model for. {ref} is filled in from a hash of the
+# prompt, so different pages get different examples (and combine_jsonl_files' dedup keeps them all) while
+# a repeated request gets the same reply, as with a deterministic model.
+MOCK_COMPLETION = """```yaml
+threadObject:
+    - systemRoleContent: "You are an embedded systems assistant."
+    - userRoleContent: "How do I enable the timer interrupt described on page {ref}?"
+    - assistantRoleContent: "Set the enable bit in the control register, then unmask the interrupt."
+```"""
+# The same example as a structured-output reply, for requests with a json_schema response_format
+MOCK_JSON_COMPLETION = json.dumps({'messages': [
+    {'role': 'system', 'content': "You are an embedded systems assistant."},
+    {'role': 'user', 'content': "How do I enable the timer interrupt described on page {ref}?"},
+    {'role': 'assistant', 'content': "Set the enable bit in the control register, then unmask the interrupt."},
+]})
+# A reply the YAML loader rejects (an unquoted ': ' inside a value), as models occasionally produce
+MALFORMED_COMPLETION = """```yaml
+threadObject:
+    - systemRoleContent: You are an embedded systems assistant.
+    - userRoleContent: Which register: the control or the status register?
+    - assistantRoleContent: The control register: set its enable bit.
+```"""
+
+# Prompt caching as the API does it: prefixes of at least 1024 tokens, matched in 128-token steps (4 characters per token here)
+MIN_CACHED_PREFIX_CHARS = 4096
+CACHED_PREFIX_STEP_CHARS = 512
+
+def _cached_prompt_chars(state, prompt_text):
+    """Returns how many leading characters of a prompt an earlier request already sent, and remembers its prefixes."""
+    cached = 0
+    with state['lock']:
+        for end in range(MIN_CACHED_PREFIX_CHARS, len(prompt_text) + 1, CACHED_PREFIX_STEP_CHARS):
+            prefix = hash(prompt_text[:end])
+            if prefix in state['prompt_prefixes']:
+                cached = end
+            else:
+                state['prompt_prefixes'].add(prefix)
+    return cached
+
+# What a new fine-tuning job does, one step per poll of its events: (message, new status), or None for a poll
+# with nothing new. Tests can give a job its own steps through state['fine_tunes'][job_id]['steps'].
+DEFAULT_FINE_TUNE_STEPS = [("The job has successfully completed", "succeeded")]
+
+def _fine_tune_event(state, fine_tune, message):
+    event = {'id': _new_id(state, 'ftevent'), 'object': 'fine_tuning.job.event', 'created_at': int(time.time()),
+             'level': 'info', 'message': message}
+    with state['lock']:
+        fine_tune['events'].append(event)
+
+def _format_reset(seconds):
+    """Formats a duration the way x-ratelimit-reset-* headers do, e.g. "1m30s" or "250ms"."""
+    if seconds < 1:
+        return f"{int(seconds * 1000)}ms"
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}m{seconds:.3g}s" if minutes else f"{seconds:.3g}s"
+
+def _take_rate_limit(state, tokens):
+    """
+    Applies the requests-per-minute and tokens-per-minute limits, if set, the way the API does: both
+    budgets refill continuously up to the limit, and a request counts its prompt plus max_tokens.
+
+    :return: (allowed, headers); headers is the x-ratelimit-* set (plus retry-after when refused), or {} without limits.
+    """
+    limits = state['rate_limits']
+    if not limits['requests_per_minute'] and not limits['tokens_per_minute']:
+        return True, {}
+    with state['lock']:
+        now = time.time()
+        elapsed, limits['updated_at'] = now - limits['updated_at'], now
+        # (per-minute limit, budget key, units this request needs) for each limit that is set
+        budgets = [(limit, key, min(needed, limit)) for limit, key, needed in
+                   ((limits['requests_per_minute'], 'requests', 1), (limits['tokens_per_minute'], 'tokens', tokens)) if limit]
+        for limit, key, _ in budgets:
+            limits[key] = min(limit, limits[key] + elapsed * limit / 60)
+        allowed = all(limits[key] >= needed for _, key, needed in budgets)
+        if allowed:
+            limits['requests'] -= 1
+            limits['tokens'] -= tokens
+        headers = {}
+        resets = []
+        for limit, key, needed in budgets:
+            resets.append(max(0.0, needed - limits[key]) * 60 / limit)
+            headers[f'x-ratelimit-limit-{key}'] = str(limit)
+            headers[f'x-ratelimit-remaining-{key}'] = str(max(0, int(limits[key])))
+            headers[f'x-ratelimit-reset-{key}'] = _format_reset(resets[-1])
+        if not allowed:
+            headers['retry-after-ms'] = str(int(max(resets) * 1000) + 1)
+    return allowed, headers
+
+def _count(state, key):
+    with state['lock']:
+        state['counts'][key] = state['counts'].get(key, 0) + 1
+
+def _new_id(state, prefix):
+    with state['lock']:
+        state['next_id'] += 1
+        return f"{prefix}-mock-{state['next_id']}"
+
+def _parse_form(content_type, body):
+    """Returns the fields of a multipart/form-data body as {name: (filename, content bytes)}."""
+    message = BytesParser(policy=policy.HTTP).parsebytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    return {part.get_param('name', header='content-disposition'): (part.get_filename(), part.get_payload(decode=True))
+            for part in message.iter_parts()}
+
+def _store_file(state, content, filename, purpose):
+    """Keeps an uploaded (or generated) file in memory and returns its file object."""
+    file_object = {'id': _new_id(state, 'file'), 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                   'filename': filename, 'purpose': purpose, 'status': 'processed'}
+    with state['lock']:
+        state['files'][file_object['id']] = (file_object, content)
+    return file_object
+
+def _chat_completion(state, request):
+    """
+    Answers one chat completion request body, failing at the configured error rate.
+
+    :return: (status, payload); payload is a chat.completion object, or an error object for a 500.
+    """
+    if _random(state) < state['error_rate']:
+        _count(state, 'errors')
+        return 500, {'error': {'message': 'Mock server error', 'type': 'server_error'}}
+    _count(state, 'chat_completions')
+    prompt_text = ''.join(message['content'] for message in request['messages'])
+    prompt_tokens = len(prompt_text) // 4
+    cached_tokens = _cached_prompt_chars(state, prompt_text) // 4
+    ref = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()[:12]
+    if request.get('response_format', {}).get('type') == 'json_schema':
+        # Strict structured outputs constrain decoding, so these replies always match the schema
+        completion = MOCK_JSON_COMPLETION.replace('{ref}', ref)
+    elif _random(state) < state['malformed_rate']:
+        _count(state, 'malformed_completions')
+        completion = MALFORMED_COMPLETION
+    else:
+        completion = MOCK_COMPLETION.replace('{ref}', ref)
+    return 200, {
+        'id': f"chatcmpl-mock-{time.time_ns()}", 'object': 'chat.completion', 'created': int(time.time()),
+        'model': request['model'],
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': completion}}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(completion) // 4,
+                  'total_tokens': prompt_tokens + len(completion) // 4,
+                  'prompt_tokens_details': {'cached_tokens': cached_tokens}},
+    }
+
+def _run_batch(state, batch):
+    """
+    Runs every request of a batch input file at once, the way a finished batch job reports them:
+    successes in the output file, failures (at the configured error rate) in the error file.
+    """
+    _, input_content = state['files'][batch['input_file_id']]
+    output_lines, error_lines = [], []
+    for line in input_content.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        _count(state, 'batch_requests')
+        status, payload = _chat_completion(state, item['body'])
+        result = {'id': _new_id(state, 'batch_req'), 'custom_id': item['custom_id'],
+                  'response': {'status_code': status, 'request_id': _new_id(state, 'req'), 'body': payload}, 'error': None}
+        (output_lines if status == 200 else error_lines).append(json.dumps(result))
+    for key, lines in (('output_file_id', output_lines), ('error_file_id', error_lines)):
+        if lines:
+            batch[key] = _store_file(state, ('\n'.join(lines) + '\n').encode('utf-8'), f"{batch['id']}_{key}.jsonl", 'batch_output')['id']
+    batch['request_counts'] = {'total': len(output_lines) + len(error_lines), 'completed': len(output_lines), 'failed': len(error_lines)}
+    batch['status'] = 'completed'
+    batch['completed_at'] = int(time.time())
+
+def _random(state):
+    with state['lock']:
+        return state['rng'].random()
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Answers the subset of the OpenAI API used by the pipeline with canned responses. Uploaded files,
+    batch jobs and multipart uploads are kept in memory, so the batch mode and resumable uploads run end
+    to end: batch requests and upload parts fail at the same error rate as chat completions, batch results
+    are served from generated output and error files, and completed uploads are checked against their
+    size and MD5. Fine-tuning jobs move through DEFAULT_FINE_TUNE_STEPS as their events are polled.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, response, chunk_chars=16, headers=None):
+        """Sends a chat completion as server-sent events, a few characters per chunk, like stream=True does."""
+        base = {'id': response['id'], 'object': 'chat.completion.chunk', 'created': response['created'], 'model': response['model']}
+        content = response['choices'][0]['message']['content']
+        events = [dict(base, choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])]
+        for i in range(0, len(content), chunk_chars):
+            events.append(dict(base, choices=[{'index': 0, 'delta': {'content': content[i:i + chunk_chars]}, 'finish_reason': None}]))
+        events.append(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+        events.append(dict(base, choices=[], usage=response['usage']))
+        body = ''.join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_POST(self):
+        state = self.server.state
+        _count(state, 'requests')
+        body = self._read_body()
+        path = self.path.split('?')[0]
+
+        if path.endswith('/chat/completions'):
+            request = json.loads(body)
+            prompt_tokens = sum(len(message['content']) for message in request['messages']) // 4
+            allowed, rate_limit_headers = _take_rate_limit(state, prompt_tokens + request.get('max_tokens', 0))
+            if not allowed:
+                _count(state, 'rate_limited')
+                return self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                                       rate_limit_headers)
+            time.sleep(state['latency_ms'] / 1000 * (0.5 + _random(state)))
+            status, response = _chat_completion(state, request)
+            if status == 200 and request.get('stream'):
+                return self._send_stream(response, headers=rate_limit_headers)
+            return self._send_json(status, response, rate_limit_headers)
+        if path.endswith('/files'):
+            fields = _parse_form(self.headers.get('Content-Type', ''), body)
+            filename, content = fields['file']
+            _count(state, 'files_uploaded')
+            return self._send_json(200, _store_file(state, content, filename or 'upload.jsonl', fields['purpose'][1].decode('utf-8')))
+        if path.endswith('/batches'):
+            request = json.loads(body)
+            if request['input_file_id'] not in state['files']:
+                return self._send_json(404, {'error': {'message': f"No such file: {request['input_file_id']}"}})
+            _count(state, 'batches')
+            batch = {'id': _new_id(state, 'batch'), 'object': 'batch', 'endpoint': request['endpoint'], 'input_file_id': request['input_file_id'],
+                     'completion_window': request['completion_window'], 'status': 'validating', 'created_at': int(time.time()),
+                     'output_file_id': None, 'error_file_id': None, 'request_counts': {'total': 0, 'completed': 0, 'failed': 0}}
+            with state['lock']:
+                state['batches'][batch['id']] = batch
+            response = dict(batch)
+            # The job finishes straight away; the next retrieve reports it completed
+            _run_batch(state, batch)
+            return self._send_json(200, response)
+        if path.endswith('/uploads'):
+            request = json.loads(body)
+            upload = {'id': _new_id(state, 'upload'), 'object': 'upload', 'status': 'pending', 'bytes': request['bytes'],
+                      'created_at': int(time.time()), 'expires_at': int(time.time()) + 3600,
+                      'filename': request['filename'], 'purpose': request['purpose'], 'file': None}
+            with state['lock']:
+                state['uploads'][upload['id']] = {'upload': upload, 'parts': {}}
+            return self._send_json(200, upload)
+        match = re.search(r'/uploads/([^/]+)/(parts|complete)$', path)
+        if match:
+            pending = state['uploads'].get(match.group(1))
+            if pending is None or pending['upload']['status'] != 'pending':
+                return self._send_json(404, {'error': {'message': f"No pending upload: {match.group(1)}"}})
+            if match.group(2) == 'parts':
+                if _random(state) < state['error_rate']:
+                    _count(state, 'errors')
+                    return self._send_json(500, {'error': {'message': 'Mock server error', 'type': 'server_error'}})
+                part_id = _new_id(state, 'part')
+                with state['lock']:
+                    pending['parts'][part_id] = _parse_form(self.headers.get('Content-Type', ''), body)['data'][1]
+                _count(state, 'upload_parts')
+                return self._send_json(200, {'id': part_id, 'object': 'upload.part', 'created_at': int(time.time()), 'upload_id': match.group(1)})
+            # Assemble the parts in the order given and check them against the declared size and MD5, as the API does
+            request = json.loads(body)
+            content = b''.join(pending['parts'].get(part_id, b'') for part_id in request['part_ids'])
+            upload = pending['upload']
+            if len(content) != upload['bytes'] or (request.get('md5') and hashlib.md5(content).hexdigest() != request['md5']):
+                return self._send_json(400, {'error': {'message': "Assembled parts do not match the upload's size and MD5"}})
+            upload.update(status='completed', file=_store_file(state, content, upload['filename'], upload['purpose']))
+            return self._send_json(200, upload)
+        if path.endswith('/fine_tuning/jobs'):
+            request = json.loads(body)
+            job = self._fine_tune_job(_new_id(state, 'ftjob'), 'queued', request['training_file'])
+            fine_tune = {'job': job, 'events': [], 'steps': list(state['fine_tune_steps'])}
+            with state['lock']:
+                state['fine_tunes'][job['id']] = fine_tune
+            _fine_tune_event(state, fine_tune, f"Created fine-tuning job: {job['id']}")
+            return self._send_json(200, job)
+        return self._send_json(404, {'error': {'message': f"Mock server does not implement POST {path}"}})
+
+    def do_GET(self):
+        state = self.server.state
+        _count(state, 'requests')
+        path = self.path.split('?')[0]
+        match = re.search(r'/fine_tuning/jobs/([^/]+)(/events)?$', path)
+        if match:
+            fine_tune = state['fine_tunes'].get(match.group(1))
+            if fine_tune is None:
+                return self._send_json(404, {'error': {'message': f"No such fine-tuning job: {match.group(1)}"}})
+            if _random(state) < state['error_rate']:
+                _count(state, 'errors')
+                return self._send_json(503, {'error': {'message': 'Mock server overloaded', 'type': 'server_error'}})
+            if not match.group(2):
+                return self._send_json(200, fine_tune['job'])
+            # Each poll of the events moves the job one step along
+            if fine_tune['steps']:
+                step = fine_tune['steps'].pop(0)
+                if step:
+                    _fine_tune_event(state, fine_tune, step[0])
+                    fine_tune['job'].update(self._fine_tune_job(fine_tune['job']['id'], step[1], fine_tune['job']['training_file']))
+            return self._send_json(200, {'object': 'list', 'has_more': False, 'data': list(reversed(fine_tune['events']))})
+        match = re.search(r'/batches/([^/]+)$', path)
+        if match:
+            batch = self.server.state['batches'].get(match.group(1))
+            if batch is None:
+                return self._send_json(404, {'error': {'message': f"No such batch: {match.group(1)}"}})
+            return self._send_json(200, batch)
+        match = re.search(r'/files/([^/]+)/content$', path)
+        if match:
+            stored = self.server.state['files'].get(match.group(1))
+            if stored is None:
+                return self._send_json(404, {'error': {'message': f"No such file: {match.group(1)}"}})
+            content = stored[1]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        return self._send_json(404, {'error': {'message': f"Mock server does not implement GET {path}"}})
+
+    def do_DELETE(self):
+        state = self.server.state
+        _count(state, 'requests')
+        path = self.path.split('?')[0]
+        match = re.search(r'/files/([^/]+)$', path)
+        if match:
+            with state['lock']:
+                stored = state['files'].pop(match.group(1), None)
+            if stored is None:
+                return self._send_json(404, {'error': {'message': f"No such file: {match.group(1)}"}})
+            _count(state, 'files_deleted')
+            return self._send_json(200, {'id': match.group(1), 'object': 'file', 'deleted': True})
+        return self._send_json(404, {'error': {'message': f"Mock server does not implement DELETE {path}"}})
+
+    def _fine_tune_job(self, job_id, status, training_file):
+        return {'id': job_id, 'object': 'fine_tuning.job', 'created_at': int(time.time()), 'status': status,
+                'model': 'gpt-4o-mini-2024-07-18', 'training_file': training_file, 'organization_id': 'org-mock',
+                'fine_tuned_model': 'ft:gpt-4o-mini-2024-07-18:mock' if status == 'succeeded' else None,
+                'result_files': [], 'hyperparameters': {'n_epochs': 3}, 'seed': 0}
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections when many concurrent requests open them at once
+    request_queue_size = 128
+    daemon_threads = True
+
+def start_mock_server(latency_ms=200, error_rate=0.0, seed=0, port=0, malformed_rate=0.0, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Starts the mock server on a background thread.
+
+    :param error_rate: Fraction of chat completions, batch requests and upload parts answered with a 500, and of fine-tuning job reads answered with a 503.
+    :param malformed_rate: Fraction of YAML (unconstrained) replies that do not parse.
+    :param requests_per_minute: Chat completion requests allowed per minute before answering 429; None for no limit.
+    :param tokens_per_minute: Chat completion tokens (prompt plus max_tokens) allowed per minute; None for no limit.
+    :return: (server, base_url); server.state['counts'] holds the request counters, server.shutdown() stops it.
+    """
+    server = MockOpenAIServer(('127.0.0.1', port), MockOpenAIHandler)
+    server.state = {'latency_ms': latency_ms, 'error_rate': error_rate, 'malformed_rate': malformed_rate, 'rng': random.Random(seed),
+                    'lock': threading.Lock(), 'prompt_prefixes': set(), 'next_id': 0, 'files': {}, 'batches': {}, 'uploads': {},
+                    'fine_tunes': {}, 'fine_tune_steps': DEFAULT_FINE_TUNE_STEPS,
+                    'counts': {'requests': 0, 'errors': 0, 'chat_completions': 0, 'malformed_completions': 0, 'rate_limited': 0},
+                    # The budgets start full, like an account that has been idle
+                    'rate_limits': {'requests_per_minute': requests_per_minute, 'tokens_per_minute': tokens_per_minute,
+                                    'requests': requests_per_minute or 0, 'tokens': tokens_per_minute or 0, 'updated_at': time.time()}}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI API server for local testing and benchmarks.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency-ms', type=float, default=200, help="Mean latency of chat completions")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of chat completions, batch requests, upload parts and fine-tuning job reads answered with an error")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="Fraction of YAML replies that do not parse")
+    parser.add_argument('--rpm', type=int, help="Requests per minute allowed before answering 429")
+    parser.add_argument('--tpm', type=int, help="Tokens per minute allowed before answering 429")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.latency_ms, args.error_rate, port=args.port, malformed_rate=args.malformed_rate,
+                                         requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+    print(f"Mock OpenAI server listening on {base_url}; set base_url in config/secrets.yaml to use it")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.metrics import record_request, increment
+from utils.rate_limit import call_with_rate_limit
+
+# The Uploads API accepts parts of up to 64 MB and expires unfinished uploads after an hour
+MAX_PART_SIZE = 64 * 1024 * 1024
+UPLOAD_EXPIRY_SECONDS = 60 * 60
+
+def _state_path(file_path):
+    return f"{file_path}.upload_state.json"
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def load_upload_state(file_path, part_size):
+    """
+    Returns the saved state of an interrupted upload of this file, or None if there is nothing
+    to resume (no state, the file changed, a different part size, or the upload has expired).
+    """
+    state_path = _state_path(file_path)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as state_file:
+        state = json.load(state_file)
+    if state.get('file') != _file_signature(file_path) or state.get('part_size') != part_size:
+        return None
+    if time.time() - state.get('created_at', 0) > UPLOAD_EXPIRY_SECONDS:
+        return None
+    return state
+
+def save_upload_state(file_path, state):
+    """Atomically saves the progress of an upload so it can be resumed."""
+    state_path = _state_path(file_path)
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, 'w') as state_file:
+        json.dump(state, state_file, indent=4)
+    os.replace(temp_path, state_path)
+
+def _read_part(file_path, part_num, part_size):
+    with open(file_path, 'rb') as f:
+        f.seek(part_num * part_size)
+        return f.read(part_size)
+
+def _upload_part(client, upload_id, file_path, part_num, part_size, rate_limiter=None):
+    data = _read_part(file_path, part_num, part_size)
+    checksum = hashlib.sha256(data).hexdigest()
+    attempt = {}
+
+    def send():
+        attempt['start'] = time.time()
+        try:
+            return client.uploads.parts.create(upload_id=upload_id, data=data)
+        except Exception:
+            record_request('upload_part', attempt['start'], error=True)
+            raise
+
+    part = call_with_rate_limit(rate_limiter, 'uploads', send)
+    record_request('upload_part', attempt['start'])
+    increment('bytes_uploaded', len(data))
+    # Re-read the part after sending it: if the file changed underneath us the upload is not trustworthy
+    if hashlib.sha256(_read_part(file_path, part_num, part_size)).hexdigest() != checksum:
+        raise IOError(f"Part {part_num} of {file_path} changed while it was being uploaded")
+    return part.id, checksum
+
+def multipart_upload(client, file_path, purpose='fine-tune', part_size=MAX_PART_SIZE, max_workers=4, mime_type='application/jsonl', rate_limiter=None):
+    """
+    Uploads a file through the Uploads API in parts sent concurrently, resuming an interrupted
+    upload of the same file where possible.
+
+    Each part is checksummed and recorded in <file>.upload_state.json as soon as it is accepted,
+    and the MD5 of the whole file is sent on completion so the server can verify the assembled file.
+
+    :param client: OpenAI client.
+    :param file_path: File to upload.
+    :param purpose: File purpose, e.g. 'fine-tune'.
+    :param part_size: Bytes per part, at most MAX_PART_SIZE.
+    :param max_workers: Number of parts uploaded at the same time.
+    :param rate_limiter: Shared rate limiter (see utils/rate_limit.py); None only retries failed calls.
+    :return: The ID of the uploaded file.
+    """
+    part_size = min(part_size, MAX_PART_SIZE)
+    file_size = os.path.getsize(file_path)
+    part_count = max(1, -(-file_size // part_size))
+
+    state = load_upload_state(file_path, part_size)
+    if state:
+        print(f"Resuming upload {state['upload_id']}: {len(state['parts'])}/{part_count} parts already sent")
+        increment('retries')
+    else:
+        upload = call_with_rate_limit(rate_limiter, 'uploads', lambda: client.uploads.create(purpose=purpose, filename=os.path.basename(file_path),
+                                                                                               bytes=file_size, mime_type=mime_type))
+        state = {'upload_id': upload.id, 'file': _file_signature(file_path), 'part_size': part_size, 'created_at': time.time(), 'parts': {}}
+        save_upload_state(file_path, state)
+
+    missing = [part_num for part_num in range(part_count) if str(part_num) not in state['parts']]
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_upload_part, client, state['upload_id'], file_path, part_num, part_size, rate_limiter): part_num for part_num in missing}
+        for future in as_completed(futures):
+            part_num = futures[future]
+            try:
+                part_id, checksum = future.result()
+            except Exception as e:
+                print(f"Error uploading part {part_num + 1}/{part_count}: {e}")
+                failed.append(part_num)
+                continue
+            state['parts'][str(part_num)] = {'id': part_id, 'sha256': checksum}
+            save_upload_state(file_path, state)
+            print(f"Uploaded part {part_num + 1}/{part_count}")
+    if failed:
+        # The parts that made it are saved; rerunning the upload only sends the failed ones
+        raise IOError(f"{len(failed)} parts of {file_path} failed to upload; rerun to resume")
+
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(part_size), b''):
+            md5.update(chunk)
+
+    part_ids = [state['parts'][str(part_num)]['id'] for part_num in range(part_count)]
+    upload = call_with_rate_limit(rate_limiter, 'uploads', lambda: client.uploads.complete(upload_id=state['upload_id'], part_ids=part_ids,
+                                                                                             md5=md5.hexdigest()))
+    os.remove(_state_path(file_path))
+    return upload.file.id
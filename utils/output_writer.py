@@ -0,0 +1,163 @@
+import os
+import json
+from utils.metrics import increment
+
+# Responses written between fsyncs of a partially written output file
+DEFAULT_FSYNC_EVERY = 16
+
+def _temp_path(output_path):
+    return f"{output_path}.partial"
+
+def _index_path(output_path):
+    return f"{output_path}.index.json"
+
+def _save_index(writer):
+    """Atomically writes the sidecar index of the pages in the partial file."""
+    temp_index_path = f"{writer['index_path']}.tmp"
+    with open(temp_index_path, 'w') as index_file:
+        json.dump({'fingerprint': writer['fingerprint'], 'pages': writer['pages']}, index_file)
+    os.replace(temp_index_path, writer['index_path'])
+
+def _load_index(output_path, fingerprint):
+    """Returns the page entries of a partial file left by an interrupted run with the same fingerprint, or None."""
+    index_path = _index_path(output_path)
+    if not os.path.exists(index_path) or not os.path.exists(_temp_path(output_path)):
+        return None
+    try:
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return None
+    return index['pages'] if index.get('fingerprint') == fingerprint else None
+
+def open_output(output_path, fingerprint=None, output_format="yaml", fsync_every=DEFAULT_FSYNC_EVERY):
+    """
+    Opens an output file that is written page by page as responses complete.
+
+    Responses go to <output>.partial in page order; <output>.index.json records the end offset of each
+    page written (or null for a page without a response) and its unit key, and is updated at every fsync.
+    If an earlier run with the same fingerprint was interrupted, the pages before its first missing
+    response are kept and the rest of the partial file is truncated away. Callers check each kept page
+    with resumed_page, which also drops the kept pages from the first one whose request changed.
+
+    :param output_path: Final path of the output file, created by finish_output.
+    :param fingerprint: Hash of what every page of the output depends on, e.g. from hash_params; None disables resuming.
+    :param output_format: "yaml" separates responses with '---' lines, "jsonl" writes one response per line.
+    :param fsync_every: Number of responses written between fsyncs.
+    :return: Writer dict for add_response and finish_output.
+    """
+    pages = _load_index(output_path, fingerprint) if fingerprint is not None else None
+    kept = []
+    for entry in pages or []:
+        if entry[1] is None:
+            break
+        kept.append(entry)
+
+    temp_path = _temp_path(output_path)
+    output_file = open(temp_path, 'r+b' if kept else 'wb')
+    if kept:
+        output_file.truncate(kept[-1][1])
+        output_file.seek(kept[-1][1])
+        print(f"Resuming {os.path.basename(output_path)} after {len(kept)} pages")
+
+    writer = {
+        'path': output_path, 'temp_path': temp_path, 'index_path': _index_path(output_path), 'file': output_file,
+        'fingerprint': fingerprint, 'output_format': output_format, 'fsync_every': fsync_every,
+        'pages': kept, 'next_page': len(kept), 'pending': {}, 'written': len(kept), 'unsynced': 0, 'seen': 0,
+    }
+    if fingerprint is not None:
+        _save_index(writer)
+    return writer
+
+def _rewind(writer, page_num):
+    """Drops page_num and every later page from the partial file."""
+    writer['pages'] = writer['pages'][:page_num]
+    end_offsets = [entry[1] for entry in writer['pages'] if entry[1] is not None]
+    writer['file'].truncate(end_offsets[-1] if end_offsets else 0)
+    writer['file'].seek(end_offsets[-1] if end_offsets else 0)
+    writer['next_page'] = page_num
+    writer['written'] = len(end_offsets)
+
+def resumed_page(writer, page_num, unit_key):
+    """
+    True if an interrupted run already wrote this page for the same request, so it needs no request.
+
+    Pages must be checked in order, before any response is added. A kept page whose request changed
+    (e.g. its text, or an earlier page being deduplicated differently) is dropped, with every later page.
+
+    :param unit_key: Key of the page's request, as passed to add_response.
+    """
+    writer['seen'] = max(writer['seen'], page_num + 1)
+    if page_num >= writer['next_page']:
+        return False
+    if len(writer['pages'][page_num]) > 2 and writer['pages'][page_num][2] == unit_key:
+        return True
+    print(f"Request {page_num + 1} of {os.path.basename(writer['path'])} changed since the interrupted run; rewriting from there")
+    _rewind(writer, page_num)
+    return False
+
+def _sync(writer):
+    writer['file'].flush()
+    os.fsync(writer['file'].fileno())
+    if writer['fingerprint'] is not None:
+        _save_index(writer)
+    writer['unsynced'] = 0
+
+def add_response(writer, page_num, response, unit_key=None):
+    """
+    Hands the writer the response of one page (None if the page got no response).
+
+    Pages may complete in any order; each is written as soon as every earlier page has been,
+    so only out-of-order responses are held in memory.
+
+    :param unit_key: Short key of the page's request, e.g. from hash_params, checked by resumed_page on the next run.
+    """
+    writer['seen'] = max(writer['seen'], page_num + 1)
+    writer['pending'][page_num] = (response, unit_key)
+    while writer['next_page'] in writer['pending']:
+        response, unit_key = writer['pending'].pop(writer['next_page'])
+        end_offset = None
+        if response:
+            if writer['output_format'] == "jsonl":
+                data = f"{response}\n"
+            else:
+                # Newline and delimiter separator between documents, none after the last one
+                data = f"\n---\n{response}" if writer['written'] else response
+            writer['file'].write(data.encode('utf-8'))
+            writer['written'] += 1
+            writer['unsynced'] += 1
+            end_offset = writer['file'].tell()
+        writer['pages'].append([writer['next_page'], end_offset, unit_key])
+        writer['next_page'] += 1
+        if writer['unsynced'] >= writer['fsync_every']:
+            _sync(writer)
+
+def finish_output(writer):
+    """
+    Makes the output final: fsyncs the partial file, renames it over the output path and removes the index.
+
+    If a resumable output (one opened with a fingerprint) has pages without a response, it is not made
+    final: the partial file and its index stay in place, so no page silently goes missing from the output
+    and the next run resumes at the first missing page. The output path keeps its previous contents.
+
+    :return: Number of responses written (in the output file, or in the partial file if it was kept).
+    """
+    # Pages never handed over count as missing, so responses after them are still written
+    while writer['pending']:
+        add_response(writer, writer['next_page'], *writer['pending'].pop(writer['next_page'], (None, None)))
+    # Kept pages past the last one checked belong to requests this run no longer has (the document got shorter)
+    if writer['next_page'] > writer['seen']:
+        _rewind(writer, writer['seen'])
+    _sync(writer)
+    writer['file'].close()
+    missing = sum(1 for entry in writer['pages'] if entry[1] is None)
+    if missing and writer['fingerprint'] is not None:
+        print(f"{missing} requests of {os.path.basename(writer['path'])} got no response; "
+              f"kept the partial output in {writer['temp_path']} for the next run to complete")
+        increment('partial_outputs')
+        return writer['written']
+    os.replace(writer['temp_path'], writer['path'])
+    if os.path.exists(writer['index_path']):
+        os.remove(writer['index_path'])
+    increment('bytes_written', os.path.getsize(writer['path']))
+    return writer['written']
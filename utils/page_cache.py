@@ -0,0 +1,61 @@
+import os
+import json
+import hashlib
+
+# Bump this when the page text produced by the extractor changes for the same PDF
+PAGE_CACHE_FORMAT_VERSION = 1
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_file_path(cache_dir, content_hash, extractor_version):
+    """Return the cache file path for a document hash and extractor version."""
+    key = hashlib.sha256(f"{content_hash}:{extractor_version}:{PAGE_CACHE_FORMAT_VERSION}".encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{key}.pages")
+
+def store_pages(cache_path, pages):
+    """
+    Writes the page texts of one document to a single cache file.
+
+    The first line is a JSON index of [offset, length] pairs (in bytes, relative to the
+    start of the page data); the UTF-8 encoded page texts follow back to back.
+
+    :param cache_path: Path of the cache file to write.
+    :param pages: List of page text strings.
+    """
+    encoded_pages = [page.encode('utf-8') for page in pages]
+    index = []
+    offset = 0
+    for encoded_page in encoded_pages:
+        index.append([offset, len(encoded_page)])
+        offset += len(encoded_page)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'wb') as cache_file:
+        cache_file.write(json.dumps(index).encode('utf-8') + b'\n')
+        for encoded_page in encoded_pages:
+            cache_file.write(encoded_page)
+    os.replace(temp_path, cache_path)
+
+def load_pages(cache_path):
+    """
+    Reads every page text from a cache file written by store_pages.
+
+    :param cache_path: Path of the cache file.
+    :return: List of page text strings, or None if the file is missing or unreadable.
+    """
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            index = json.loads(cache_file.readline())
+            data = cache_file.read()
+        return [data[offset:offset + length].decode('utf-8') for offset, length in index]
+    except (OSError, ValueError) as e:
+        if os.path.exists(cache_path):
+            print(f"Ignoring unreadable page cache {cache_path}: {e}")
+        return None
@@ -0,0 +1,100 @@
+import re
+import json
+
+RANGE_PATTERN = re.compile(r'\s*(\d+)\s*(?:-\s*(\d+)\s*)?')
+
+def parse_page_ranges(spec, page_count):
+    """
+    Parses a page range string such as "1-50, 120, 300-310" (1-based, inclusive).
+
+    :param spec: The range string.
+    :param page_count: Number of pages in the PDF; ranges are clipped to it.
+    :return: Sorted list of 0-based page numbers.
+    """
+    pages = set()
+    for part in spec.split(','):
+        match = RANGE_PATTERN.fullmatch(part)
+        if match is None:
+            raise ValueError(f"Invalid page range {part.strip()!r} in {spec!r}")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid page range {part.strip()!r} in {spec!r}")
+        pages.update(range(first - 1, min(last, page_count)))
+    return sorted(pages)
+
+def outline_entries(reader):
+    """
+    Flattens a PDF's outline (bookmarks) into (depth, title, 0-based page number) tuples, in outline order.
+
+    :param reader: A PyPDF2 PdfReader.
+    """
+    entries = []
+
+    def walk(items, depth):
+        for item in items:
+            if isinstance(item, list):
+                walk(item, depth + 1)
+                continue
+            try:
+                page_num = reader.get_destination_page_number(item)
+            except Exception:  # Bookmarks pointing at missing pages or external files are skipped
+                continue
+            if page_num is not None and page_num >= 0:
+                entries.append((depth, str(item.title).strip(), page_num))
+
+    walk(reader.outline, 0)
+    return entries
+
+def outline_pages(reader, titles, page_count):
+    """
+    Returns the pages of the outline sections whose title starts with one of the given titles (case-insensitive).
+
+    A section runs from its bookmark's page up to the page before the next bookmark at the same or a
+    higher level, so selecting a chapter also selects its subsections.
+
+    :return: Sorted list of 0-based page numbers.
+    """
+    wanted = [title.strip().lower() for title in titles]
+    entries = outline_entries(reader)
+    pages = set()
+    matched = set()
+    for i, (depth, title, start) in enumerate(entries):
+        prefix = next((wanted_title for wanted_title in wanted if title.lower().startswith(wanted_title)), None)
+        if prefix is None:
+            continue
+        matched.add(prefix)
+        end = page_count - 1
+        for next_depth, _, next_page in entries[i + 1:]:
+            if next_depth <= depth:
+                end = max(start, next_page - 1)
+                break
+        pages.update(range(start, min(end, page_count - 1) + 1))
+    unmatched = [title for title in titles if title.strip().lower() not in matched]
+    if unmatched:
+        print(f"No outline entries match {', '.join(map(repr, unmatched))}")
+    return sorted(pages)
+
+def select_pages(reader, spec):
+    """
+    Returns the 0-based page numbers a page_selection entry from config.yaml selects.
+
+    :param reader: A PyPDF2 PdfReader of the document.
+    :param spec: None for every page, a range string such as "1-50, 120-200", or a list of outline (bookmark) titles.
+    """
+    page_count = len(reader.pages)
+    if spec is None:
+        return list(range(page_count))
+    if isinstance(spec, str):
+        return parse_page_ranges(spec, page_count)
+    return outline_pages(reader, spec, page_count)
+
+def page_spec_for(page_selection, file_path):
+    """Returns the page_selection entry for a PDF (looked up by file name), or None to process every page."""
+    if not page_selection:
+        return None
+    return page_selection.get(file_path.replace('\\', '/').rsplit('/', 1)[-1])
+
+def page_spec_key(spec):
+    """A stable text form of a page selection, for cache keys."""
+    return json.dumps(spec, sort_keys=True)
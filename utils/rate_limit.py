@@ -0,0 +1,300 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from utils.metrics import increment
+
+# Status codes worth retrying: rate limits, and the transient server errors the API documents
+RETRY_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+# Reset durations in x-ratelimit-reset-* headers look like "1s", "6m0s", "20ms" or "1h2m3.5s"
+RESET_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+RESET_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def open_rate_limiter(db_path, headroom=0.95, max_retries=8, base_delay=1.0, max_delay=60.0, timeout=60):
+    """
+    Opens (and creates if needed) the rate limiter shared by every process using the same SQLite file.
+
+    Each bucket (a model for chat completions, or an endpoint such as 'files') keeps a requests-per-minute
+    and a tokens-per-minute budget that refills continuously, the way the API's own limits do. The limits
+    are learned from the x-ratelimit-* response headers, and the budgets are corrected by the remaining
+    counts the headers report. Until a bucket's limits are known, only 429 responses slow it down.
+
+    :param headroom: Fraction of the account limits to use, so throughput stays just under them.
+    :param max_retries: Retries of a call that is rate limited or fails transiently, with jittered exponential backoff.
+    :return: Limiter dict for call_with_rate_limit.
+    """
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    # Also used by upload worker threads, which take turns through the lock
+    conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS buckets (
+            name TEXT PRIMARY KEY,
+            request_limit REAL,
+            token_limit REAL,
+            requests REAL NOT NULL,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            blocked_until REAL NOT NULL DEFAULT 0
+        )
+    """)
+    conn.commit()
+    # Async callers run the SQLite transactions here, so waiting for another process's write never blocks the event loop
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rate_limit')
+    return {'conn': conn, 'lock': threading.Lock(), 'executor': executor, 'headroom': headroom, 'max_retries': max_retries,
+            'base_delay': base_delay, 'max_delay': max_delay, 'rng': random.Random()}
+
+def init_rate_limiter(config):
+    """Opens the rate limiter configured in config.yaml."""
+    return open_rate_limiter(config['rate_limit_path'], config.get('rate_limit_headroom', 0.95), config.get('rate_limit_max_retries', 8))
+
+def parse_reset(value):
+    """Returns the seconds in a reset duration such as "6m0s" or "20ms" (or a plain number of seconds), or None."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = RESET_PATTERN.findall(value)
+    return sum(float(number) * RESET_UNITS[unit] for number, unit in parts) if parts else None
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def _refill(limit, available, elapsed, headroom):
+    """Budget left after `elapsed` seconds of refilling at the (headroom-scaled) per-minute limit."""
+    capacity = limit * headroom
+    return min(capacity, available + elapsed * capacity / 60)
+
+def _transaction(limiter, work):
+    """Runs work(conn, now) in a write transaction, so processes update a bucket one at a time."""
+    with limiter['lock']:
+        conn = limiter['conn']
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn, time.time())
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return result
+
+def _load_bucket(conn, bucket, now, headroom):
+    """Returns a bucket's row with its budgets refilled up to now, creating the bucket if needed."""
+    row = conn.execute("SELECT request_limit, token_limit, requests, tokens, updated_at, blocked_until FROM buckets WHERE name = ?",
+                       (bucket,)).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO buckets (name, requests, tokens, updated_at) VALUES (?, 0, 0, ?)", (bucket, now))
+        return None, None, 0.0, 0.0, 0.0
+    request_limit, token_limit, requests, tokens, updated_at, blocked_until = row
+    elapsed = max(0.0, now - updated_at)
+    if request_limit:
+        requests = _refill(request_limit, requests, elapsed, headroom)
+    if token_limit:
+        tokens = _refill(token_limit, tokens, elapsed, headroom)
+    return request_limit, token_limit, requests, tokens, blocked_until
+
+def try_reserve(limiter, bucket, tokens=0):
+    """
+    Reserves one request and an estimated number of tokens from a bucket if its budgets allow.
+
+    A request estimated above the whole token budget is let through once the budget is full.
+
+    :return: 0 if reserved, otherwise the number of seconds until the budgets should allow it.
+    """
+    headroom = limiter['headroom']
+
+    def work(conn, now):
+        request_limit, token_limit, requests, available_tokens, blocked_until = _load_bucket(conn, bucket, now, headroom)
+        if blocked_until > now:
+            return blocked_until - now
+        wait = 0.0
+        if request_limit and requests < 1:
+            wait = max(wait, (1 - requests) * 60 / (request_limit * headroom))
+        needed_tokens = min(tokens, token_limit * headroom) if token_limit else 0
+        if token_limit and available_tokens < needed_tokens:
+            wait = max(wait, (needed_tokens - available_tokens) * 60 / (token_limit * headroom))
+        if wait == 0.0:
+            requests -= 1 if request_limit else 0
+            available_tokens -= tokens if token_limit else 0
+        conn.execute("UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE name = ?", (requests, available_tokens, now, bucket))
+        return wait
+
+    return _transaction(limiter, work)
+
+def wait_for_budget(limiter, bucket, tokens=0):
+    """Blocks until try_reserve succeeds. Returns the seconds waited."""
+    waited = 0.0
+    while True:
+        wait = try_reserve(limiter, bucket, tokens)
+        if wait <= 0:
+            break
+        # A little jitter so processes waiting on the same bucket do not all wake at once
+        wait *= 1 + limiter['rng'].random() * 0.1
+        time.sleep(wait)
+        waited += wait
+    if waited:
+        increment('rate_limit_wait_seconds', waited)
+    return waited
+
+async def _off_loop(limiter, function, *args):
+    """Runs a limiter function on the limiter's thread; without a shared limiter there is no SQLite to wait for."""
+    if limiter.get('conn') is None:
+        return function(*args)
+    return await asyncio.get_running_loop().run_in_executor(limiter['executor'], function, *args)
+
+async def wait_for_budget_async(limiter, bucket, tokens=0):
+    """Async counterpart of wait_for_budget. The reservation runs off the event loop, so other coroutines keep going meanwhile."""
+    waited = 0.0
+    while True:
+        wait = await _off_loop(limiter, try_reserve, limiter, bucket, tokens)
+        if wait <= 0:
+            break
+        wait *= 1 + limiter['rng'].random() * 0.1
+        await asyncio.sleep(wait)
+        waited += wait
+    if waited:
+        increment('rate_limit_wait_seconds', waited)
+    return waited
+
+def update_from_headers(limiter, bucket, headers):
+    """
+    Learns a bucket's limits from x-ratelimit-* response headers and lowers its budgets to the
+    remaining counts they report (scaled by the headroom), if those are lower than the local estimate.
+    """
+    request_limit = _number(headers.get('x-ratelimit-limit-requests'))
+    token_limit = _number(headers.get('x-ratelimit-limit-tokens'))
+    remaining_requests = _number(headers.get('x-ratelimit-remaining-requests'))
+    remaining_tokens = _number(headers.get('x-ratelimit-remaining-tokens'))
+    if request_limit is None and token_limit is None:
+        return
+    headroom = limiter['headroom']
+
+    def work(conn, now):
+        known_request_limit, known_token_limit, requests, tokens, _ = _load_bucket(conn, bucket, now, headroom)
+        # The headroom is kept back from the account's budget, so the reported remainder shrinks by that much
+        if request_limit and remaining_requests is not None:
+            reported = remaining_requests - request_limit * (1 - headroom)
+            requests = min(requests, reported) if known_request_limit else reported
+        if token_limit and remaining_tokens is not None:
+            reported = remaining_tokens - token_limit * (1 - headroom)
+            tokens = min(tokens, reported) if known_token_limit else reported
+        conn.execute("UPDATE buckets SET request_limit = ?, token_limit = ?, requests = ?, tokens = ?, updated_at = ? WHERE name = ?",
+                     (request_limit or known_request_limit, token_limit or known_token_limit, requests, tokens, now, bucket))
+
+    _transaction(limiter, work)
+
+def block_bucket(limiter, bucket, seconds):
+    """Pauses every process's requests to a bucket for the given time, e.g. after a 429."""
+    def work(conn, now):
+        _load_bucket(conn, bucket, now, limiter['headroom'])
+        conn.execute("UPDATE buckets SET blocked_until = MAX(blocked_until, ?), requests = MIN(requests, 0), tokens = MIN(tokens, 0), "
+                     "updated_at = ? WHERE name = ?", (now + seconds, now, bucket))
+
+    _transaction(limiter, work)
+
+def _response_headers(result):
+    headers = getattr(result, 'headers', None)
+    return headers if headers is not None and hasattr(headers, 'get') else None
+
+def is_transient(error):
+    """True for errors worth retrying: rate limits, transient server errors and connection errors."""
+    return isinstance(error, openai.APIConnectionError) or getattr(error, 'status_code', None) in RETRY_STATUS_CODES
+
+def retry_delay(limiter, bucket, error, attempt):
+    """
+    Works out whether a failed call should be retried.
+
+    Rate limits (429), transient server errors and connection errors are retried with exponential
+    backoff and jitter, waiting at least as long as the server's retry-after. A 429 also pauses the
+    bucket for every process sharing the limiter.
+
+    :return: Seconds to wait before the next attempt, or None if the error should be raised.
+    """
+    status_code = getattr(error, 'status_code', None)
+    if attempt >= limiter['max_retries'] or not is_transient(error):
+        return None
+    backoff = min(limiter['max_delay'], limiter['base_delay'] * 2 ** attempt)
+    delay = backoff / 2 + limiter['rng'].random() * backoff / 2
+
+    headers = _response_headers(getattr(error, 'response', None)) or {}
+    retry_after_ms = _number(headers.get('retry-after-ms'))
+    retry_after = retry_after_ms / 1000 if retry_after_ms is not None else parse_reset(headers.get('retry-after'))
+    if status_code == 429:
+        increment('rate_limited')
+        if retry_after is None:
+            retry_after = max(parse_reset(headers.get('x-ratelimit-reset-requests')) or 0, parse_reset(headers.get('x-ratelimit-reset-tokens')) or 0) or None
+        if retry_after is not None:
+            delay = retry_after + limiter['rng'].random() * min(retry_after, backoff) / 2
+        if limiter.get('conn') is not None:
+            block_bucket(limiter, bucket, delay)
+    elif retry_after is not None:
+        delay = max(delay, retry_after)
+    increment('retries')
+    return delay
+
+# Retry settings for call sites without a shared limiter
+RETRY_ONLY = {'conn': None, 'max_retries': 8, 'base_delay': 1.0, 'max_delay': 60.0, 'rng': random.Random()}
+
+def call_with_rate_limit(limiter, bucket, call, tokens=0):
+    """
+    Makes an API call within a bucket's budget, retrying rate limits and transient errors.
+
+    :param limiter: Limiter from open_rate_limiter, or None to only retry, without shared budgets.
+    :param bucket: Budget the call counts against: the model for chat completions, or an endpoint name.
+    :param call: Function making one attempt. Responses from with_raw_response carry the headers the budgets are learned from.
+    :param tokens: Estimated tokens the request counts against the tokens-per-minute limit.
+    :return: What call returned.
+    """
+    limiter = limiter or RETRY_ONLY
+    attempt = 0
+    while True:
+        if limiter['conn'] is not None:
+            wait_for_budget(limiter, bucket, tokens)
+        try:
+            result = call()
+        except Exception as e:
+            delay = retry_delay(limiter, bucket, e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            print(f"{bucket}: {e.__class__.__name__}, retrying in {delay:.1f}s ({attempt}/{limiter['max_retries']})")
+            time.sleep(delay)
+            continue
+        headers = _response_headers(result)
+        if limiter['conn'] is not None and headers is not None:
+            update_from_headers(limiter, bucket, headers)
+        return result
+
+async def call_with_rate_limit_async(limiter, bucket, call, tokens=0):
+    """
+    Async counterpart of call_with_rate_limit; call is a coroutine function making one attempt.
+    The limiter's SQLite transactions run on its own thread, off the event loop.
+    """
+    limiter = limiter or RETRY_ONLY
+    attempt = 0
+    while True:
+        if limiter['conn'] is not None:
+            await wait_for_budget_async(limiter, bucket, tokens)
+        try:
+            result = await call()
+        except Exception as e:
+            delay = await _off_loop(limiter, retry_delay, limiter, bucket, e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            print(f"{bucket}: {e.__class__.__name__}, retrying in {delay:.1f}s ({attempt}/{limiter['max_retries']})")
+            await asyncio.sleep(delay)
+            continue
+        headers = _response_headers(result)
+        if limiter['conn'] is not None and headers is not None:
+            await _off_loop(limiter, update_from_headers, limiter, bucket, headers)
+        return result
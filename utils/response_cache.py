@@ -0,0 +1,169 @@
+import os
+import json
+import sqlite3
+import hashlib
+import time
+
+def open_response_cache(db_path):
+    """Open (and create if needed) the SQLite response cache and return the connection."""
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    # Queue workers share the cache, so wait for another process's write to finish rather than fail
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    """)
+    # Maps each (document, prompt set, page) to the response it last resolved to, so --resume
+    # can rebuild the YAML outputs even when identical pages share a single cached response
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pages (
+            document TEXT NOT NULL,
+            prompt_set TEXT NOT NULL,
+            page_num INTEGER NOT NULL,
+            pdf_hash TEXT NOT NULL,
+            cache_key TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (document, prompt_set, page_num)
+        )
+    """)
+    # The number of pages (request units) of the last complete run of each document/prompt set pair,
+    # so --resume can tell a document whose cached pages are all there from one with gaps
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            document TEXT NOT NULL,
+            prompt_set TEXT NOT NULL,
+            pdf_hash TEXT NOT NULL,
+            page_count INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (document, prompt_set)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used_at)")
+    conn.commit()
+    return conn
+
+def response_cache_key(request):
+    """
+    Returns the cache key for a chat completion request.
+
+    The key covers the model, the sampling parameters and the rendered messages
+    (which contain both the prompt and the page text).
+
+    :param request: Keyword arguments passed to client.chat.completions.create.
+    :return: SHA-256 hex digest.
+    """
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def get_cached_response(conn, cache_key):
+    """Return the cached response text for a key, or None on a miss."""
+    row = conn.execute("SELECT response FROM responses WHERE cache_key = ?", (cache_key,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("UPDATE responses SET last_used_at = ? WHERE cache_key = ?", (time.time(), cache_key))
+    conn.commit()
+    return row[0]
+
+def put_cached_response(conn, cache_key, model, response):
+    """Store a cleaned response text under its cache key."""
+    now = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+        (cache_key, model, response, len(response.encode('utf-8')), now, now)
+    )
+    conn.commit()
+
+def record_page(conn, page_ref, cache_key):
+    """
+    Records which cached response a page resolved to.
+
+    :param conn: Connection returned by open_response_cache.
+    :param page_ref: Dict with document, pdf_hash, prompt_set and page_num.
+    :param cache_key: Key from response_cache_key.
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+        (page_ref['document'], page_ref['prompt_set'], page_ref['page_num'], page_ref['pdf_hash'], cache_key, time.time())
+    )
+    conn.commit()
+
+def prune_pages(conn, document, prompt_set, pdf_hash, page_count):
+    """
+    Records a complete run of a document/prompt set pair and drops the page records it did not produce:
+    pages recorded for other versions of the PDF, and pages past the run's last request unit (left over
+    from runs that packed or deduplicated the pages differently).
+
+    :param page_count: Number of request units of the complete run.
+    :return: Number of dropped page records.
+    """
+    dropped = conn.execute(
+        "DELETE FROM pages WHERE document = ? AND prompt_set = ? AND (pdf_hash != ? OR page_num >= ?)",
+        (document, prompt_set, pdf_hash, page_count)
+    ).rowcount
+    conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)", (document, prompt_set, pdf_hash, page_count, time.time()))
+    conn.commit()
+    return dropped
+
+def evict_responses(conn, max_size_mb=None, max_age_days=None):
+    """
+    Applies the eviction policy: entries unused for longer than max_age_days are dropped,
+    then the least recently used entries are dropped until the cache fits in max_size_mb.
+
+    :return: Number of evicted entries.
+    """
+    evicted = 0
+    if max_age_days is not None:
+        cutoff = time.time() - max_age_days * 86400
+        evicted += conn.execute("DELETE FROM responses WHERE last_used_at < ?", (cutoff,)).rowcount
+
+    if max_size_mb is not None:
+        max_bytes = max_size_mb * 1024 * 1024
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > max_bytes:
+            stale_keys = []
+            for cache_key, size in conn.execute("SELECT cache_key, size FROM responses ORDER BY last_used_at"):
+                if total <= max_bytes:
+                    break
+                stale_keys.append((cache_key,))
+                total -= size
+            conn.executemany("DELETE FROM responses WHERE cache_key = ?", stale_keys)
+            evicted += len(stale_keys)
+
+    # Drop page records that point at evicted responses
+    conn.execute("DELETE FROM pages WHERE cache_key NOT IN (SELECT cache_key FROM responses)")
+    conn.commit()
+    if evicted:
+        conn.execute("VACUUM")
+    return evicted
+
+def iter_cached_documents(conn):
+    """
+    Yields (document, prompt_set, responses) for every document/prompt set pair in the cache.
+
+    responses holds the cached response of each page of the pair's last complete run, in page order,
+    with None for a page whose response has been evicted or was since replaced by a run that did not
+    complete. It is None if no complete run of the pair has been recorded.
+    """
+    pairs = conn.execute("SELECT document, prompt_set FROM pages UNION SELECT document, prompt_set FROM documents "
+                         "ORDER BY document, prompt_set").fetchall()
+    for document, prompt_set in pairs:
+        run = conn.execute("SELECT pdf_hash, page_count FROM documents WHERE document = ? AND prompt_set = ?", (document, prompt_set)).fetchone()
+        if run is None:
+            yield document, prompt_set, None
+            continue
+        pdf_hash, page_count = run
+        responses = [None] * page_count
+        rows = conn.execute(
+            "SELECT pages.page_num, responses.response FROM pages JOIN responses ON pages.cache_key = responses.cache_key "
+            "WHERE pages.document = ? AND pages.prompt_set = ? AND pages.pdf_hash = ? AND pages.page_num < ?",
+            (document, prompt_set, pdf_hash, page_count)
+        ).fetchall()
+        for page_num, response in rows:
+            responses[page_num] = response
+        yield document, prompt_set, responses
@@ -0,0 +1,92 @@
+import os
+import random
+
+# Register-description flavoured vocabulary, so synthetic pages look a little like datasheet text
+WORDS = (
+    "register bit field reset value clock enable interrupt mask status control timer counter prescaler "
+    "channel buffer address offset read write access mode configuration peripheral bus voltage pin "
+    "output input pull-up drive strength frequency divider flag pending priority vector handler memory "
+    "flash sram dma transfer request acknowledge trigger compare capture overflow underflow"
+).split()
+LINE_WORDS = 12
+
+def synthetic_page_text(rng, word_count):
+    """Returns the lines of one page of pseudo-datasheet text with about word_count words."""
+    words = [rng.choice(WORDS) for _ in range(word_count)]
+    return [' '.join(words[i:i + LINE_WORDS]) for i in range(0, len(words), LINE_WORDS)]
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def _content_stream(lines):
+    commands = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+    for line in lines:
+        commands.append(f"({_escape(line)}) Tj T*")
+    commands.append("ET")
+    return '\n'.join(commands).encode('latin-1')
+
+def write_synthetic_pdf(file_path, pages):
+    """
+    Writes a minimal, uncompressed PDF with one text page per entry in `pages`.
+
+    :param file_path: Path of the PDF to write.
+    :param pages: List of pages, each a list of text lines (ASCII).
+    """
+    page_count = len(pages)
+    # Object numbers: 1 catalog, 2 page tree, 3 font, then a (page, content) pair per page
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    kids = []
+    for i, lines in enumerate(pages):
+        page_obj, content_obj = 4 + 2 * i, 5 + 2 * i
+        kids.append(f"{page_obj} 0 R")
+        stream = _content_stream(lines)
+        objects[page_obj] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                             f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_obj} 0 R >>").encode('latin-1')
+        objects[content_obj] = f"<< /Length {len(stream)} >>\nstream\n".encode('latin-1') + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {page_count} >>".encode('latin-1')
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(output)
+        output += f"{number} 0 obj\n".encode('latin-1') + objects[number] + b"\nendobj\n"
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    for number in sorted(objects):
+        output += f"{offsets[number]:010d} 00000 n \n".encode('latin-1')
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('latin-1')
+
+    with open(file_path, 'wb') as pdf_file:
+        pdf_file.write(output)
+
+def generate_synthetic_pdfs(directory, pdf_count=5, pages_per_pdf=20, words_per_page=300, duplicate_fraction=0.0, seed=0):
+    """
+    Fills a directory with synthetic datasheet PDFs for benchmarking.
+
+    :param directory: Directory to write synthetic_NNN.pdf files into.
+    :param pdf_count: Number of PDF files.
+    :param pages_per_pdf: Pages in each PDF.
+    :param words_per_page: Text density of each page.
+    :param duplicate_fraction: Fraction of pages that repeat an earlier page, to exercise deduplication.
+    :param seed: Seed for the generated text, so runs are reproducible.
+    :return: List of the generated PDF paths.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    generated_pages = []
+    pdf_paths = []
+    for pdf_num in range(pdf_count):
+        pages = []
+        for _ in range(pages_per_pdf):
+            if generated_pages and rng.random() < duplicate_fraction:
+                pages.append(rng.choice(generated_pages))
+            else:
+                pages.append(synthetic_page_text(rng, words_per_page))
+                generated_pages.append(pages[-1])
+        pdf_path = os.path.join(directory, f"synthetic_{pdf_num:03d}.pdf")
+        write_synthetic_pdf(pdf_path, pages)
+        pdf_paths.append(pdf_path)
+    return pdf_paths
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import sqlite3
+
+# Task states: pending tasks can be claimed, leased tasks belong to a worker until their lease
+# expires, done tasks hold their response and failed tasks ran out of attempts
+TASK_STATUSES = ('pending', 'leased', 'done', 'failed')
+
+def open_work_queue(db_path, timeout=60):
+    """
+    Open (and create if needed) the SQLite work queue and return the connection.
+
+    The queue uses SQLite's default rollback journal rather than WAL, because WAL needs shared memory
+    and does not work when workers on several hosts open the file over a network filesystem.
+    """
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    # One job per (PDF version + prompt set + output format); job_id is the output fingerprint
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            pdf_path TEXT NOT NULL,
+            pdf_hash TEXT NOT NULL,
+            prompt_set TEXT NOT NULL,
+            output_format TEXT NOT NULL,
+            task_count INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            assembled_at REAL
+        )
+    """)
+    # One task per request unit (a page, or a chunk of pages when chunk_token_budget is set)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            job_id TEXT NOT NULL,
+            page_num INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            max_tokens INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_expires_at REAL,
+            response TEXT,
+            error TEXT,
+            updated_at REAL NOT NULL,
+            completed_at REAL,
+            PRIMARY KEY (job_id, page_num)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires_at)")
+    conn.commit()
+    return conn
+
+def enqueue_job(conn, job_id, pdf_path, pdf_hash, prompt_set, output_format, request_units):
+    """
+    Adds a job and one pending task per request unit, unless the job is already queued.
+
+    :param request_units: List of (content, max_tokens) pairs, as from build_request_units.
+    :return: True if the job was added.
+    """
+    now = time.time()
+    with conn:
+        added = conn.execute(
+            "INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, NULL)",
+            (job_id, pdf_path, pdf_hash, json.dumps(prompt_set), output_format, len(request_units), now)
+        ).rowcount
+        if added:
+            conn.executemany(
+                "INSERT INTO tasks (job_id, page_num, content, max_tokens, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, page_num, content, max_tokens, now) for page_num, (content, max_tokens) in enumerate(request_units)]
+            )
+    return bool(added)
+
+def claim_task(conn, worker, lease_seconds=300, max_attempts=3):
+    """
+    Leases the next claimable task to a worker: a pending task, or a leased one whose worker stopped
+    sending heartbeats. Tasks whose lease expired after their last allowed attempt are marked failed.
+
+    :return: Task dict (with its job's prompt set and output format), or None if nothing is claimable.
+    """
+    now = time.time()
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers cannot claim the same task
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "UPDATE tasks SET status = 'failed', error = 'lease expired', worker = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+            (now, now, max_attempts)
+        )
+        row = conn.execute(
+            "SELECT tasks.job_id, tasks.page_num, tasks.content, tasks.max_tokens, tasks.attempts, "
+            "jobs.pdf_path, jobs.pdf_hash, jobs.prompt_set, jobs.output_format "
+            "FROM tasks JOIN jobs ON tasks.job_id = jobs.job_id "
+            "WHERE tasks.status = 'pending' OR (tasks.status = 'leased' AND tasks.lease_expires_at < ?) "
+            "ORDER BY tasks.status = 'leased', jobs.created_at, tasks.page_num LIMIT 1",
+            (now,)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND page_num = ?",
+                (worker, now + lease_seconds, now, row[0], row[1])
+            )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    if row is None:
+        return None
+    job_id, page_num, content, max_tokens, attempts, pdf_path, pdf_hash, prompt_set, output_format = row
+    return {'job_id': job_id, 'page_num': page_num, 'content': content, 'max_tokens': max_tokens, 'attempt': attempts + 1,
+            'pdf_path': pdf_path, 'pdf_hash': pdf_hash, 'prompt_set': json.loads(prompt_set), 'output_format': output_format}
+
+def heartbeat(conn, worker, lease_seconds=300):
+    """Extends the leases of every task a worker holds. Returns the number of leases extended."""
+    now = time.time()
+    with conn:
+        return conn.execute(
+            "UPDATE tasks SET lease_expires_at = ?, updated_at = ? WHERE status = 'leased' AND worker = ?",
+            (now + lease_seconds, now, worker)
+        ).rowcount
+
+def complete_task(conn, task, worker, response):
+    """
+    Stores a task's response. Returns False if the worker no longer held the lease
+    (it expired and the task went to another worker), in which case nothing is stored.
+    """
+    now = time.time()
+    with conn:
+        return conn.execute(
+            "UPDATE tasks SET status = 'done', response = ?, error = NULL, worker = NULL, lease_expires_at = NULL, "
+            "updated_at = ?, completed_at = ? WHERE job_id = ? AND page_num = ? AND status = 'leased' AND worker = ?",
+            (response, now, now, task['job_id'], task['page_num'], worker)
+        ).rowcount == 1
+
+def fail_task(conn, task, worker, error, max_attempts=3):
+    """Releases a task after a failed attempt: back to pending, or failed once it used max_attempts."""
+    status = 'failed' if task['attempt'] >= max_attempts else 'pending'
+    with conn:
+        conn.execute(
+            "UPDATE tasks SET status = ?, error = ?, worker = NULL, lease_expires_at = NULL, updated_at = ? "
+            "WHERE job_id = ? AND page_num = ? AND status = 'leased' AND worker = ?",
+            (status, error, time.time(), task['job_id'], task['page_num'], worker)
+        )
+    return status
+
+def retry_failed_tasks(conn):
+    """Puts failed tasks back in the queue with fresh attempts. Returns the number of tasks requeued."""
+    with conn:
+        requeued = conn.execute(
+            "UPDATE tasks SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'", (time.time(),)
+        ).rowcount
+        conn.execute("UPDATE jobs SET assembled_at = NULL WHERE job_id IN (SELECT job_id FROM tasks WHERE status = 'pending')")
+    return requeued
+
+def has_unsettled_tasks(conn):
+    """True while any task is pending or leased."""
+    return conn.execute("SELECT 1 FROM tasks WHERE status IN ('pending', 'leased') LIMIT 1").fetchone() is not None
+
+def iter_settled_jobs(conn):
+    """
+    Yields (job, responses) for every job that is not assembled yet and has no pending or leased
+    tasks left. responses is in page order, with None for failed tasks.
+    """
+    rows = conn.execute(
+        "SELECT job_id, pdf_path, pdf_hash, prompt_set, output_format, task_count FROM jobs WHERE assembled_at IS NULL "
+        "AND NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.job_id = jobs.job_id AND tasks.status IN ('pending', 'leased')) "
+        "ORDER BY created_at"
+    ).fetchall()
+    for job_id, pdf_path, pdf_hash, prompt_set, output_format, task_count in rows:
+        responses = [response for (response,) in conn.execute(
+            "SELECT response FROM tasks WHERE job_id = ? ORDER BY page_num", (job_id,)
+        )]
+        job = {'job_id': job_id, 'pdf_path': pdf_path, 'pdf_hash': pdf_hash, 'prompt_set': json.loads(prompt_set),
+               'output_format': output_format, 'task_count': task_count}
+        yield job, responses
+
+def mark_assembled(conn, job_id):
+    """Records that a job's output file has been written."""
+    with conn:
+        conn.execute("UPDATE jobs SET assembled_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+def queue_status(conn, window_seconds=300):
+    """
+    Summarises the queue.
+
+    :param window_seconds: Period over which the recent throughput is measured.
+    :return: Dict with task counts per status, job counts, per-worker leases and throughput figures.
+    """
+    now = time.time()
+    counts = dict.fromkeys(TASK_STATUSES, 0)
+    counts.update(conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+    jobs, assembled = conn.execute("SELECT COUNT(*), COUNT(assembled_at) FROM jobs").fetchone()
+    first_done, last_done = conn.execute("SELECT MIN(completed_at), MAX(completed_at) FROM tasks WHERE status = 'done'").fetchone()
+    recent = conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'done' AND completed_at >= ?", (now - window_seconds,)).fetchone()[0]
+    workers = dict(conn.execute(
+        "SELECT worker, COUNT(*) FROM tasks WHERE status = 'leased' AND lease_expires_at >= ? GROUP BY worker", (now,)
+    ).fetchall())
+    errors = conn.execute(
+        "SELECT error, COUNT(*) FROM tasks WHERE error IS NOT NULL AND status != 'done' GROUP BY error ORDER BY COUNT(*) DESC LIMIT 5"
+    ).fetchall()
+
+    # A queue younger than the window is measured over its own lifetime
+    window = min(window_seconds, now - first_done) if first_done is not None else window_seconds
+    recent_rate = recent / window if window > 0 else 0.0
+    overall_rate = counts['done'] / (last_done - first_done) if first_done is not None and last_done > first_done else None
+    remaining = counts['pending'] + counts['leased']
+    return {
+        'tasks': counts,
+        'jobs': jobs,
+        'assembled_jobs': assembled,
+        'active_workers': workers,
+        'recent_tasks_per_second': recent_rate,
+        'overall_tasks_per_second': overall_rate,
+        'eta_seconds': remaining / recent_rate if recent_rate and remaining else None,
+        'top_errors': errors,
+    }
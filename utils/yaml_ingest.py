@@ -0,0 +1,195 @@
+import re
+import yaml
+
+# libyaml's C loader when PyYAML was built with it, the pure-Python loader otherwise
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+ROLE_KEYS = ('systemRoleContent', 'userRoleContent', 'assistantRoleContent')
+ITEM_PATTERN = re.compile(r'( *)- (' + '|'.join(ROLE_KEYS) + r'):(.*)')
+DOUBLE_QUOTED_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"')
+SINGLE_QUOTED_PATTERN = re.compile(r"'((?:[^']|'')*)'")
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+# Characters the YAML reader rejects or treats as line breaks, and the byte order mark;
+# documents containing any of them are left to the YAML loader
+SPECIAL_CHARACTERS = re.compile('[^\x09\x0A\x20-\x7E\xA0-\uD7FF\uE000-\uFEFE\uFF00-\uFFFD\U00010000-\U0010FFFF]|[\u2028\u2029]')
+# Characters a plain scalar may not start with
+INDICATORS = '-?:,[]{}#&*!|>\'"%@`'
+
+_resolver = yaml.resolver.Resolver()
+
+def _plain_scalar(value):
+    if not value or value[0] in INDICATORS or '\t' in value or ' #' in value or ': ' in value or value.endswith(':'):
+        return None
+    # Only values the loader would read as strings; numbers, booleans, dates and nulls go to the loader
+    if _resolver.resolve(yaml.ScalarNode, value, (True, False)) != 'tag:yaml.org,2002:str':
+        return None
+    return value
+
+def _unescape(match):
+    return yaml.scanner.Scanner.ESCAPE_REPLACEMENTS.get(match.group(1), match.group(0))
+
+def _flow_scalar(value):
+    """Returns the string a one-line scalar stands for, or None if the parser does not handle it."""
+    if value.startswith('"'):
+        match = DOUBLE_QUOTED_PATTERN.fullmatch(value)
+        if match is None:
+            return None
+        text = match.group(1)
+        # Hex and unicode escapes (\x, \u, \U) are left to the loader
+        if any(escape not in yaml.scanner.Scanner.ESCAPE_REPLACEMENTS for escape in re.findall(r'\\(.)', text)):
+            return None
+        return ESCAPE_PATTERN.sub(_unescape, text)
+    if value.startswith("'"):
+        match = SINGLE_QUOTED_PATTERN.fullmatch(value)
+        return match.group(1).replace("''", "'") if match else None
+    return _plain_scalar(value)
+
+def _literal_block(lines, start, min_indent, chomping):
+    """
+    Reads a literal block scalar (| with clip, strip or keep chomping) starting at lines[start].
+
+    :return: (text, index of the first line after the block), or (None, start) if the parser does not handle it.
+    """
+    first = start
+    while first < len(lines) and lines[first] == '\n':
+        first += 1
+    if first == len(lines) or not lines[first].strip(' \n'):
+        return None, start
+    indent = len(lines[first]) - len(lines[first].lstrip(' '))
+    if indent < min_indent:
+        return None, start
+
+    parts = ['\n'] * (first - start)
+    pending_breaks = []
+    line_break = ''
+    position = first
+    while position < len(lines):
+        line = lines[position]
+        text = line.rstrip('\n')
+        if len(text) <= indent and not text.strip(' '):
+            # An empty line only becomes part of the text if more content follows (or with keep chomping)
+            if line.endswith('\n'):
+                pending_breaks.append('\n')
+            position += 1
+            continue
+        if not text.startswith(' ' * indent):
+            break
+        if position > first:
+            parts.append(line_break)
+        parts.extend(pending_breaks)
+        pending_breaks = []
+        parts.append(text[indent:])
+        line_break = '\n' if line.endswith('\n') else ''
+        position += 1
+
+    if chomping != '-':
+        parts.append(line_break)
+    if chomping == '+':
+        parts.extend(pending_breaks)
+    return ''.join(parts), position
+
+def parse_thread_object(lines):
+    """
+    Parses one cleaned threadObject document without the YAML loader.
+
+    Only the shape process_pdf.py asks the model for is handled: a top-level threadObject holding a
+    sequence of systemRoleContent/userRoleContent/assistantRoleContent entries, each a one-line plain
+    or quoted string or a literal (|) block. Anything else returns None, so callers can fall back to
+    the loader, which also keeps the result identical to what yaml.safe_load would return.
+
+    :param lines: Cleaned lines of one document, with line endings.
+    :return: The parsed document, or None if it must go through the YAML loader.
+    """
+    if any(SPECIAL_CHARACTERS.search(line) for line in lines):
+        return None
+
+    position = 0
+    while position < len(lines) and not lines[position].strip(' \n'):
+        position += 1
+    if position == len(lines) or lines[position].rstrip(' \n') != 'threadObject:':
+        return None
+    position += 1
+
+    items = []
+    item_indent = None
+    while position < len(lines):
+        line = lines[position].rstrip('\n')
+        if not line.strip(' '):
+            position += 1
+            continue
+        match = ITEM_PATTERN.fullmatch(line)
+        if match is None:
+            return None
+        indent, key, rest = len(match.group(1)), match.group(2), match.group(3)
+        if item_indent is None:
+            item_indent = indent
+        if indent != item_indent or (rest and not rest.startswith(' ')):
+            return None
+
+        value = rest.strip(' ')
+        if value in ('|', '|-', '|+'):
+            # Block content must be indented past the key, which sits two columns after the dash
+            text, position = _literal_block(lines, position + 1, item_indent + 3, value[1:])
+        else:
+            text = _flow_scalar(value)
+            position += 1
+        if text is None:
+            return None
+        items.append({key: text})
+
+    return {'threadObject': items} if items else None
+
+def split_document_lines(lines):
+    """Groups lines into per-document lists, splitting on '---' delimiter lines."""
+    document_lines = []
+    for line in lines:
+        if line.startswith('---') and line[3:].strip() == '':
+            yield document_lines
+            document_lines = []
+        else:
+            document_lines.append(line)
+    yield document_lines
+
+def load_documents(lines):
+    """
+    Returns what yaml.safe_load_all would return for a cleaned YAML file.
+
+    Documents with the threadObject shape are parsed by parse_thread_object and the rest are loaded
+    one by one with the YAML loader. Files with directives, '...' markers or documents that do not
+    load on their own are handed to the loader as a whole instead.
+
+    :param lines: List of cleaned YAML lines, with line endings.
+    :return: (list of documents, number of documents the fast parser handled)
+    """
+    documents = []
+    fast_count = 0
+    for document_num, document_lines in enumerate(split_document_lines(lines)):
+        if not any(line.strip(' \n') for line in document_lines):
+            # An explicit '---' starts a document even if it is empty; the implicit first one does not
+            if document_num > 0:
+                documents.append(None)
+            continue
+        data = parse_thread_object(document_lines)
+        if data is not None:
+            fast_count += 1
+            documents.append(data)
+            continue
+
+        if any(line.startswith(('%', '---', '...')) for line in document_lines):
+            return list(yaml.load_all(''.join(lines), Loader=SafeLoader)), 0
+        try:
+            data = yaml.load(''.join(document_lines), Loader=SafeLoader)
+        except yaml.YAMLError:
+            return list(yaml.load_all(''.join(lines), Loader=SafeLoader)), 0
+        if data is None and document_num == 0:
+            # A comment-only first document is no document at all to load_all; let it decide
+            return list(yaml.load_all(''.join(lines), Loader=SafeLoader)), 0
+        documents.append(data)
+    return documents, fast_count
+
+def load_document(document):
+    """Returns what yaml.safe_load would return for one cleaned YAML document (a string)."""
+    data = parse_thread_object(document.splitlines(keepends=True)) if document.strip(' \n') else None
+    if data is None:
+        return yaml.load(document, Loader=SafeLoader)
+    return data